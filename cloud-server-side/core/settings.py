@@ -50,6 +50,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'knowledge.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -81,6 +82,11 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Web requests and ingestion workers write concurrently
+        'OPTIONS': {
+            'timeout': 20,
+            'init_command': 'PRAGMA journal_mode=WAL;',
+        },
     }
 }
 
@@ -130,6 +136,95 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 10
 }
 
+# Knowledge pipeline configuration
+# Embedding model of courses that do not declare their own (Course.embedding_models)
+KNOWLEDGE_EMBEDDING_MODEL = 'exp-models/dragonkue-KoEn-E5-Tiny-ONNX'
+# Load the shared embedding model (tokenizer and ONNX session) in a background thread when a
+# server process starts, instead of on its first upload. Management commands and tests skip it
+KNOWLEDGE_WARMUP_ON_STARTUP = True
+# Texts per ONNX session.run call; texts are grouped by token length before batching
+KNOWLEDGE_EMBEDDING_BATCH_SIZE = 32
+# ONNX Runtime execution profile of the embedding session (knowledge.services.ONNX_PROFILES):
+# 'default' (ONNX Runtime defaults), 'optimized' (threads split between ingestion workers, full
+# graph optimization saved under pretrained_models/ort-optimized/) or 'int8' ('optimized' on an
+# int8 x86 model, produced by dynamic quantization if the model ships none)
+KNOWLEDGE_ONNX_PROFILE = 'optimized'
+# Thread counts for the tuned profiles (None = CPU cores / ingestion workers intra-op, 1 inter-op)
+KNOWLEDGE_ONNX_INTRA_OP_THREADS = None
+KNOWLEDGE_ONNX_INTER_OP_THREADS = None
+# Processes embedding in parallel, each with its own ONNX session (0 = embed in the calling
+# process); vectors come back through shared memory. Use one per core for bulk ingestion
+KNOWLEDGE_EMBEDDING_PROCESSES = 0
+# Chunk rows per bulk INSERT; a document's chunks are always stored in one transaction
+KNOWLEDGE_CHUNK_BULK_BATCH_SIZE = 500
+# Chunking: 'tokens' sizes chunks in tokens of the embedding model's tokenizer,
+# 'characters' uses LangChain's RecursiveCharacterTextSplitter (400/120 characters)
+KNOWLEDGE_CHUNKER = 'tokens'
+KNOWLEDGE_CHUNK_TOKENS = 128
+KNOWLEDGE_CHUNK_OVERLAP_TOKENS = 32
+# Batches buffered between the streaming ingestion stages (parse/chunk -> embed -> store)
+KNOWLEDGE_PIPELINE_QUEUE_SIZE = 4
+# Max cached chunk embeddings (least recently used are evicted); 0 disables the cache
+KNOWLEDGE_EMBEDDING_CACHE_SIZE = 200000
+# Default handling of re-uploaded files: 'reuse' (copy the earlier upload's chunks),
+# 'reject' (409) or 'ingest'; uploads can override it with the on_duplicate field
+KNOWLEDGE_DUPLICATE_UPLOADS = 'reuse'
+# PDF text extraction: page ranges of at least KNOWLEDGE_PDF_PAGES_PER_TASK pages are
+# extracted by up to KNOWLEDGE_PDF_WORKERS processes (None = one per CPU core)
+KNOWLEDGE_PDF_WORKERS = None
+KNOWLEDGE_PDF_PAGES_PER_TASK = 16
+# Ingestion job queue: worker threads started inside the web process on the first upload
+# (set to 0 and run `manage.py run_ingestion_workers` to process jobs in a separate process)
+KNOWLEDGE_INGESTION_LOCAL_WORKERS = 2
+KNOWLEDGE_INGESTION_POLL_INTERVAL = 2.0
+KNOWLEDGE_INGESTION_MAX_ATTEMPTS = 3
+# Running jobs without a heartbeat for this many seconds are re-queued
+KNOWLEDGE_INGESTION_STALE_AFTER = 300
+# Re-embedding jobs (`manage.py reembed`, /api/knowledge/reembeddings/) run on idle ingestion
+# workers in batches of this many chunks, each committed with the job's checkpoint
+KNOWLEDGE_REEMBED_BATCH_SIZE = 256
+# Optional cap on re-embedding throughput (chunks per second) to leave CPU for live uploads
+KNOWLEDGE_REEMBED_MAX_CHUNKS_PER_SECOND = None
+
+# Prebuilt knowledge-base snapshots, one file per course content version and precision
+KNOWLEDGE_SNAPSHOT_DIR = BASE_DIR / 'snapshots'
+
+# Courses whose normalized vector matrices are kept in memory for server-side search
+KNOWLEDGE_SEARCH_CACHE_COURSES = 16
+# IVF approximate nearest-neighbour index, trained per course once it has this many chunks,
+# retrained when it grows past KNOWLEDGE_ANN_RETRAIN_GROWTH times the training size
+KNOWLEDGE_ANN_MIN_CHUNKS = 5000
+KNOWLEDGE_ANN_RETRAIN_GROWTH = 2.0
+# IVF lists scanned per query (server search default, also recorded in snapshots)
+KNOWLEDGE_ANN_NPROBE = 8
+
+# Request and job profiling (knowledge.profiling): staff users profile a request with the
+# X-Knowledge-Profile header; these rates profile a random share of requests to
+# KNOWLEDGE_PROFILING_PATHS (uploads and exports by default) and of ingestion jobs
+KNOWLEDGE_PROFILING_SAMPLE_RATE = 0.0
+KNOWLEDGE_PROFILING_JOB_SAMPLE_RATE = 0.0
+# 'sampling' (stack samples every KNOWLEDGE_PROFILING_INTERVAL seconds) or 'cprofile'
+KNOWLEDGE_PROFILING_MODE = 'sampling'
+KNOWLEDGE_PROFILING_INTERVAL = 0.005
+# Saved profiles (browsable in the admin); only the newest KNOWLEDGE_PROFILE_KEEP are kept
+KNOWLEDGE_PROFILE_DIR = BASE_DIR / 'profiles'
+KNOWLEDGE_PROFILE_KEEP = 200
+
+# Pipeline logs are JSON lines (event plus structured fields); metrics are served at /metrics
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'structured': {'()': 'knowledge.log.StructuredFormatter'},
+    },
+    'handlers': {
+        'knowledge_console': {'class': 'logging.StreamHandler', 'formatter': 'structured'},
+    },
+    'loggers': {
+        'knowledge': {'handlers': ['knowledge_console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
 # CORS Configuration
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
@@ -22,6 +22,8 @@ from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
+from knowledge.views import metrics_view
+
 # Swagger schema view
 schema_view = get_schema_view(
     openapi.Info(
@@ -39,6 +41,7 @@ schema_view = get_schema_view(
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/knowledge/', include('knowledge.urls')),
+    path('metrics', metrics_view, name='metrics'),
     
     # Swagger documentation
     re_path(r'^swagger(?P<format>\.json|\.yaml)$', schema_view.without_ui(cache_timeout=0), name='schema-json'),
@@ -1,10 +1,23 @@
+import json
+
 from django.contrib import admin
-from .models import Course, Document, Chunk
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.http import FileResponse, Http404
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html
+from .models import (
+    Course, Document, Chunk, ChunkEmbedding, IngestionJob, ReembeddingJob, VectorIndex, EmbeddingCacheEntry,
+    RequestProfile
+)
+from .profiling import profile_dir
+from .services import LexicalSearchService
 
 
 @admin.register(Course)
 class CourseAdmin(admin.ModelAdmin):
-    list_display = ['code', 'name', 'created_at']
+    list_display = ['code', 'name', 'embedding_models', 'created_at']
     search_fields = ['code', 'name']
 
 
@@ -20,3 +33,110 @@ class ChunkAdmin(admin.ModelAdmin):
     list_display = ['id', 'document', 'chunk_index', 'created_at']
     search_fields = ['document__title', 'text']
     list_filter = ['document']
+    
+    def get_search_results(self, request, queryset, search_term):
+        # Search chunk text through the FTS5 index instead of a LIKE scan
+        if not search_term or not LexicalSearchService.available():
+            return super().get_search_results(request, queryset, search_term)
+        if not LexicalSearchService.match_expression(search_term):
+            return queryset.filter(document__title__icontains=search_term), False
+        sql, params = LexicalSearchService.matching_ids_sql(search_term)
+        return queryset.filter(
+            Q(pk__in=RawSQL(sql, params)) | Q(document__title__icontains=search_term)
+        ), False
+
+
+@admin.register(ChunkEmbedding)
+class ChunkEmbeddingAdmin(admin.ModelAdmin):
+    list_display = ['chunk', 'embedding_model']
+    list_filter = ['embedding_model']
+    raw_id_fields = ['chunk']
+    exclude = ['vector']
+
+
+@admin.register(IngestionJob)
+class IngestionJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'document', 'status', 'stage', 'chunks_stored', 'chunks_total', 'cache_hits', 'attempts', 'created_at']
+    list_filter = ['status', 'stage', 'profile']
+    search_fields = ['document__title']
+
+
+@admin.register(ReembeddingJob)
+class ReembeddingJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'course', 'embedding_model', 'status', 'chunks_done', 'chunks_total', 'cache_hits',
+                    'swapped_at', 'created_at']
+    list_filter = ['status', 'embedding_model']
+    search_fields = ['course__code']
+
+
+@admin.register(VectorIndex)
+class VectorIndexAdmin(admin.ModelAdmin):
+    list_display = ['course', 'embedding_model', 'nlist', 'dimension', 'trained_chunk_count', 'created_at']
+    list_filter = ['embedding_model']
+    exclude = ['centroids']
+
+
+@admin.register(EmbeddingCacheEntry)
+class EmbeddingCacheEntryAdmin(admin.ModelAdmin):
+    list_display = ['text_hash', 'embedding_model', 'last_used_at', 'created_at']
+    list_filter = ['embedding_model']
+    search_fields = ['text_hash']
+    exclude = ['vector']
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    """Read-only browser for saved profiles (see knowledge.profiling)"""
+    list_display = ['created_at', 'label', 'status_code', 'duration_ms', 'query_count', 'query_ms',
+                    'onnx_calls', 'onnx_ms', 'mode', 'user']
+    list_filter = ['kind', 'mode']
+    search_fields = ['label', 'user']
+    fields = ['label', 'kind', 'mode', 'status_code', 'user', 'duration_ms', 'query_count', 'query_ms',
+              'onnx_calls', 'onnx_ms', 'created_at', 'download', 'queries', 'report']
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        return [
+            path('<int:pk>/raw/', self.admin_site.admin_view(self.raw_view), name='knowledge_requestprofile_raw'),
+        ] + super().get_urls()
+
+    def raw_view(self, request, pk):
+        """Download the .prof (snakeviz, pstats) or .folded (flamegraph, speedscope) file"""
+        profile = get_object_or_404(RequestProfile, pk=pk)
+        file_path = profile_dir() / profile.raw_file
+        if not file_path.is_file():
+            raise Http404("Profile file is gone")
+        return FileResponse(open(file_path, 'rb'), as_attachment=True, filename=profile.raw_file)
+
+    def _saved(self, obj):
+        try:
+            return json.loads((profile_dir() / f"{obj.name}.json").read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return {}
+
+    @admin.display(description='Raw profile')
+    def download(self, obj):
+        return format_html('<a href="{}">{}</a>', reverse('admin:knowledge_requestprofile_raw', args=[obj.pk]), obj.raw_file)
+
+    @admin.display(description='Queries')
+    def queries(self, obj):
+        saved = self._saved(obj)
+        lines = ['Slowest:']
+        lines += [f"  {query['ms']:8.2f} ms  {query['sql']}" for query in saved.get('slowest_queries', [])]
+        lines += ['', 'Repeated:']
+        lines += [f"  {query['count']:6d} x  {query['sql']}" for query in saved.get('repeated_queries', [])]
+        return format_html('<pre style="white-space: pre-wrap">{}</pre>', '\n'.join(lines))
+
+    @admin.display(description='Report')
+    def report(self, obj):
+        saved = self._saved(obj)
+        text = saved.get('report', 'Report file is gone')
+        if saved.get('note'):
+            text = f"{saved['note']}\n\n{text}"
+        return format_html('<pre>{}</pre>', text)
@@ -1,5 +1,44 @@
+import logging
+import os
+import sys
+import threading
+
 from django.apps import AppConfig
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _serves_requests() -> bool:
+    """
+    Whether this process serves requests: a WSGI/ASGI server or the runserver
+    child, not the autoreloader parent, a test run or another management command
+    """
+    if 'pytest' in sys.modules:
+        return False
+    if len(sys.argv) > 1 and sys.argv[0].endswith('manage.py'):
+        return sys.argv[1] == 'runserver' and os.environ.get('RUN_MAIN') == 'true'
+    return True
+
+
+def _warm_up():
+    from .services import EmbeddingService
+    try:
+        for service in EmbeddingService.warm_up():
+            service.embed_array(["warm-up"])
+    except Exception:
+        # The first upload loads the model instead (and reports the error)
+        logger.warning("embedding warm-up failed", exc_info=True)
 
 
 class KnowledgeConfig(AppConfig):
     name = 'knowledge'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+
+        if not getattr(settings, 'KNOWLEDGE_WARMUP_ON_STARTUP', True) or not _serves_requests():
+            return
+        # In the background, so startup is not held up by a model download;
+        # an upload arriving meanwhile waits for the same load (get_shared)
+        threading.Thread(target=_warm_up, name='embedding-warm-up', daemon=True).start()
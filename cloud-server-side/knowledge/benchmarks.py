@@ -0,0 +1,735 @@
+"""
+Benchmarks for the ingestion pipeline.
+
+Each benchmark returns a dict of measurements so results can be printed
+or saved by the `benchmark` management command.
+"""
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import List
+
+import numpy as np
+
+from django.conf import settings
+
+from .models import Course, Document, Chunk
+from .services import (
+    ONNX_PROFILES, CharacterSplitter, ChunkingService, ChunkStorageService, DocumentParsingService, EmbeddingService,
+    TokenBudgetSplitter, VectorIndexService, VectorQuantizationService, VectorSearchService
+)
+
+
+def _synthetic_chunks(rows: int, dim: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    texts = [f"Synthetic chunk {idx} " + "lorem ipsum dolor sit amet " * 12 for idx in range(rows)]
+    vectors = rng.standard_normal((rows, dim)).astype(np.float32)
+    return texts, vectors
+
+
+def _scratch_document():
+    """Create a throwaway course and document; deleting the course removes everything"""
+    tag = uuid.uuid4().hex[:8]
+    course = Course.objects.create(code=f"BENCH-{tag}", name="Benchmark scratch course")
+    document = Document.objects.create(course=course, title=f"benchmark-{tag}", file=f"documents/benchmark-{tag}.txt")
+    return course, document
+
+
+# Scratch table with the columns and indexes of the original Chunk model,
+# whose vector was a JSONField
+_BASELINE_CHUNK_TABLE = 'knowledge_benchmark_json_chunk'
+
+
+def _per_row_json_seconds(document, texts: List[str], vectors: np.ndarray, model_name: str) -> float:
+    """
+    Time the original write path: one autocommitted INSERT per chunk, the
+    vector serialized as JSON text, into a scratch copy of the original
+    chunk table (no FTS triggers, as then)
+    """
+    from django.db import connection
+    from django.utils import timezone
+
+    table = _BASELINE_CHUNK_TABLE
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+        cursor.execute(f"""
+            CREATE TABLE {table} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                document_id INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                chunk_index INTEGER NOT NULL,
+                vector TEXT NOT NULL,
+                embedding_model VARCHAR(100) NOT NULL,
+                created_at DATETIME NOT NULL
+            )
+        """)
+        cursor.execute(f"CREATE INDEX {table}_document ON {table} (document_id)")
+        cursor.execute(f"CREATE INDEX {table}_document_chunk ON {table} (document_id, chunk_index)")
+    try:
+        insert_sql = (
+            f"INSERT INTO {table} (document_id, text, chunk_index, vector, embedding_model, created_at) "
+            f"VALUES (%s, %s, %s, %s, %s, %s)"
+        )
+        start = time.perf_counter()
+        for idx, (text, vector) in enumerate(zip(texts, vectors)):
+            with connection.cursor() as cursor:
+                cursor.execute(insert_sql, [
+                    document.pk, text, idx, json.dumps(vector.tolist()), model_name, timezone.now()
+                ])
+        return time.perf_counter() - start
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+
+
+def benchmark_persistence(rows: int = 2000, dim: int = 384, batch_size: int = None) -> dict:
+    """
+    Compare the original per-row write path (one autocommitted INSERT per
+    chunk, JSON vectors) against ChunkStorageService.store_chunks (bulk_create
+    of binary vectors in one transaction). Each variant writes a fresh
+    document, so neither pays for deleting the other's rows.
+    """
+    texts, vectors = _synthetic_chunks(rows, dim)
+    model_name = "benchmark-model"
+    course, document = _scratch_document()
+    try:
+        per_row_seconds = _per_row_json_seconds(document, texts, vectors, model_name)
+
+        bulk_document = Document.objects.create(
+            course=course, title=f"{document.title}-bulk", file=document.file.name
+        )
+        start = time.perf_counter()
+        ChunkStorageService.store_chunks(bulk_document, texts, vectors, model_name, batch_size=batch_size)
+        bulk_seconds = time.perf_counter() - start
+    finally:
+        course.delete()
+
+    return {
+        'stage': 'persistence',
+        'rows': rows,
+        'dim': dim,
+        'per_row_seconds': round(per_row_seconds, 4),
+        'per_row_rows_per_sec': round(rows / per_row_seconds, 1),
+        'bulk_seconds': round(bulk_seconds, 4),
+        'bulk_rows_per_sec': round(rows / bulk_seconds, 1),
+        'speedup': round(per_row_seconds / bulk_seconds, 2),
+    }
+
+
+def _clustered_vectors(rows: int, dim: int, clusters: int = 50, seed: int = 0):
+    """Vectors grouped around random centers, closer to real embeddings than pure noise"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, rows)
+    return centers[labels] + 0.6 * rng.standard_normal((rows, dim)).astype(np.float32)
+
+
+def benchmark_quantization(rows: int = 2000, dim: int = 384, queries: int = 100, k: int = 10,
+                           course_id: int = None) -> dict:
+    """
+    Recall@k of each export precision against float32 brute force, plus bytes
+    per vector. Uses the vectors of course_id if given, else synthetic ones.
+    """
+    if course_id is not None:
+        vectors = np.vstack(list(
+            Chunk.objects.filter(document__course_id=course_id).values_list('vector', flat=True)
+        ))
+    else:
+        vectors = _clustered_vectors(rows, dim)
+    rng = np.random.default_rng(1)
+    sample = rng.choice(len(vectors), size=min(queries, len(vectors)), replace=False)
+    query_vectors = vectors[sample] + 0.3 * rng.standard_normal((len(sample), vectors.shape[1])).astype(np.float32)
+
+    exact = [VectorQuantizationService.search(query, vectors, 'float32', k) for query in query_vectors]
+
+    result = {'stage': 'quantization', 'rows': len(vectors), 'dim': vectors.shape[1], 'queries': len(sample), 'k': k}
+    for precision in VectorQuantizationService.PRECISIONS:
+        encoded = VectorQuantizationService.encode(vectors[:1], precision)[0]
+        size = sum(len(value) if isinstance(value, (bytes, str)) else 4 for value in encoded)
+
+        hits = 0
+        for query, expected in zip(query_vectors, exact):
+            approx = VectorQuantizationService.search(query, vectors, precision, k)
+            hits += len(np.intersect1d(expected, approx))
+        result[f'{precision}_bytes_per_vector'] = size
+        result[f'{precision}_recall_at_{k}'] = round(hits / (k * len(query_vectors)), 4)
+    return result
+
+
+def benchmark_ann(rows: int = 20000, dim: int = 384, queries: int = 200, k: int = 10,
+                  course_id: int = None) -> dict:
+    """
+    IVF index build time, query latency and recall@k against brute-force
+    cosine search, for several nprobe values.
+    """
+    if course_id is not None:
+        vectors = np.vstack(list(
+            Chunk.objects.filter(document__course_id=course_id).values_list('vector', flat=True)
+        ))
+    else:
+        vectors = _clustered_vectors(rows, dim, clusters=max(50, rows // 200))
+    matrix = VectorSearchService.normalize(vectors)
+    rng = np.random.default_rng(1)
+    sample = rng.choice(len(matrix), size=min(queries, len(matrix)), replace=False)
+    query_vectors = VectorSearchService.normalize(
+        matrix[sample] + 0.05 * rng.standard_normal((len(sample), matrix.shape[1])).astype(np.float32)
+    )
+
+    start = time.perf_counter()
+    exact = [VectorSearchService.top_k(matrix @ query, k) for query in query_vectors]
+    brute_ms = 1000 * (time.perf_counter() - start) / len(query_vectors)
+
+    nlist = VectorIndexService.default_nlist(len(matrix))
+    start = time.perf_counter()
+    centroids = VectorIndexService.train(matrix, nlist)
+    order, offsets = VectorIndexService.inverted_lists(VectorIndexService.assign(matrix, centroids), len(centroids))
+    build_seconds = time.perf_counter() - start
+
+    result = {
+        'stage': 'ann', 'rows': len(matrix), 'dim': matrix.shape[1], 'queries': len(sample), 'k': k,
+        'nlist': len(centroids), 'build_seconds': round(build_seconds, 3),
+        'brute_force_ms_per_query': round(brute_ms, 3),
+    }
+    for nprobe in (1, 4, 8, 16, 32):
+        if nprobe > len(centroids):
+            break
+        hits = 0
+        start = time.perf_counter()
+        for query, expected in zip(query_vectors, exact):
+            found = VectorIndexService.search(query, matrix, centroids, order, offsets, k=k, nprobe=nprobe)
+            hits += len(np.intersect1d(expected, found))
+        elapsed_ms = 1000 * (time.perf_counter() - start) / len(query_vectors)
+        result[f'nprobe_{nprobe}_recall_at_{k}'] = round(hits / (k * len(query_vectors)), 4)
+        result[f'nprobe_{nprobe}_ms_per_query'] = round(elapsed_ms, 3)
+    return result
+
+
+def _synthetic_corpus(paragraphs: int, seed: int = 0, korean: bool = True) -> str:
+    """
+    Paragraphs of English prose, Korean text and numeric tables, whose
+    characters-per-token differ. Without korean, those paragraphs are English
+    too (for the Latin-1-only synthetic PDFs).
+    """
+    rng = np.random.default_rng(seed)
+    english = ("the cell uses light energy to turn water and carbon dioxide into glucose and oxygen "
+               "while enzymes in the membrane move protons along a gradient").split()
+    syllables = [chr(code) for code in range(0xAC00, 0xAC00 + 400)]
+    result = []
+    for idx in range(paragraphs):
+        count = int(rng.integers(10, 120))
+        if idx % 3 == 0 or (idx % 3 == 1 and not korean):
+            words = [english[j] for j in rng.integers(0, len(english), count)]
+        elif idx % 3 == 1:
+            words = ["".join(syllables[j] for j in rng.integers(0, len(syllables), int(rng.integers(1, 4))))
+                     for _ in range(count)]
+        else:
+            words = [f"{rng.integers(0, 99999)}.{rng.integers(0, 99)}" for _ in range(count)]
+        sentences = [" ".join(words[start:start + 15]) for start in range(0, len(words), 15)]
+        result.append(". ".join(sentences) + ".")
+    return "\n\n".join(result)
+
+
+def _chunk_stats(prefix: str, lengths: np.ndarray, batch_size: int) -> dict:
+    """Token-length spread and the padding embed_array would add (length-sorted groups of 8 batches)"""
+    padded = 0
+    step = batch_size * 8
+    for start in range(0, len(lengths), step):
+        group = np.sort(lengths[start:start + step])
+        padded += sum(int(group[i:i + batch_size].max()) * len(group[i:i + batch_size])
+                      for i in range(0, len(group), batch_size))
+    return {
+        f'{prefix}_chunks': len(lengths),
+        f'{prefix}_tokens_mean': round(float(lengths.mean()), 1),
+        f'{prefix}_tokens_std': round(float(lengths.std()), 1),
+        f'{prefix}_tokens_cv': round(float(lengths.std() / lengths.mean()), 3),
+        f'{prefix}_tokens_max': int(lengths.max()),
+        f'{prefix}_padding_fraction': round(1 - float(lengths.sum()) / padded, 3),
+    }
+
+
+def benchmark_chunking(rows: int = 2000, course_id: int = None, model: str = None, chunk_tokens: int = None,
+                       overlap_tokens: int = None) -> dict:
+    """
+    Speed and chunk token-length spread of the token-budget splitter against
+    LangChain's RecursiveCharacterTextSplitter (400/120 characters), on rows
+    synthetic paragraphs or the text of course_id's chunks. Lengths are in
+    tokens of the embedding model, special tokens included.
+
+    model is an embedding model name or local directory; by default the
+    tiny encoder of benchmark_ingestion, whose tokenizer is trained on the
+    synthetic corpus.
+    """
+    if course_id is not None:
+        text = "\n\n".join(
+            Chunk.objects.filter(document__course_id=course_id).order_by('document_id', 'chunk_index')
+            .values_list('text', flat=True)
+        )
+    else:
+        text = _synthetic_corpus(rows)
+
+    if model is None:
+        model = build_tiny_embedding_model(TINY_MODEL_DIR)
+    embedding_service = EmbeddingService(model)
+    tokens_splitter = TokenBudgetSplitter(
+        embedding_service.tokenizer,
+        chunk_size=chunk_tokens or getattr(settings, 'KNOWLEDGE_CHUNK_TOKENS', 128),
+        chunk_overlap=overlap_tokens or getattr(settings, 'KNOWLEDGE_CHUNK_OVERLAP_TOKENS', 32)
+    )
+    batch_size = getattr(settings, 'KNOWLEDGE_EMBEDDING_BATCH_SIZE', 32)
+    model_limit = 512
+
+    result = {
+        'stage': 'chunking', 'characters': len(text), 'model': embedding_service.model_name,
+        'chunk_tokens': tokens_splitter.chunk_size, 'overlap_tokens': tokens_splitter.chunk_overlap,
+    }
+    for prefix, splitter in (('langchain', CharacterSplitter()), ('token_budget', tokens_splitter)):
+        start = time.perf_counter()
+        chunks = [chunk for chunk, _ in splitter.split(text)]
+        seconds = time.perf_counter() - start
+        lengths = np.array([
+            len(encoding.ids) for encoding in tokens_splitter.tokenizer.encode_batch(chunks)
+        ])
+        result[f'{prefix}_seconds'] = round(seconds, 4)
+        result[f'{prefix}_mb_per_sec'] = round(len(text) / seconds / 1e6, 2)
+        result.update(_chunk_stats(prefix, lengths, batch_size))
+        result[f'{prefix}_over_{model_limit}_tokens'] = int((lengths > model_limit).sum())
+    return result
+
+
+class _PeakRSS:
+    """
+    Peak resident set size of this process while the block runs, sampled on
+    a background thread (Linux /proc; elsewhere the process-lifetime peak).
+    Memory of PDF worker processes is not included.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.start_bytes = self.peak_bytes = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def current() -> int:
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, AttributeError):
+            import resource
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # kilobytes on Linux, bytes on macOS
+            return peak if sys.platform == 'darwin' else peak * 1024
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak_bytes = max(self.peak_bytes, self.current())
+
+    def __enter__(self):
+        self.start_bytes = self.peak_bytes = self.current()
+        self._thread = threading.Thread(target=self._sample, name='benchmark-rss', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak_bytes = max(self.peak_bytes, self.current())
+
+    @property
+    def peak_mb(self) -> float:
+        return round(self.peak_bytes / 2 ** 20, 1)
+
+    @property
+    def growth_mb(self) -> float:
+        return round((self.peak_bytes - self.start_bytes) / 2 ** 20, 1)
+
+
+def _measure(result: dict, prefix: str, repeat: int, func, *args, **kwargs):
+    """
+    Run func repeat times, recording the fastest run as {prefix}_seconds and
+    the peak RSS over all runs in result; returns (value, seconds).
+    """
+    seconds = float('inf')
+    with _PeakRSS() as rss:
+        for _ in range(max(1, repeat)):
+            start = time.perf_counter()
+            value = func(*args, **kwargs)
+            seconds = min(seconds, time.perf_counter() - start)
+    result[f'{prefix}_seconds'] = round(seconds, 4)
+    result[f'{prefix}_peak_rss_mb'] = rss.peak_mb
+    result[f'{prefix}_rss_growth_mb'] = rss.growth_mb
+    return value, seconds
+
+
+def _synthetic_pages(count: int, seed: int = 0) -> List[str]:
+    """count pages of about 3,000 characters of English prose and numeric tables"""
+    return [_synthetic_corpus(8, seed=seed + page, korean=False) for page in range(count)]
+
+
+def _write_pdf(path, pages: List[str], line_chars: int = 100, lines_per_page: int = 60):
+    """
+    Minimal PDF with one Helvetica text page per page (overflowing lines
+    continue on extra pages). Written by hand so no PDF library is needed
+    and the file is identical across runs.
+    """
+    import textwrap
+
+    streams = []
+    for text in pages:
+        lines = []
+        for paragraph in text.split("\n\n"):
+            lines.extend(textwrap.wrap(paragraph, line_chars) + [''])
+        for start in range(0, len(lines), lines_per_page):
+            shown = ''.join(
+                '(' + line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)') + ") '\n"
+                for line in lines[start:start + lines_per_page]
+            )
+            streams.append(f"BT /F1 9 Tf 12 TL 36 768 Td\n{shown}ET".encode('latin-1'))
+
+    # Objects: 1 catalog, 2 page tree, 3 font, then a (page, content) pair per page
+    first_page = 4
+    kids = ' '.join(f"{first_page + 2 * idx} 0 R" for idx in range(len(streams)))
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{kids}] /Count {len(streams)} >>".encode(),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    ]
+    for idx, stream in enumerate(streams):
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> "
+            f"/Contents {first_page + 2 * idx + 1} 0 R >>".encode()
+        )
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n".encode() + stream + b"\nendstream")
+
+    with open(path, 'wb') as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(f.tell())
+            f.write(f"{number} 0 obj\n".encode() + body + b"\nendobj\n")
+        xref = f.tell()
+        f.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+        f.write(''.join(f"{offset:010d} 00000 n \n" for offset in offsets).encode())
+        f.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+
+
+def _write_docx(path, pages: List[str]):
+    """Minimal DOCX (one paragraph per text paragraph, page breaks between pages), written with zipfile"""
+    import zipfile
+    from xml.sax.saxutils import escape
+
+    namespace = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+    page_break = '<w:p><w:r><w:br w:type="page"/></w:r></w:p>'
+    body = page_break.join(
+        ''.join(f'<w:p><w:r><w:t xml:space="preserve">{escape(paragraph)}</w:t></w:r></w:p>'
+                for paragraph in text.split("\n\n"))
+        for text in pages
+    )
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/word/document.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+            '</Types>'
+        ))
+        archive.writestr('_rels/.rels', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Target="word/document.xml" '
+            'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+            '</Relationships>'
+        ))
+        archive.writestr('word/document.xml', (
+            f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            f'<w:document xmlns:w="{namespace}"><w:body>{body}</w:body></w:document>'
+        ))
+
+
+def build_tiny_embedding_model(directory, dim: int = 384, layers: int = 2, vocab_size: int = 4000,
+                               seed: int = 0) -> str:
+    """
+    Write a small random-weight encoder (tokenizer.json + model.onnx) to
+    directory and return it, for running the benchmarks offline.
+
+    The tokenizer is a BERT-style WordPiece trained on the synthetic corpus;
+    the model is an embedding lookup followed by `layers` dense tanh layers,
+    with the same inputs and (batch, sequence, dim) output as the real
+    encoder, so EmbeddingService(directory) loads and pools it the same way.
+    Vectors are meaningless; only throughput and memory are comparable.
+    The directory is reused if both files already exist.
+    """
+    try:
+        import onnx
+        from onnx import TensorProto, helper, numpy_helper
+        from tokenizers import Tokenizer, models, normalizers, pre_tokenizers, processors, trainers
+    except ImportError as e:
+        raise ImportError(f"Required packages not installed: {e}. Install with: uv pip install onnx tokenizers")
+
+    directory = Path(directory)
+    if (directory / 'tokenizer.json').exists() and (directory / 'model.onnx').exists():
+        return str(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    special_tokens = ["[PAD]", "[UNK]", "[CLS]", "[SEP]"]
+    tokenizer = Tokenizer(models.WordPiece(unk_token="[UNK]"))
+    tokenizer.normalizer = normalizers.BertNormalizer(lowercase=True)
+    tokenizer.pre_tokenizer = pre_tokenizers.BertPreTokenizer()
+    tokenizer.train_from_iterator(
+        _synthetic_corpus(3000, seed=seed).split("\n\n"),
+        trainers.WordPieceTrainer(vocab_size=vocab_size, special_tokens=special_tokens, show_progress=False)
+    )
+    tokenizer.post_processor = processors.TemplateProcessing(
+        single="[CLS] $A [SEP]",
+        special_tokens=[("[CLS]", tokenizer.token_to_id("[CLS]")), ("[SEP]", tokenizer.token_to_id("[SEP]"))]
+    )
+    tokenizer.enable_truncation(512)
+    tokenizer.save(str(directory / 'tokenizer.json'))
+
+    rng = np.random.default_rng(seed)
+    initializers = [numpy_helper.from_array(
+        (rng.standard_normal((tokenizer.get_vocab_size(), dim)) * 0.5).astype(np.float32), 'embeddings'
+    )]
+    nodes = [helper.make_node('Gather', ['embeddings', 'input_ids'], ['hidden_0'])]
+    for layer in range(layers):
+        initializers.append(numpy_helper.from_array(
+            (rng.standard_normal((dim, dim)) / np.sqrt(dim)).astype(np.float32), f'weight_{layer}'
+        ))
+        initializers.append(numpy_helper.from_array(np.zeros(dim, dtype=np.float32), f'bias_{layer}'))
+        nodes += [
+            helper.make_node('MatMul', [f'hidden_{layer}', f'weight_{layer}'], [f'projected_{layer}']),
+            helper.make_node('Add', [f'projected_{layer}', f'bias_{layer}'], [f'biased_{layer}']),
+            helper.make_node('Tanh', [f'biased_{layer}'],
+                             ['last_hidden_state' if layer == layers - 1 else f'hidden_{layer + 1}']),
+        ]
+    if not layers:
+        nodes.append(helper.make_node('Identity', ['hidden_0'], ['last_hidden_state']))
+
+    graph = helper.make_graph(
+        nodes, 'tiny_encoder',
+        inputs=[
+            helper.make_tensor_value_info('input_ids', TensorProto.INT64, ['batch', 'sequence']),
+            helper.make_tensor_value_info('attention_mask', TensorProto.INT64, ['batch', 'sequence']),
+        ],
+        outputs=[helper.make_tensor_value_info('last_hidden_state', TensorProto.FLOAT, ['batch', 'sequence', dim])],
+        initializer=initializers,
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 17)], producer_name='knowledge-benchmarks')
+    # Loadable by any onnxruntime that supports opset 17
+    model.ir_version = 8
+    onnx.checker.check_model(model)
+    onnx.save(model, str(directory / 'model.onnx'))
+    return str(directory)
+
+
+TINY_MODEL_DIR = Path(__file__).resolve().parent.parent / 'pretrained_models' / 'benchmark-tiny-encoder'
+
+
+def benchmark_ingestion(sizes=(10, 100, 500), model: str = None, formats=('txt', 'pdf', 'docx'),
+                        embed_sample: int = 256, batch_size: int = None, repeat: int = 3) -> List[dict]:
+    """
+    Throughput and peak RSS of each ingestion stage on synthetic documents
+    of several sizes (pages of about 3,000 characters), one result per size:
+
+        parse_{txt,pdf,docx}: DocumentParsingService.parse_document, pages/s
+        chunk: ChunkingService.iter_chunks over the pages with the splitter
+            IngestionService.process_document uses (splitter_for), chunks/s
+        embed: EmbeddingService.embed one chunk at a time (first embed_sample chunks), chunks/s
+        embed_batch: EmbeddingService.embed_batch over all chunks, chunks/s
+        persistence: ChunkStorageService.store_chunks into a scratch document, rows/s
+
+    model is an embedding model name or local directory; by default a tiny
+    random-weight encoder is built under pretrained_models/ so the suite
+    runs offline. The corpus, files and tiny model are seeded, and each
+    stage reports its fastest of repeat runs, so runs on the same machine
+    are comparable. PDFs are parsed once (pdfplumber needs about 0.2 s per
+    page), using KNOWLEDGE_PDF_WORKERS processes.
+    """
+    import tempfile
+
+    if model is None:
+        model = build_tiny_embedding_model(TINY_MODEL_DIR)
+    embedding_service = EmbeddingService(model)
+    dim = int(embedding_service.embed_array(["warm up"]).shape[1])
+    writers = {
+        'txt': lambda path, pages: Path(path).write_text("\n\n".join(pages), encoding='utf-8'),
+        'pdf': _write_pdf,
+        'docx': _write_docx,
+    }
+
+    pdf_workers = getattr(settings, 'KNOWLEDGE_PDF_WORKERS', None) or os.cpu_count() or 1
+    results = []
+    # A 1-page pass first loads the parsers and splitter, so import time and
+    # memory do not count against the first size
+    for size in [1, *sizes]:
+        pages = _synthetic_pages(size)
+        result = {'stage': 'ingestion', 'pages': size, 'characters': sum(len(page) for page in pages),
+                  'model': embedding_service.model_name, 'dim': dim, 'pdf_workers': pdf_workers}
+
+        with tempfile.TemporaryDirectory() as directory:
+            for file_type in formats:
+                path = os.path.join(directory, f"corpus.{file_type}")
+                writers[file_type](path, pages)
+                result[f'{file_type}_file_bytes'] = os.path.getsize(path)
+                if file_type == 'pdf':
+                    result['pdf_pages'] = DocumentParsingService.pdf_page_count(path)
+                try:
+                    _, seconds = _measure(
+                        result, f'parse_{file_type}', 1 if file_type == 'pdf' else repeat,
+                        DocumentParsingService.parse_document, path, file_type
+                    )
+                except ImportError as e:
+                    result[f'parse_{file_type}_skipped'] = str(e)
+                    continue
+                result[f'parse_{file_type}_pages_per_sec'] = round(result.get(f'{file_type}_pages', size) / seconds, 1)
+
+        numbered = list(enumerate(pages, start=1))
+        chunks, seconds = _measure(result, 'chunk', repeat, lambda: [
+            chunk for chunk, _ in ChunkingService.iter_chunks(numbered, ChunkingService.splitter_for(embedding_service))
+        ])
+        result['chunks'] = len(chunks)
+        result['chunk_chunks_per_sec'] = round(len(chunks) / seconds, 1)
+
+        sample = chunks[:embed_sample]
+        _, seconds = _measure(result, 'embed', repeat, lambda: [embedding_service.embed(chunk) for chunk in sample])
+        result['embed_chunks_per_sec'] = round(len(sample) / seconds, 1)
+
+        vectors, seconds = _measure(result, 'embed_batch', repeat, embedding_service.embed_batch, chunks, batch_size)
+        result['embed_batch_chunks_per_sec'] = round(len(chunks) / seconds, 1)
+
+        course, document = _scratch_document()
+        try:
+            _, seconds = _measure(
+                result, 'persistence', repeat, ChunkStorageService.store_chunks,
+                document, chunks, np.asarray(vectors, dtype=np.float32), embedding_service.model_name
+            )
+        finally:
+            course.delete()
+        result['persistence_rows_per_sec'] = round(len(chunks) / seconds, 1)
+        results.append(result)
+    return results[1:]
+
+
+def _normalized(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def benchmark_onnx_profiles(rows: int = 2000, model: str = None, batch_size: int = None, repeat: int = 3,
+                            queries: int = 100, k: int = 10) -> List[dict]:
+    """
+    Load time, throughput and vector drift of each ONNX execution profile
+    (services.ONNX_PROFILES), one result per profile, on `rows` chunks of
+    the synthetic corpus:
+
+        load / reload: seconds to create the session the first time (graph
+            optimization and saving, int8 quantization if needed) and again
+            (reusing the saved files)
+        embed_batch: EmbeddingService.embed_array over all chunks, chunks/s
+        drift_mean / drift_max: cosine distance of each vector from the
+            'default' profile's vector for the same chunk
+        neighbours_recall_at_k: overlap of each chunk's k nearest chunks
+            with those under the 'default' profile (first `queries` chunks)
+
+    model is an embedding model name or local directory; by default the
+    tiny random-weight encoder of benchmark_ingestion is used.
+    """
+    if model is None:
+        model = build_tiny_embedding_model(TINY_MODEL_DIR)
+    texts = ChunkingService.chunk_text(_synthetic_corpus(rows))[:rows]
+
+    results = []
+    reference = None
+    for profile in ONNX_PROFILES:
+        result = {'stage': 'onnx_profile', 'profile': profile, 'rows': len(texts)}
+        start = time.perf_counter()
+        service = EmbeddingService(model, profile=profile)
+        result['load_seconds'] = round(time.perf_counter() - start, 4)
+        start = time.perf_counter()
+        service = EmbeddingService(model, profile=profile)
+        result['reload_seconds'] = round(time.perf_counter() - start, 4)
+        result['model'] = service.model_name
+        result['model_file'] = os.path.basename(service.onnx_model_path)
+        result['model_file_mb'] = round(os.path.getsize(service.onnx_model_path) / 1e6, 2)
+        result['intra_op_threads'] = service.session.get_session_options().intra_op_num_threads
+
+        service.embed_array(texts[:8], batch_size=batch_size)
+        vectors, seconds = _measure(result, 'embed_batch', repeat, service.embed_array, texts, batch_size)
+        result['embed_batch_chunks_per_sec'] = round(len(texts) / seconds, 1)
+
+        vectors = _normalized(vectors)
+        if reference is None:
+            reference = vectors
+        distance = 1.0 - np.sum(vectors * reference, axis=1)
+        result['drift_mean'] = float(f"{distance.mean():.3g}")
+        result['drift_max'] = float(f"{distance.max():.3g}")
+
+        sample = min(queries, len(texts))
+        hits = 0
+        for row in range(sample):
+            expected = np.argsort(-(reference @ reference[row]))[:k + 1]
+            actual = np.argsort(-(vectors @ vectors[row]))[:k + 1]
+            # The chunk itself is its own nearest neighbour under every profile
+            hits += len(np.intersect1d(expected[expected != row][:k], actual[actual != row][:k]))
+        result[f'neighbours_recall_at_{k}'] = round(hits / (k * sample), 4)
+        results.append(result)
+    return results
+
+
+def benchmark_embedding_processes(rows: int = 2000, model: str = None, processes=None, batch_size: int = None,
+                                  repeat: int = 3) -> List[dict]:
+    """
+    embed_array throughput over `rows` chunks of the synthetic corpus with
+    EmbeddingProcessPools of several sizes, one result per size (default
+    1, 2, 4, ... up to the CPU count; 1 embeds in this process):
+
+        embed_batch: chunks/s, best of repeat runs after a warm-up call that
+            starts the processes and loads their sessions
+        speedup / efficiency: throughput relative to 1 process, and that
+            divided by the process count (1.0 is linear scaling)
+        max_abs_diff: largest difference from the 1-process vectors
+
+    model is an embedding model name or local directory; by default the
+    tiny random-weight encoder of benchmark_ingestion is used.
+    """
+    if model is None:
+        model = build_tiny_embedding_model(TINY_MODEL_DIR)
+    if not processes:
+        cores = os.cpu_count() or 1
+        processes = sorted({1, cores} | {2 ** power for power in range(cores.bit_length()) if 2 ** power < cores})
+    texts = ChunkingService.chunk_text(_synthetic_corpus(rows))[:rows]
+
+    results = []
+    reference = baseline = None
+    for count in processes:
+        result = {'stage': 'embedding_processes', 'processes': count, 'rows': len(texts), 'cpu_count': os.cpu_count()}
+        service = EmbeddingService(model, processes=count if count > 1 else 0)
+        try:
+            service.embed_array(texts, batch_size=batch_size)
+            vectors, seconds = _measure(result, 'embed_batch', repeat, service.embed_array, texts, batch_size)
+        finally:
+            service.close()
+        result['embed_batch_chunks_per_sec'] = round(len(texts) / seconds, 1)
+        if baseline is None:
+            reference, baseline = vectors, seconds
+        result['speedup'] = round(baseline / seconds, 2)
+        result['efficiency'] = round(baseline / seconds / count, 2)
+        result['max_abs_diff'] = float(f"{np.abs(vectors - reference).max():.3g}")
+        results.append(result)
+    return results
+
+
+BENCHMARKS = {
+    'ann': benchmark_ann,
+    'chunking': benchmark_chunking,
+    'embedding_processes': benchmark_embedding_processes,
+    'ingestion': benchmark_ingestion,
+    'onnx_profiles': benchmark_onnx_profiles,
+    'persistence': benchmark_persistence,
+    'quantization': benchmark_quantization,
+}
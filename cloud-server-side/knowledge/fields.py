@@ -0,0 +1,55 @@
+import numpy as np
+from django.db import models
+
+
+class VectorField(models.BinaryField):
+    """
+    Dense vector stored as raw little-endian floats in a BLOB.
+
+    Values load as read-only NumPy arrays that share the row's buffer
+    (np.frombuffer, no copy). Lists and arrays are accepted on save.
+    """
+    description = "Dense vector stored as raw little-endian floats"
+
+    DTYPES = {
+        'float32': '<f4',
+        'float16': '<f2',
+    }
+
+    def __init__(self, *args, dtype: str = 'float32', **kwargs):
+        if dtype not in self.DTYPES:
+            raise ValueError(f"Unsupported vector dtype: {dtype}")
+        self.dtype = dtype
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.dtype != 'float32':
+            kwargs['dtype'] = self.dtype
+        return name, path, args, kwargs
+
+    @property
+    def numpy_dtype(self) -> np.dtype:
+        return np.dtype(self.DTYPES[self.dtype])
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return None
+        return np.frombuffer(value, dtype=self.numpy_dtype)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, np.ndarray):
+            return value
+        if isinstance(value, str):
+            # Serialized (dumpdata) values are base64 text
+            value = super().to_python(value)
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return np.frombuffer(value, dtype=self.numpy_dtype)
+        return np.asarray(value, dtype=self.numpy_dtype)
+
+    def get_prep_value(self, value):
+        if value is None:
+            return None
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return bytes(value)
+        return np.ascontiguousarray(value, dtype=self.numpy_dtype).tobytes()
@@ -0,0 +1,462 @@
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import profiling
+from .models import IngestionJob, ReembeddingJob
+from .services import (
+    IngestionService, IngestionCancelled, ChunkStorageService, DocumentDedupService, ReembeddingService,
+    VectorIndexService,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class IngestionQueue:
+    """DB-backed queue of ingestion jobs (no external broker)"""
+
+    @staticmethod
+    def enqueue(document, profile: bool = False) -> IngestionJob:
+        """Create a queued job for document and wake the local workers"""
+        job = IngestionJob.objects.create(
+            document=document,
+            max_attempts=getattr(settings, 'KNOWLEDGE_INGESTION_MAX_ATTEMPTS', 3),
+            profile=profile
+        )
+        transaction.on_commit(ensure_local_workers)
+        return job
+
+    @staticmethod
+    def requeue_stale():
+        """Put back running jobs whose worker stopped sending heartbeats"""
+        stale_after = getattr(settings, 'KNOWLEDGE_INGESTION_STALE_AFTER', 300)
+        cutoff = timezone.now() - timedelta(seconds=stale_after)
+        return IngestionJob.objects.filter(
+            status=IngestionJob.STATUS_RUNNING, heartbeat_at__lt=cutoff
+        ).update(status=IngestionJob.STATUS_QUEUED, worker='')
+
+    @staticmethod
+    def claim_next(worker_name: str):
+        """
+        Atomically move the oldest queued job to running and return it.
+        The claim is a conditional UPDATE, so two workers never get the same job.
+        """
+        candidates = IngestionJob.objects.filter(
+            status=IngestionJob.STATUS_QUEUED
+        ).order_by('created_at').values_list('pk', flat=True)[:5]
+
+        for pk in list(candidates):
+            now = timezone.now()
+            claimed = IngestionJob.objects.filter(pk=pk, status=IngestionJob.STATUS_QUEUED).update(
+                status=IngestionJob.STATUS_RUNNING,
+                stage='pending',
+                worker=worker_name,
+                attempts=F('attempts') + 1,
+                chunks_total=0,
+                chunks_embedded=0,
+                chunks_stored=0,
+                cache_hits=0,
+                cache_misses=0,
+                stage_timings={},
+                error='',
+                started_at=now,
+                heartbeat_at=now,
+                finished_at=None,
+            )
+            if claimed:
+                return IngestionJob.objects.select_related('document').get(pk=pk)
+        return None
+
+    @staticmethod
+    def run_job(job: IngestionJob):
+        """Run a claimed job to completion, failure or cancellation"""
+        if not (job.profile or profiling.sampled('KNOWLEDGE_PROFILING_JOB_SAMPLE_RATE')):
+            return IngestionQueue._run_job(job)
+        profiler = profiling.Profiler('job', f"job {job.pk} ({job.document.title})")
+        try:
+            with profiler.running():
+                IngestionQueue._run_job(job)
+        finally:
+            profiling.save_quietly(profiler)
+        return job
+
+    @staticmethod
+    def _run_job(job: IngestionJob):
+        tracker = _JobProgress(job)
+        try:
+            # Duplicate uploads (Document.duplicate_of) copy the earlier upload's chunks
+            source = DocumentDedupService.reusable_source(job.document)
+            if source is not None:
+                DocumentDedupService.copy_chunks(source, job.document, progress=tracker)
+            else:
+                IngestionService.process_document(job.document, progress=tracker)
+        except IngestionCancelled:
+            _discard_chunks(job.document)
+            tracker.finish(IngestionJob.STATUS_CANCELLED)
+            logger.info("ingestion job cancelled", extra={'job_id': job.pk, 'document_id': job.document_id})
+        except Exception as e:
+            _discard_chunks(job.document)
+            job.error = f"{e}\n\n{traceback.format_exc()}"
+            retry = job.attempts < job.max_attempts
+            logger.warning("ingestion job failed", exc_info=True, extra={
+                'job_id': job.pk, 'document_id': job.document_id, 'attempt': job.attempts, 'retry': retry
+            })
+            tracker.finish(IngestionJob.STATUS_QUEUED if retry else IngestionJob.STATUS_FAILED)
+        else:
+            tracker.finish(IngestionJob.STATUS_SUCCEEDED, stage='done')
+            # Train the IVF index here, so searches never have to
+            VectorIndexService.refresh(job.document.course)
+        return job
+
+    @staticmethod
+    def cancel(job: IngestionJob) -> IngestionJob:
+        """Cancel a queued job immediately, or ask its worker to stop a running one"""
+        now = timezone.now()
+        IngestionJob.objects.filter(pk=job.pk, status=IngestionJob.STATUS_QUEUED).update(
+            status=IngestionJob.STATUS_CANCELLED, finished_at=now
+        )
+        IngestionJob.objects.filter(pk=job.pk, status=IngestionJob.STATUS_RUNNING).update(
+            cancel_requested=True
+        )
+        job.refresh_from_db()
+        return job
+
+    @staticmethod
+    def retry(job: IngestionJob) -> IngestionJob:
+        """Re-queue a failed or cancelled job with a fresh attempt budget"""
+        IngestionJob.objects.filter(
+            pk=job.pk, status__in=[IngestionJob.STATUS_FAILED, IngestionJob.STATUS_CANCELLED]
+        ).update(
+            status=IngestionJob.STATUS_QUEUED,
+            cancel_requested=False,
+            attempts=0,
+            finished_at=None,
+        )
+        transaction.on_commit(ensure_local_workers)
+        job.refresh_from_db()
+        return job
+
+
+class ReembeddingQueue:
+    """
+    DB-backed queue of re-embedding jobs. Ingestion workers take them only
+    while no upload is waiting, and a running job hands its worker back as
+    soon as one is (it stays queued at its checkpoint), so re-embedding
+    never holds up live ingestion.
+    """
+
+    @staticmethod
+    def enqueue(course=None, embedding_model: str = None, force: bool = False,
+                start_workers: bool = True) -> ReembeddingJob:
+        """
+        Queue a job, or return the unfinished one with the same course, model
+        and force flag. start_workers=False leaves it to a caller that runs
+        the job itself (the reembed command).
+        """
+        if embedding_model is None:
+            from .services import DEFAULT_EMBEDDING_MODEL
+            embedding_model = getattr(settings, 'KNOWLEDGE_EMBEDDING_MODEL', DEFAULT_EMBEDDING_MODEL)
+        existing = ReembeddingJob.objects.filter(
+            course=course, embedding_model=embedding_model, force=force,
+            status__in=[ReembeddingJob.STATUS_QUEUED, ReembeddingJob.STATUS_RUNNING]
+        ).first()
+        if existing is not None:
+            return existing
+        job = ReembeddingJob.objects.create(course=course, embedding_model=embedding_model, force=force)
+        if start_workers:
+            transaction.on_commit(ensure_local_workers)
+        return job
+
+    @staticmethod
+    def sync_course_models(course, previous_models):
+        """
+        Follow a change of course's additional embedding models: queue a
+        backfill of each added one and drop the vectors of each removed one.
+        """
+        from .models import ChunkEmbedding
+
+        current = course.embedding_model_names()
+        removed = [name for name in previous_models[1:] if name not in current[1:]]
+        if removed:
+            for job in ReembeddingJob.objects.filter(
+                course=course, embedding_model__in=removed,
+                status__in=[ReembeddingJob.STATUS_QUEUED, ReembeddingJob.STATUS_RUNNING]
+            ):
+                ReembeddingQueue.cancel(job)
+            ChunkEmbedding.objects.filter(chunk__document__course=course, embedding_model__in=removed).delete()
+        return [
+            ReembeddingQueue.enqueue(course, name)
+            for name in current[1:] if name not in previous_models[1:]
+        ]
+
+    @staticmethod
+    def ingestion_waiting() -> bool:
+        """Whether uploads are queued or being ingested"""
+        return IngestionJob.objects.filter(
+            status__in=[IngestionJob.STATUS_QUEUED, IngestionJob.STATUS_RUNNING]
+        ).exists()
+
+    @staticmethod
+    def requeue_stale():
+        """Put back running jobs whose worker stopped sending heartbeats"""
+        stale_after = getattr(settings, 'KNOWLEDGE_INGESTION_STALE_AFTER', 300)
+        cutoff = timezone.now() - timedelta(seconds=stale_after)
+        return ReembeddingJob.objects.filter(
+            status=ReembeddingJob.STATUS_RUNNING, heartbeat_at__lt=cutoff
+        ).update(status=ReembeddingJob.STATUS_QUEUED, worker='')
+
+    @staticmethod
+    def claim(pk: int, worker_name: str):
+        """Atomically move a queued job to running and return it, or None if it is not queued"""
+        now = timezone.now()
+        claimed = ReembeddingJob.objects.filter(pk=pk, status=ReembeddingJob.STATUS_QUEUED).update(
+            status=ReembeddingJob.STATUS_RUNNING, worker=worker_name, heartbeat_at=now, error=''
+        )
+        if not claimed:
+            return None
+        ReembeddingJob.objects.filter(pk=pk, started_at__isnull=True).update(started_at=now)
+        return ReembeddingJob.objects.get(pk=pk)
+
+    @staticmethod
+    def claim_next(worker_name: str):
+        """Claim the oldest queued job, unless uploads are waiting"""
+        if ReembeddingQueue.ingestion_waiting():
+            return None
+        candidates = ReembeddingJob.objects.filter(
+            status=ReembeddingJob.STATUS_QUEUED
+        ).order_by('created_at').values_list('pk', flat=True)[:5]
+        for pk in list(candidates):
+            job = ReembeddingQueue.claim(pk, worker_name)
+            if job is not None:
+                return job
+        return None
+
+    @staticmethod
+    def run_job(job: ReembeddingJob, embedding_service=None):
+        """
+        Run a claimed job until it finishes, fails, is cancelled or yields to
+        waiting uploads (back to queued, checkpoint kept).
+        """
+        def progress(job):
+            if ReembeddingJob.objects.filter(pk=job.pk, cancel_requested=True).exists():
+                raise IngestionCancelled(f"Re-embedding job {job.pk} cancelled")
+
+        status = ReembeddingJob.STATUS_SUCCEEDED
+        try:
+            finished = ReembeddingService.run(
+                job, embedding_service, should_yield=ReembeddingQueue.ingestion_waiting, progress=progress
+            )
+            if not finished:
+                status = ReembeddingJob.STATUS_QUEUED
+        except IngestionCancelled:
+            job.shadow_vectors.all().delete()
+            status = ReembeddingJob.STATUS_CANCELLED
+            logger.info("re-embedding job cancelled", extra={'job_id': job.pk})
+        except Exception as e:
+            # Shadow vectors and the checkpoint stay, so a retry resumes where this stopped
+            job.error = f"{e}\n\n{traceback.format_exc()}"
+            status = ReembeddingJob.STATUS_FAILED
+            logger.warning("re-embedding job failed", exc_info=True, extra={'job_id': job.pk})
+
+        job.status = status
+        job.worker = ''
+        job.heartbeat_at = timezone.now()
+        job.finished_at = job.heartbeat_at if status in ReembeddingJob.FINISHED_STATUSES else None
+        job.save(update_fields=['status', 'worker', 'heartbeat_at', 'finished_at', 'error', 'updated_at'])
+        return job
+
+    @staticmethod
+    def cancel(job: ReembeddingJob) -> ReembeddingJob:
+        """Cancel a queued job immediately, or ask its worker to stop a running one"""
+        if ReembeddingJob.objects.filter(pk=job.pk, status=ReembeddingJob.STATUS_QUEUED).update(
+            status=ReembeddingJob.STATUS_CANCELLED, finished_at=timezone.now()
+        ):
+            job.shadow_vectors.all().delete()
+        ReembeddingJob.objects.filter(pk=job.pk, status=ReembeddingJob.STATUS_RUNNING).update(
+            cancel_requested=True
+        )
+        job.refresh_from_db()
+        return job
+
+    @staticmethod
+    def retry(job: ReembeddingJob) -> ReembeddingJob:
+        """Re-queue a failed job; it resumes from its checkpoint"""
+        ReembeddingJob.objects.filter(pk=job.pk, status=ReembeddingJob.STATUS_FAILED).update(
+            status=ReembeddingJob.STATUS_QUEUED, finished_at=None
+        )
+        transaction.on_commit(ensure_local_workers)
+        job.refresh_from_db()
+        return job
+
+
+def _discard_chunks(document):
+    """Remove chunks left by an unfinished run"""
+    ChunkStorageService.clear_chunks(document)
+
+
+class _JobProgress:
+    """Progress callback that persists stage, counters and stage timings on the job"""
+
+    def __init__(self, job: IngestionJob):
+        self.job = job
+        self.stage_started = time.monotonic()
+        # Set once the pipeline reports its own per-stage timings
+        self.timings_reported = False
+
+    def __call__(self, stage, done=0, total=0, embedded=None, cache_hits=None, cache_misses=None,
+                 stage_timings=None):
+        job = self.job
+        now = time.monotonic()
+        if stage != job.stage:
+            if job.stage in ('parse', 'chunk', 'embed', 'store'):
+                job.stage_timings[job.stage] = round(now - self.stage_started, 3)
+            self.stage_started = now
+            job.stage = stage
+        if total:
+            job.chunks_total = total
+        if stage == 'embed':
+            job.chunks_embedded = done
+        elif stage == 'store':
+            job.chunks_stored = done
+        if embedded is not None:
+            job.chunks_embedded = embedded
+        if cache_hits is not None:
+            job.cache_hits = cache_hits
+            job.cache_misses = cache_misses
+        if stage_timings is not None:
+            # Pipelined stages overlap, so their own busy times replace wall-clock stage spans
+            job.stage_timings = dict(stage_timings)
+            self.timings_reported = True
+        job.heartbeat_at = timezone.now()
+        job.save(update_fields=[
+            'stage', 'chunks_total', 'chunks_embedded', 'chunks_stored', 'cache_hits',
+            'cache_misses', 'stage_timings', 'heartbeat_at', 'updated_at'
+        ])
+
+        if IngestionJob.objects.filter(pk=job.pk, cancel_requested=True).exists():
+            raise IngestionCancelled(f"Job {job.pk} cancelled")
+
+    def finish(self, status, stage=None):
+        job = self.job
+        if job.stage in ('parse', 'chunk', 'embed', 'store') and not self.timings_reported:
+            job.stage_timings[job.stage] = round(time.monotonic() - self.stage_started, 3)
+        if stage:
+            job.stage = stage
+        job.status = status
+        job.worker = ''
+        job.heartbeat_at = timezone.now()
+        job.finished_at = None if status == IngestionJob.STATUS_QUEUED else job.heartbeat_at
+        job.save()
+
+
+class IngestionWorkerPool:
+    """
+    Pool of worker threads pulling jobs from IngestionQueue.
+    Embedding runs inside ONNX Runtime with the GIL released, so threads
+    sharing one model session keep all cores busy.
+    """
+
+    def __init__(self, workers: int = 2, poll_interval: float = None, daemon: bool = True):
+        self.workers = max(1, workers)
+        self.poll_interval = poll_interval if poll_interval is not None else getattr(
+            settings, 'KNOWLEDGE_INGESTION_POLL_INTERVAL', 2.0
+        )
+        self.daemon = daemon
+        self.wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for idx in range(self.workers):
+            self._threads.append(self._start_thread(idx))
+        return self
+
+    def _start_thread(self, idx: int) -> threading.Thread:
+        thread = threading.Thread(
+            target=self._run, args=(f"{socket.gethostname()}:{os.getpid()}:{idx}",),
+            name=f"ingestion-worker-{idx}", daemon=self.daemon
+        )
+        thread.start()
+        return thread
+
+    def restart_dead(self) -> int:
+        """Replace worker threads that exited unexpectedly; returns how many were restarted"""
+        if self._stop.is_set():
+            return 0
+        restarted = 0
+        for idx, thread in enumerate(self._threads):
+            if not thread.is_alive():
+                logger.warning("restarting ingestion worker", extra={'worker': thread.name})
+                self._threads[idx] = self._start_thread(idx)
+                restarted += 1
+        return restarted
+
+    def stop(self, wait: bool = True):
+        self._stop.set()
+        self.wakeup.set()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def is_alive(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def _run(self, worker_name: str):
+        try:
+            while not self._stop.is_set():
+                try:
+                    self._run_once(worker_name)
+                except Exception:
+                    # E.g. "database is locked"; the worker stays up and tries again
+                    logger.exception("ingestion worker error", extra={'worker': worker_name})
+                    self._stop.wait(self.poll_interval)
+        finally:
+            connection.close()
+
+    def _run_once(self, worker_name: str):
+        """Run one queued job, or wait up to poll_interval for one"""
+        close_old_connections()
+        IngestionQueue.requeue_stale()
+        ReembeddingQueue.requeue_stale()
+        job = IngestionQueue.claim_next(worker_name)
+        if job is not None:
+            IngestionQueue.run_job(job)
+            return
+        # Re-embedding only uses workers that no upload is waiting for
+        reembedding = ReembeddingQueue.claim_next(worker_name)
+        if reembedding is not None:
+            ReembeddingQueue.run_job(reembedding)
+            return
+        self.wakeup.wait(self.poll_interval)
+        self.wakeup.clear()
+
+
+_local_pool = None
+_local_pool_lock = threading.Lock()
+
+
+def ensure_local_workers():
+    """
+    Start the in-process worker pool (KNOWLEDGE_INGESTION_LOCAL_WORKERS threads)
+    on first use, restart any of its threads that died, and wake it up. With 0 local workers, jobs wait for the
+    run_ingestion_workers command.
+    """
+    global _local_pool
+    workers = getattr(settings, 'KNOWLEDGE_INGESTION_LOCAL_WORKERS', 2)
+    if workers <= 0:
+        return
+    with _local_pool_lock:
+        if _local_pool is None:
+            _local_pool = IngestionWorkerPool(workers=workers).start()
+        else:
+            _local_pool.restart_dead()
+    _local_pool.wakeup.set()
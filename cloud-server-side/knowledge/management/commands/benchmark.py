@@ -0,0 +1,96 @@
+import inspect
+import json
+import os
+import platform
+from datetime import datetime, timezone
+
+from django.core.management.base import BaseCommand
+
+from knowledge.benchmarks import BENCHMARKS
+
+
+class Command(BaseCommand):
+    help = "Run ingestion pipeline benchmarks against the configured database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('stages', nargs='*', choices=sorted(BENCHMARKS), help="Benchmarks to run (default: all)")
+        parser.add_argument('--rows', type=int, default=2000, help="Number of synthetic chunks")
+        parser.add_argument('--course', type=int, default=None,
+                            help="Use this course's chunks instead of synthetic data (where supported)")
+        parser.add_argument('--sizes', type=int, nargs='+', default=None,
+                            help="Synthetic document sizes in pages (ingestion; default 10 100 500)")
+        parser.add_argument('--model', default=None,
+                            help="Embedding model name or local directory (chunking, ingestion, onnx_profiles; "
+                                 "default: a generated tiny model)")
+        parser.add_argument('--processes', type=int, nargs='+', default=None,
+                            help="Embedding pool sizes (embedding_processes; default 1, 2, 4, ... up to the CPU count)")
+        parser.add_argument('--repeat', type=int, default=None,
+                            help="Runs per stage, fastest reported (ingestion, onnx_profiles; default 3)")
+        parser.add_argument('--json', action='store_true', help="Print results as JSON")
+        parser.add_argument('--output', default=None, help="Also save results and machine info to this JSON file")
+        parser.add_argument('--compare', default=None,
+                            help="JSON file saved by an earlier --output run to compare the results with")
+
+    def handle(self, *args, **options):
+        optional = {'course_id': options['course'], 'sizes': options['sizes'], 'model': options['model'],
+                    'repeat': options['repeat'], 'processes': options['processes']}
+        results = []
+        for stage in options['stages'] or sorted(BENCHMARKS):
+            benchmark = BENCHMARKS[stage]
+            parameters = inspect.signature(benchmark).parameters
+            kwargs = {'rows': options['rows']} if 'rows' in parameters else {}
+            kwargs.update({key: value for key, value in optional.items() if value is not None and key in parameters})
+            result = benchmark(**kwargs)
+            results.extend(result if isinstance(result, list) else [result])
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'machine': self.machine_info(), 'results': results}, f, indent=2)
+            self.stderr.write(f"Saved results to {options['output']}")
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            for result in results:
+                self.stdout.write(self.style.SUCCESS(f"[{result['stage']}]"))
+                for key, value in result.items():
+                    if key != 'stage':
+                        self.stdout.write(f"  {key}: {value}")
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                self.compare(json.load(f)['results'], results)
+
+    @staticmethod
+    def machine_info():
+        import numpy
+        import onnxruntime
+        return {
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+            'numpy': numpy.__version__,
+            'onnxruntime': onnxruntime.__version__,
+        }
+
+    @staticmethod
+    def _key(result):
+        """Results of the same stage, size, ONNX profile and process count are compared with each other"""
+        return result['stage'], result.get('pages'), result.get('rows'), result.get('profile'), result.get('processes')
+
+    def compare(self, previous, current):
+        """Print current / previous for each numeric measurement present in both runs"""
+        baseline = {self._key(result): result for result in previous}
+        for result in current:
+            before = baseline.get(self._key(result))
+            if before is None:
+                continue
+            label = ' '.join(f"{value}" for value in self._key(result) if value is not None)
+            self.stdout.write(self.style.SUCCESS(f"[{label}] current / previous"))
+            for key, value in result.items():
+                old = before.get(key)
+                if isinstance(value, bool) or not isinstance(value, (int, float)) or not isinstance(old, (int, float)):
+                    continue
+                if old:
+                    self.stdout.write(f"  {key}: {old} -> {value} ({value / old:.2f}x)")
@@ -0,0 +1,127 @@
+import os
+import socket
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from knowledge.jobs import ReembeddingQueue
+from knowledge.models import Course, ReembeddingJob
+from knowledge.services import DEFAULT_EMBEDDING_MODEL, EmbeddingService
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-embed the chunks of some courses (or of every course) with an embedding model, "
+        "in checkpointed batches, then swap the new vectors in atomically. "
+        "Interrupted runs resume from their checkpoint; uploads always go first."
+    )
+
+    def add_arguments(self, parser):
+        scope = parser.add_mutually_exclusive_group()
+        scope.add_argument('--course', type=int, action='append', dest='courses', default=[],
+                           help="Course id to re-embed (repeatable)")
+        scope.add_argument('--all', action='store_true', help="Re-embed every course in one job")
+        scope.add_argument('--resume', action='store_true',
+                           help="Run the unfinished and failed jobs instead of queueing new ones")
+        scope.add_argument('--list', action='store_true', help="List re-embedding jobs and exit")
+        parser.add_argument('--model', default=None,
+                            help="Embedding model (default: KNOWLEDGE_EMBEDDING_MODEL). Courses declaring "
+                                 "it as an additional model get its vectors backfilled")
+        parser.add_argument('--force', action='store_true',
+                            help="Also re-embed chunks already embedded with the model, bypassing the cache")
+        parser.add_argument('--processes', type=int, default=None,
+                            help="Embed with a pool of this many worker processes")
+        parser.add_argument('--poll-interval', type=float, default=None,
+                            help="Seconds to wait while uploads are being ingested")
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for job in ReembeddingJob.objects.select_related('course').order_by('-created_at')[:50]:
+                self.stdout.write(self._describe(job))
+            return
+
+        model_name = options['model'] or getattr(settings, 'KNOWLEDGE_EMBEDDING_MODEL', DEFAULT_EMBEDDING_MODEL)
+        if options['resume']:
+            ReembeddingQueue.requeue_stale()
+            jobs = list(ReembeddingJob.objects.filter(status__in=[
+                ReembeddingJob.STATUS_QUEUED, ReembeddingJob.STATUS_RUNNING, ReembeddingJob.STATUS_FAILED
+            ]).order_by('created_at'))
+            for job in jobs:
+                ReembeddingQueue.retry(job)
+        elif options['all']:
+            jobs = [ReembeddingQueue.enqueue(None, model_name, options['force'], start_workers=False)]
+        elif options['courses']:
+            courses = Course.objects.in_bulk(options['courses'])
+            missing = set(options['courses']) - set(courses)
+            if missing:
+                raise CommandError(f"Unknown course ids: {', '.join(map(str, sorted(missing)))}")
+            jobs = [
+                ReembeddingQueue.enqueue(courses[pk], model_name, options['force'], start_workers=False)
+                for pk in options['courses']
+            ]
+        else:
+            raise CommandError("Give --course ID, --all, --resume or --list")
+
+        if not jobs:
+            self.stdout.write("Nothing to re-embed")
+            return
+
+        services = {}
+        poll_interval = options['poll_interval'] or getattr(settings, 'KNOWLEDGE_INGESTION_POLL_INTERVAL', 2.0)
+        worker_name = f"{socket.gethostname()}:{os.getpid()}:reembed"
+        try:
+            for job in jobs:
+                if options['processes'] is not None and job.embedding_model not in services:
+                    services[job.embedding_model] = EmbeddingService(
+                        job.embedding_model, processes=options['processes']
+                    )
+                job = self._run(job, services.get(job.embedding_model), worker_name, poll_interval)
+                self.stdout.write(self._describe(job))
+        finally:
+            for service in services.values():
+                service.close()
+
+    def _run(self, job, embedding_service, worker_name, poll_interval):
+        """Run job in this process until it finishes, waiting while uploads or another worker hold it"""
+        waiting = False
+        while True:
+            claimed = None
+            if not ReembeddingQueue.ingestion_waiting():
+                claimed = ReembeddingQueue.claim(job.pk, worker_name)
+            if claimed is None:
+                job.refresh_from_db()
+                if job.is_finished:
+                    return job
+                if not waiting:
+                    self.stdout.write(f"Job {job.pk}: waiting for uploads or worker {job.worker or '-'}...")
+                    waiting = True
+                time.sleep(poll_interval)
+                continue
+
+            waiting = False
+            try:
+                job = ReembeddingQueue.run_job(claimed, embedding_service)
+            except KeyboardInterrupt:
+                # The checkpoint is already saved; anyone can resume the job
+                ReembeddingJob.objects.filter(
+                    pk=job.pk, status=ReembeddingJob.STATUS_RUNNING, worker=worker_name
+                ).update(status=ReembeddingJob.STATUS_QUEUED, worker='')
+                self.stdout.write(f"Job {job.pk}: interrupted, resume with --resume")
+                raise
+            if job.is_finished:
+                return job
+            self.stdout.write(f"Job {job.pk}: paused for uploads at {job.chunks_done}/{job.chunks_total} chunks")
+
+    @staticmethod
+    def _describe(job):
+        scope = job.course.code if job.course_id else 'all courses'
+        line = (
+            f"Job {job.pk} [{job.status}] {scope} -> {job.embedding_model}: "
+            f"{job.chunks_done}/{job.chunks_total} chunks, {job.cache_hits} cache hits"
+        )
+        if job.swapped_at:
+            line += f", swapped at {job.swapped_at:%Y-%m-%d %H:%M:%S}"
+        if job.status == ReembeddingJob.STATUS_FAILED:
+            line += f"\n  {job.error.splitlines()[0] if job.error else ''}"
+        return line
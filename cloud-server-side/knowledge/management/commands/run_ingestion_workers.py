@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from knowledge import metrics
+from knowledge.jobs import IngestionWorkerPool
+from knowledge.services import EmbeddingService
+
+
+class Command(BaseCommand):
+    help = "Process queued document ingestion jobs with a local pool of worker threads"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help="Number of worker threads")
+        parser.add_argument('--poll-interval', type=float, default=None,
+                            help="Seconds between queue polls when idle")
+        parser.add_argument('--metrics-port', type=int, default=None,
+                            help="Serve this process's metrics at http://0.0.0.0:{port}/metrics")
+
+    def handle(self, *args, **options):
+        if options['metrics_port'] is not None:
+            metrics.serve(options['metrics_port'])
+            self.stdout.write(f"Serving metrics on port {options['metrics_port']}")
+        # The embedding session splits the cores between the workers
+        EmbeddingService.set_concurrency(options['workers'])
+        pool = IngestionWorkerPool(
+            workers=options['workers'],
+            poll_interval=options['poll_interval'],
+            daemon=False
+        ).start()
+        self.stdout.write(self.style.SUCCESS(f"Started {pool.workers} ingestion workers (Ctrl+C to stop)"))
+        try:
+            while pool.is_alive():
+                time.sleep(1.0)
+                pool.restart_dead()
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping workers after their current job...")
+            pool.stop()
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from knowledge.services import EmbeddingService
+
+
+class Command(BaseCommand):
+    help = (
+        "Prefetch embedding models into the local pretrained_models/ cache and check they run. "
+        "This does not warm a running server; server processes warm up on startup"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'models', nargs='*',
+            help="Model names to warm (defaults to KNOWLEDGE_EMBEDDING_MODEL)"
+        )
+
+    def handle(self, *args, **options):
+        for service in EmbeddingService.warm_up(options['models']):
+            dim = len(service.embed("warm-up"))
+            self.stdout.write(self.style.SUCCESS(
+                f"{service.model_name}: ready ({dim}-dim) from {service.model_path}"
+            ))
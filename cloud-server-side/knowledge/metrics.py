@@ -0,0 +1,257 @@
+"""
+In-process metrics in the Prometheus text exposition format.
+
+Counters and histograms are kept per process and served by the /metrics
+view (and by `run_ingestion_workers --metrics-port` for separate worker
+processes). Each server process reports its own values; the scraper sums
+them across processes. Shared metrics (read from the database, such as
+knowledge_ingestion_jobs) are the same in every process: only the /metrics
+view serves them, and several web processes should be aggregated with max.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Sequence
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_registry: List["_Metric"] = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ''
+    # Same value in every process (read from the database), not per process
+    shared = False
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels: Dict[str, object]) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        return '\n'.join(lines + self.samples())
+
+
+class Counter(_Metric):
+    """Monotonically increasing total, optionally per label values"""
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets, with their sum and count"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets: Sequence[float], labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        # Per label values: [per-bucket counts..., sum]
+        self._values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0]
+            for idx, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[idx] += 1
+                    break
+            state[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the seconds spent in the with block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, list(state)) for key, state in self._values.items())
+        lines = []
+        for key, state in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(state[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Callback(_Metric):
+    """
+    Counter or gauge whose values are read when metrics are rendered.
+    shared=True marks values read from the database rather than this process.
+    """
+
+    def __init__(self, name, documentation, kind: str, collect: Callable[[], Dict[tuple, float]], labelnames=(),
+                 shared: bool = False):
+        super().__init__(name, documentation, labelnames)
+        self.kind = kind
+        self.collect = collect
+        self.shared = shared
+
+    def samples(self):
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(self.collect().items())
+        ]
+
+
+def render(shared: bool = True) -> str:
+    """All registered metrics in the text exposition format; shared=False leaves out shared ones"""
+    with _registry_lock:
+        metrics = [metric for metric in _registry if shared or not metric.shared]
+    parts = []
+    for metric in metrics:
+        try:
+            parts.append(metric.render())
+        except Exception:
+            # A failing callback (e.g. database unavailable) must not hide the other metrics
+            continue
+    return '\n'.join(parts) + '\n'
+
+
+def serve(port: int, address: str = ''):
+    """
+    Serve render() at /metrics from a background thread, for processes
+    without the web server (run_ingestion_workers). Shared metrics are left
+    to the web server's /metrics view. Returns the server.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from django.db import connection
+    
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            try:
+                body = render(shared=False).encode('utf-8')
+            finally:
+                connection.close()
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def log_message(self, format, *args):
+            pass
+    
+    server = ThreadingHTTPServer((address, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
+
+
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+STAGE_SECONDS = Histogram(
+    'knowledge_ingestion_stage_seconds', 'Seconds a document spent working in each ingestion stage',
+    STAGE_BUCKETS, ['stage']
+)
+DOCUMENTS = Counter(
+    'knowledge_ingestion_documents_total', 'Documents run through the ingestion pipeline, by outcome',
+    ['file_type', 'status']
+)
+DOCUMENT_BYTES = Counter(
+    'knowledge_ingestion_bytes_total', 'Bytes of document files run through the ingestion pipeline', ['file_type']
+)
+CHUNKS = Counter(
+    'knowledge_ingestion_chunks_total', 'Chunks that went through each ingestion stage', ['stage']
+)
+ONNX_BATCH_SIZE = Histogram(
+    'knowledge_onnx_batch_size', 'Texts per ONNX session.run call', (1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+ONNX_BATCH_SEQUENCE_LENGTH = Histogram(
+    'knowledge_onnx_batch_sequence_length', 'Padded sequence length (tokens) of each ONNX batch',
+    (16, 32, 64, 128, 256, 512)
+)
+ONNX_BATCH_SECONDS = Histogram(
+    'knowledge_onnx_batch_seconds', 'Latency of one ONNX session.run call',
+    (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+SNAPSHOT_BUILD_SECONDS = Histogram(
+    'knowledge_snapshot_build_seconds', 'Seconds to build a knowledge-base snapshot or sync patch',
+    STAGE_BUCKETS, ['kind']
+)
+SNAPSHOT_BYTES = Counter(
+    'knowledge_snapshot_bytes_total', 'Bytes of snapshot and patch files built', ['kind']
+)
+
+
+def _embedding_cache_requests():
+    from .services import EmbeddingCacheService
+    with EmbeddingCacheService._counters_lock:
+        return {('hit',): EmbeddingCacheService.counters['hits'], ('miss',): EmbeddingCacheService.counters['misses']}
+
+
+def _ingestion_jobs():
+    from django.db.models import Count
+    from .models import IngestionJob
+    counts = {(status,): 0 for status in (IngestionJob.STATUS_QUEUED, IngestionJob.STATUS_RUNNING)}
+    for status, count in IngestionJob.objects.filter(
+        status__in=[IngestionJob.STATUS_QUEUED, IngestionJob.STATUS_RUNNING]
+    ).values_list('status').annotate(count=Count('pk')).order_by():
+        counts[(status,)] = count
+    return counts
+
+
+EMBEDDING_CACHE_REQUESTS = Callback(
+    'knowledge_embedding_cache_requests_total', 'Chunk embeddings served from the cache (hit) or computed (miss)',
+    'counter', _embedding_cache_requests, ['result']
+)
+INGESTION_JOBS = Callback(
+    'knowledge_ingestion_jobs', 'Ingestion jobs waiting or running (all processes; aggregate with max, not sum)',
+    'gauge', _ingestion_jobs, ['status'], shared=True
+)
@@ -0,0 +1,88 @@
+import re
+
+from django.conf import settings
+
+from . import profiling
+
+HEADER = 'X-Knowledge-Profile'
+
+DEFAULT_PATHS = [
+    r'^/api/knowledge/documents/$',
+    r'/download_knowledge_base/$',
+    r'/sync/$',
+    r'/chunks/$',
+]
+
+
+class ProfilingMiddleware:
+    """
+    Profile a request (see knowledge.profiling) when a staff user sends the
+    X-Knowledge-Profile header ("1", "sampling" or "cprofile"), or at random
+    with probability KNOWLEDGE_PROFILING_SAMPLE_RATE for requests to
+    KNOWLEDGE_PROFILING_PATHS. Profiled responses carry the profile name in
+    the same header. Must come after AuthenticationMiddleware.
+
+    Uploads started by a profiled request enqueue a job that is profiled too.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.paths = [re.compile(pattern) for pattern in getattr(settings, 'KNOWLEDGE_PROFILING_PATHS', DEFAULT_PATHS)]
+
+    def __call__(self, request):
+        mode = self._requested_mode(request)
+        if mode is None:
+            return self.get_response(request)
+
+        profiler = profiling.Profiler('request', f"{request.method} {request.path}", mode=mode).start()
+        request.knowledge_profile = profiler
+        try:
+            with profiler.attach():
+                response = self.get_response(request)
+        except BaseException:
+            profiler.stop()
+            raise
+
+        response[HEADER] = profiler.name
+        if response.streaming:
+            # Most of an export's work happens while the body is iterated, after this returns
+            response.streaming_content = self._profiled_stream(
+                response.streaming_content, profiler, request, response
+            )
+        else:
+            self._finish(profiler, request, response)
+        return response
+
+    def _requested_mode(self, request):
+        """Profiling mode for this request, or None to not profile it"""
+        default = getattr(settings, 'KNOWLEDGE_PROFILING_MODE', 'sampling')
+        requested = request.headers.get(HEADER, '').strip().lower()
+        if requested and request.user.is_staff:
+            if requested in ('0', 'off'):
+                return None
+            return requested if requested in profiling.MODES else default
+        if profiling.sampled() and any(pattern.search(request.path) for pattern in self.paths):
+            return default
+        return None
+
+    def _profiled_stream(self, content, profiler, request, response):
+        iterator = iter(content)
+        try:
+            while True:
+                with profiler.attach():
+                    try:
+                        block = next(iterator)
+                    except StopIteration:
+                        break
+                yield block
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+            self._finish(profiler, request, response)
+
+    @staticmethod
+    def _finish(profiler, request, response):
+        profiler.stop()
+        user = request.user.get_username() if request.user.is_authenticated else ''
+        profiling.save_quietly(profiler, status_code=response.status_code, user=user)
@@ -0,0 +1,41 @@
+# Generated by Django 6.1.2 on 2026-10-16 22:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestionJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed'), ('cancelled', 'Cancelled')], default='queued', max_length=20)),
+                ('stage', models.CharField(choices=[('pending', 'Pending'), ('parse', 'Parse'), ('chunk', 'Chunk'), ('embed', 'Embed'), ('store', 'Store'), ('done', 'Done')], default='pending', max_length=20)),
+                ('chunks_total', models.IntegerField(default=0)),
+                ('chunks_embedded', models.IntegerField(default=0)),
+                ('chunks_stored', models.IntegerField(default=0)),
+                ('stage_timings', models.JSONField(blank=True, default=dict)),
+                ('attempts', models.IntegerField(default=0)),
+                ('max_attempts', models.IntegerField(default=3)),
+                ('cancel_requested', models.BooleanField(default=False)),
+                ('error', models.TextField(blank=True, default='')),
+                ('worker', models.CharField(blank=True, default='', max_length=100)),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='knowledge.document')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='knowledge_i_status_44daab_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Converts Chunk.vector from JSON text to a raw float32 BLOB
+
+import numpy as np
+from django.db import migrations, models
+
+import knowledge.fields
+
+BATCH_SIZE = 1000
+
+
+def _convert(apps, source, target, encode):
+    Chunk = apps.get_model('knowledge', 'Chunk')
+    last_pk = 0
+    while True:
+        batch = list(
+            Chunk.objects.filter(pk__gt=last_pk).order_by('pk').only('pk', source)[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+        for chunk in batch:
+            setattr(chunk, target, encode(getattr(chunk, source)))
+        Chunk.objects.bulk_update(batch, [target])
+        last_pk = batch[-1].pk
+
+
+def json_to_blob(apps, schema_editor):
+    _convert(apps, 'vector', 'vector_blob', lambda value: np.asarray(value, dtype='<f4'))
+
+
+def blob_to_json(apps, schema_editor):
+    _convert(apps, 'vector_blob', 'vector', lambda value: np.asarray(value, dtype=np.float32).tolist())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0002_ingestionjob'),
+    ]
+
+    operations = [
+        # Nullable first so the migration can be reversed on a populated table
+        migrations.AlterField(
+            model_name='chunk',
+            name='vector',
+            field=models.JSONField(null=True),
+        ),
+        migrations.AddField(
+            model_name='chunk',
+            name='vector_blob',
+            field=knowledge.fields.VectorField(null=True),
+        ),
+        migrations.RunPython(json_to_blob, blob_to_json),
+        migrations.RemoveField(
+            model_name='chunk',
+            name='vector',
+        ),
+        migrations.RenameField(
+            model_name='chunk',
+            old_name='vector_blob',
+            new_name='vector',
+        ),
+        migrations.AlterField(
+            model_name='chunk',
+            name='vector',
+            field=knowledge.fields.VectorField(),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.1.2 on 2026-10-16 22:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0003_chunk_binary_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='content_version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
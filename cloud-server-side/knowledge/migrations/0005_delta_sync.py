@@ -0,0 +1,52 @@
+# Generated by Django 6.1.2 on 2026-10-16 22:46
+
+from django.db import migrations, models
+
+
+def start_sync_history(apps, schema_editor):
+    # Deletions before this migration left no tombstones, so devices
+    # holding an older snapshot must do a full download first
+    Course = apps.get_model('knowledge', 'Course')
+    Course.objects.update(sync_min_version=models.F('content_version'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0004_course_content_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('course_id', models.BigIntegerField()),
+                ('document_id', models.BigIntegerField()),
+                ('content_version', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['content_version'],
+            },
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='sync_min_version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='content_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['course', 'content_version'], name='knowledge_d_course__03aa4b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='documenttombstone',
+            index=models.Index(fields=['course_id', 'content_version'], name='knowledge_d_course__cce723_idx'),
+        ),
+        migrations.RunPython(start_sync_history, migrations.RunPython.noop),
+    ]
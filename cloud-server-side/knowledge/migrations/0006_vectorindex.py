@@ -0,0 +1,30 @@
+# Generated by Django 6.1.2 on 2026-10-16 22:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0005_delta_sync'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VectorIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('embedding_model', models.CharField(max_length=100)),
+                ('centroids', models.BinaryField()),
+                ('nlist', models.PositiveIntegerField()),
+                ('dimension', models.PositiveIntegerField()),
+                ('trained_chunk_count', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vector_indexes', to='knowledge.course')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('course', 'embedding_model'), name='unique_course_model_index')],
+            },
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Full-text (FTS5) index over Chunk.text, kept in sync by triggers (SQLite only)
+
+from django.db import migrations
+
+FTS_SQL = [
+    """
+    CREATE VIRTUAL TABLE knowledge_chunk_fts USING fts5(
+        text, content='knowledge_chunk', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER knowledge_chunk_fts_insert AFTER INSERT ON knowledge_chunk BEGIN
+        INSERT INTO knowledge_chunk_fts (rowid, text) VALUES (new.id, new.text);
+    END
+    """,
+    """
+    CREATE TRIGGER knowledge_chunk_fts_delete AFTER DELETE ON knowledge_chunk BEGIN
+        INSERT INTO knowledge_chunk_fts (knowledge_chunk_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    END
+    """,
+    """
+    CREATE TRIGGER knowledge_chunk_fts_update AFTER UPDATE OF text ON knowledge_chunk BEGIN
+        INSERT INTO knowledge_chunk_fts (knowledge_chunk_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        INSERT INTO knowledge_chunk_fts (rowid, text) VALUES (new.id, new.text);
+    END
+    """,
+    "INSERT INTO knowledge_chunk_fts (knowledge_chunk_fts) VALUES ('rebuild')",
+]
+
+DROP_SQL = [
+    "DROP TRIGGER IF EXISTS knowledge_chunk_fts_update",
+    "DROP TRIGGER IF EXISTS knowledge_chunk_fts_delete",
+    "DROP TRIGGER IF EXISTS knowledge_chunk_fts_insert",
+    "DROP TABLE IF EXISTS knowledge_chunk_fts",
+]
+
+
+def _run(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0006_vectorindex'),
+    ]
+
+    operations = [
+        migrations.RunPython(_run(FTS_SQL), _run(DROP_SQL)),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 6.1.2 on 2026-10-16 22:54
+
+import knowledge.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0007_chunk_fts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestionjob',
+            name='cache_hits',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='ingestionjob',
+            name='cache_misses',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='EmbeddingCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('embedding_model', models.CharField(max_length=100)),
+                ('text_hash', models.CharField(max_length=64)),
+                ('vector', knowledge.fields.VectorField()),
+                ('last_used_at', models.DateTimeField(db_index=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('embedding_model', 'text_hash'), name='unique_model_text_hash')],
+            },
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 6.1.2 on 2026-10-16 22:55
+
+import hashlib
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def hash_existing_files(apps, schema_editor):
+    """Fill in sha256 for documents whose files are still on disk"""
+    Document = apps.get_model('knowledge', 'Document')
+    for document in Document.objects.filter(sha256='').only('pk', 'file').iterator():
+        if not document.file or not document.file.storage.exists(document.file.name):
+            continue
+        digest = hashlib.sha256()
+        with document.file.open('rb') as f:
+            for block in f.chunks():
+                digest.update(block)
+        Document.objects.filter(pk=document.pk).update(sha256=digest.hexdigest())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0008_embedding_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='duplicate_of',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='duplicates', to='knowledge.document'),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='sha256',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['sha256'], name='knowledge_d_sha256_fce8bb_idx'),
+        ),
+        migrations.RunPython(hash_existing_files, migrations.RunPython.noop),
+    ]
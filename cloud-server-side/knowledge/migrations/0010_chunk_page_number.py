@@ -0,0 +1,18 @@
+# Generated by Django 6.1.2 on 2026-10-16 22:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0009_document_sha256'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chunk',
+            name='page_number',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 6.1.2 on 2026-10-16 23:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0010_chunk_page_number'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('kind', models.CharField(choices=[('request', 'Request'), ('job', 'Ingestion job')], max_length=20)),
+                ('label', models.CharField(max_length=255)),
+                ('status_code', models.PositiveIntegerField(blank=True, null=True)),
+                ('user', models.CharField(blank=True, default='', max_length=150)),
+                ('mode', models.CharField(max_length=20)),
+                ('duration_ms', models.FloatField()),
+                ('query_count', models.PositiveIntegerField(default=0)),
+                ('query_ms', models.FloatField(default=0)),
+                ('onnx_calls', models.PositiveIntegerField(default=0)),
+                ('onnx_ms', models.FloatField(default=0)),
+                ('raw_file', models.CharField(max_length=120)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='ingestionjob',
+            name='profile',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 6.1.2 on 2026-10-16 23:37
+
+import django.db.models.deletion
+import knowledge.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0011_request_profile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReembeddingJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('embedding_model', models.CharField(max_length=100)),
+                ('force', models.BooleanField(default=False)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed'), ('cancelled', 'Cancelled')], default='queued', max_length=20)),
+                ('last_chunk_id', models.BigIntegerField(default=0)),
+                ('chunks_total', models.IntegerField(default=0)),
+                ('chunks_done', models.IntegerField(default=0)),
+                ('cache_hits', models.IntegerField(default=0)),
+                ('cancel_requested', models.BooleanField(default=False)),
+                ('error', models.TextField(blank=True, default='')),
+                ('worker', models.CharField(blank=True, default='', max_length=100)),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('swapped_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('course', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='reembedding_jobs', to='knowledge.course')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ChunkShadowVector',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('vector', knowledge.fields.VectorField()),
+                ('chunk', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='knowledge.chunk')),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shadow_vectors', to='knowledge.reembeddingjob')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='reembeddingjob',
+            index=models.Index(fields=['status', 'created_at'], name='knowledge_r_status_5102cd_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='chunkshadowvector',
+            constraint=models.UniqueConstraint(fields=('job', 'chunk'), name='unique_shadow_vector_per_job'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 6.1.2 on 2026-10-16 23:42
+
+import django.db.models.deletion
+import knowledge.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0012_reembedding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='embedding_models',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.CreateModel(
+            name='ChunkEmbedding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('embedding_model', models.CharField(max_length=100)),
+                ('vector', knowledge.fields.VectorField()),
+                ('chunk', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='embeddings', to='knowledge.chunk')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['embedding_model', 'chunk'], name='knowledge_c_embeddi_0ff67d_idx')],
+                'constraints': [models.UniqueConstraint(fields=('chunk', 'embedding_model'), name='unique_chunk_embedding_per_model')],
+            },
+        ),
+    ]
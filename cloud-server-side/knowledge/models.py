@@ -1,5 +1,8 @@
+import numpy as np
+from django.conf import settings
 from django.db import models
-import json
+
+from .fields import VectorField
 
 
 class Course(models.Model):
@@ -7,6 +10,15 @@ class Course(models.Model):
     code = models.CharField(max_length=50, unique=True)
     name = models.CharField(max_length=255)
     description = models.TextField(blank=True, null=True)
+    # Bumped whenever the course, its documents or its chunks change;
+    # identifies the knowledge-base snapshot built from this content
+    content_version = models.PositiveIntegerField(default=1, editable=False)
+    # Oldest base version a device can delta-sync from (tombstones are kept from here on)
+    sync_min_version = models.PositiveIntegerField(default=1, editable=False)
+    # Embedding models the course's chunks are embedded with, primary first (empty:
+    # KNOWLEDGE_EMBEDDING_MODEL). Chunk.vector holds the primary model's vector, used
+    # for server-side search; the others are ChunkEmbedding rows for devices running them
+    embedding_models = models.JSONField(default=list, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -15,6 +27,44 @@ class Course(models.Model):
     
     def __str__(self):
         return f"{self.code} - {self.name}"
+    
+    def embedding_model_names(self) -> list:
+        """Declared embedding models, primary first"""
+        return list(self.embedding_models) or [
+            getattr(settings, 'KNOWLEDGE_EMBEDDING_MODEL', 'exp-models/dragonkue-KoEn-E5-Tiny-ONNX')
+        ]
+    
+    @property
+    def primary_embedding_model(self) -> str:
+        return self.embedding_model_names()[0]
+    
+    def save(self, *args, **kwargs):
+        # content_version only moves through bump_content_version(), so saving
+        # a stale instance can never roll it back to an already-used version
+        updating = not self._state.adding and self.pk is not None
+        if updating and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'content_version'
+            ]
+        super().save(*args, **kwargs)
+        if updating:
+            Course.bump_content_version(self.pk)
+    
+    @staticmethod
+    def bump_content_version(course_id, document_id=None):
+        """
+        Atomically mark the course content as changed.
+        If document_id is given, that document is stamped with the new
+        version so delta syncs from older versions include it.
+        """
+        Course.objects.filter(pk=course_id).update(content_version=models.F('content_version') + 1)
+        if document_id is not None:
+            Document.objects.filter(pk=document_id).update(
+                content_version=models.Subquery(
+                    Course.objects.filter(pk=course_id).values('content_version')[:1]
+                )
+            )
 
 
 class Document(models.Model):
@@ -27,10 +77,22 @@ class Document(models.Model):
         choices=[('pdf', 'PDF'), ('txt', 'Text'), ('docx', 'Word')],
         default='txt'
     )
+    # Course content_version at which this document or its chunks last changed
+    content_version = models.PositiveIntegerField(default=0, editable=False)
+    # SHA-256 of the uploaded file, used to detect duplicate uploads
+    sha256 = models.CharField(max_length=64, blank=True, default='', editable=False)
+    # Earlier upload of the same file whose file and chunks this document reuses
+    duplicate_of = models.ForeignKey(
+        'self', on_delete=models.SET_NULL, blank=True, null=True, editable=False, related_name='duplicates'
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['course', 'content_version']),
+            models.Index(fields=['sha256']),
+        ]
     
     def __str__(self):
         return f"{self.course.code} - {self.title}"
@@ -41,9 +103,11 @@ class Chunk(models.Model):
     document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='chunks')
     text = models.TextField()
     chunk_index = models.IntegerField()
-    # Store vector as JSON
-    vector = models.JSONField()
+    # Raw little-endian float32 BLOB, loaded as a NumPy array
+    vector = VectorField()
     embedding_model = models.CharField(max_length=100, default='exp-models/dragonkue-KoEn-E5-Tiny-ONNX')
+    # 1-based page the chunk starts on (PDFs only)
+    page_number = models.PositiveIntegerField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -55,3 +119,260 @@ class Chunk(models.Model):
     
     def __str__(self):
         return f"{self.document.title} - Chunk {self.chunk_index}"
+
+
+class ChunkEmbedding(models.Model):
+    """Vector of a chunk for one of its course's additional (non-primary) embedding models"""
+    chunk = models.ForeignKey(Chunk, on_delete=models.CASCADE, related_name='embeddings')
+    embedding_model = models.CharField(max_length=100)
+    vector = VectorField()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['chunk', 'embedding_model'], name='unique_chunk_embedding_per_model'),
+        ]
+        indexes = [
+            models.Index(fields=['embedding_model', 'chunk']),
+        ]
+    
+    def __str__(self):
+        return f"Chunk {self.chunk_id} - {self.embedding_model}"
+
+
+class VectorIndex(models.Model):
+    """
+    IVF (inverted file) index over a course's vectors for one embedding model.
+    
+    Only the k-means centroids are stored; chunks are assigned to their
+    nearest centroid when a snapshot or search matrix is built, so new
+    chunks slot into the existing lists without retraining.
+    """
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='vector_indexes')
+    embedding_model = models.CharField(max_length=100)
+    # (nlist, dim) L2-normalized float32 centroids
+    centroids = models.BinaryField()
+    nlist = models.PositiveIntegerField()
+    dimension = models.PositiveIntegerField()
+    # Chunks the centroids were trained on; the index is retrained once the course outgrows it
+    trained_chunk_count = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['course', 'embedding_model'], name='unique_course_model_index'),
+        ]
+    
+    def __str__(self):
+        return f"{self.course.code} - {self.embedding_model} (IVF {self.nlist})"
+    
+    def centroid_matrix(self):
+        return np.frombuffer(self.centroids, dtype='<f4').reshape(self.nlist, self.dimension)
+
+
+class EmbeddingCacheEntry(models.Model):
+    """
+    Embedding of one normalized chunk text, keyed by model and text hash,
+    so identical chunks are not re-embedded. Least recently used entries
+    are evicted once the cache is full.
+    """
+    embedding_model = models.CharField(max_length=100)
+    # SHA-256 hex digest of the normalized chunk text
+    text_hash = models.CharField(max_length=64)
+    vector = VectorField()
+    last_used_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['embedding_model', 'text_hash'], name='unique_model_text_hash'),
+        ]
+    
+    def __str__(self):
+        return f"{self.embedding_model} - {self.text_hash[:12]}"
+
+
+class DocumentTombstone(models.Model):
+    """Record of a deleted document, so delta syncs can tell devices to remove it"""
+    # Plain ids rather than foreign keys: the rows they point to are gone
+    course_id = models.BigIntegerField()
+    document_id = models.BigIntegerField()
+    content_version = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['content_version']
+        indexes = [
+            models.Index(fields=['course_id', 'content_version']),
+        ]
+    
+    def __str__(self):
+        return f"Course {self.course_id} - deleted document {self.document_id} (v{self.content_version})"
+
+
+class IngestionJob(models.Model):
+    """Background parse/chunk/embed/store run for an uploaded document"""
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CANCELLED = 'cancelled'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SUCCEEDED, 'Succeeded'),
+        (STATUS_FAILED, 'Failed'),
+        (STATUS_CANCELLED, 'Cancelled'),
+    ]
+    FINISHED_STATUSES = (STATUS_SUCCEEDED, STATUS_FAILED, STATUS_CANCELLED)
+
+    STAGE_CHOICES = [
+        ('pending', 'Pending'),
+        ('parse', 'Parse'),
+        ('chunk', 'Chunk'),
+        ('embed', 'Embed'),
+        ('store', 'Store'),
+        ('done', 'Done'),
+    ]
+
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='jobs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    stage = models.CharField(max_length=20, choices=STAGE_CHOICES, default='pending')
+    chunks_total = models.IntegerField(default=0)
+    chunks_embedded = models.IntegerField(default=0)
+    chunks_stored = models.IntegerField(default=0)
+    # Chunks whose vectors came from the embedding cache / had to be embedded
+    cache_hits = models.IntegerField(default=0)
+    cache_misses = models.IntegerField(default=0)
+    # Seconds spent in each finished stage, e.g. {"parse": 1.2, "chunk": 0.3}
+    stage_timings = models.JSONField(default=dict, blank=True)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    cancel_requested = models.BooleanField(default=False)
+    # Run the job under a Profiler (see knowledge.profiling)
+    profile = models.BooleanField(default=False)
+    error = models.TextField(blank=True, default='')
+    worker = models.CharField(max_length=100, blank=True, default='')
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"Job {self.id} - {self.document.title} ({self.status})"
+
+    @property
+    def is_finished(self):
+        return self.status in self.FINISHED_STATUSES
+
+
+class ReembeddingJob(models.Model):
+    """
+    Re-embedding of a course's chunks (or every course's, without a course)
+    with embedding_model: chunks embedded with another model, or all of
+    them with force. New vectors go to ChunkShadowVector rows, checkpointed
+    batch by batch, and replace the live ones in one transaction at the end.
+    """
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CANCELLED = 'cancelled'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SUCCEEDED, 'Succeeded'),
+        (STATUS_FAILED, 'Failed'),
+        (STATUS_CANCELLED, 'Cancelled'),
+    ]
+    FINISHED_STATUSES = (STATUS_SUCCEEDED, STATUS_FAILED, STATUS_CANCELLED)
+
+    course = models.ForeignKey(
+        Course, on_delete=models.CASCADE, related_name='reembedding_jobs', blank=True, null=True
+    )
+    embedding_model = models.CharField(max_length=100)
+    # Re-embed chunks already embedded with embedding_model too (e.g. after a tokenizer fix)
+    force = models.BooleanField(default=False)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    # Checkpoint: chunks up to this id are embedded into shadow vectors
+    last_chunk_id = models.BigIntegerField(default=0)
+    chunks_total = models.IntegerField(default=0)
+    chunks_done = models.IntegerField(default=0)
+    cache_hits = models.IntegerField(default=0)
+    cancel_requested = models.BooleanField(default=False)
+    error = models.TextField(blank=True, default='')
+    worker = models.CharField(max_length=100, blank=True, default='')
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    swapped_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+    def __str__(self):
+        scope = self.course.code if self.course_id else 'all courses'
+        return f"Re-embedding {self.id} - {scope} with {self.embedding_model} ({self.status})"
+
+    @property
+    def is_finished(self):
+        return self.status in self.FINISHED_STATUSES
+
+
+class ChunkShadowVector(models.Model):
+    """New vector of a chunk, computed by a re-embedding job and not yet live"""
+    job = models.ForeignKey(ReembeddingJob, on_delete=models.CASCADE, related_name='shadow_vectors')
+    chunk = models.ForeignKey(Chunk, on_delete=models.CASCADE, related_name='+')
+    vector = VectorField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['job', 'chunk'], name='unique_shadow_vector_per_job'),
+        ]
+
+
+class RequestProfile(models.Model):
+    """
+    Profile of one sampled or explicitly profiled request or ingestion job.
+    The report and raw profile live in files under KNOWLEDGE_PROFILE_DIR;
+    only the newest KNOWLEDGE_PROFILE_KEEP profiles are kept.
+    """
+    KIND_REQUEST = 'request'
+    KIND_JOB = 'job'
+    KIND_CHOICES = [
+        (KIND_REQUEST, 'Request'),
+        (KIND_JOB, 'Ingestion job'),
+    ]
+
+    name = models.CharField(max_length=100, unique=True)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    # "GET /api/knowledge/courses/1/chunks/" or "job 12 (notes.pdf)"
+    label = models.CharField(max_length=255)
+    status_code = models.PositiveIntegerField(blank=True, null=True)
+    user = models.CharField(max_length=150, blank=True, default='')
+    mode = models.CharField(max_length=20)
+    duration_ms = models.FloatField()
+    query_count = models.PositiveIntegerField(default=0)
+    query_ms = models.FloatField(default=0)
+    onnx_calls = models.PositiveIntegerField(default=0)
+    onnx_ms = models.FloatField(default=0)
+    # Name of the .prof (cProfile) or .folded (stack samples) file next to the JSON report
+    raw_file = models.CharField(max_length=120)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.label} ({self.duration_ms:.0f} ms)"
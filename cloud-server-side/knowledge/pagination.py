@@ -0,0 +1,15 @@
+from rest_framework.pagination import CursorPagination
+
+
+class ChunkCursorPagination(CursorPagination):
+    """
+    Keyset pagination over one document's chunks.
+    
+    Pages continue from the last chunk_index seen (a range scan of the
+    (document, chunk_index) index), so page 1000 costs the same as page 1,
+    unlike OFFSET pagination.
+    """
+    ordering = 'chunk_index'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
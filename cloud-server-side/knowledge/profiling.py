@@ -0,0 +1,292 @@
+"""
+Opt-in profiling of single requests and ingestion jobs.
+
+A Profiler records, while it runs:
+    - a statistical profile (stack samples of the threads attached to it)
+      or a cProfile profile,
+    - ORM query count and time, the slowest queries and the most repeated
+      query templates (N+1 patterns),
+    - ONNX session.run calls and time.
+
+Threads join a profile with Profiler.attach(); the ingestion pipeline's
+stage threads attach to the profile of the thread that started them.
+Finished profiles are saved as RequestProfile rows plus files in
+KNOWLEDGE_PROFILE_DIR, keeping the newest KNOWLEDGE_PROFILE_KEEP (a ring
+buffer), and are browsable in the admin.
+"""
+import cProfile
+import io
+import json
+import logging
+import pstats
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+MODES = ('sampling', 'cprofile')
+
+_current: ContextVar = ContextVar('knowledge_profiler', default=None)
+# cProfile hooks every thread of the process (sys.monitoring), so only one can run at a time
+_cprofile_lock = threading.Lock()
+
+
+def current():
+    """The Profiler the calling thread is attached to, or None"""
+    return _current.get()
+
+
+def record_onnx(seconds: float, texts: int):
+    """Count an ONNX session.run call against the current profile, if any"""
+    profiler = _current.get()
+    if profiler is not None:
+        profiler.record_onnx(seconds, texts)
+
+
+def sampled(setting: str = 'KNOWLEDGE_PROFILING_SAMPLE_RATE') -> bool:
+    """Whether to profile a request or job nobody asked to profile, at the rate in setting"""
+    from django.conf import settings
+    rate = getattr(settings, setting, 0.0)
+    return rate > 0 and random.random() < rate
+
+
+def save_quietly(profiler, **fields):
+    """Profiler.save(), logging instead of raising: a profile must never fail the work it measured"""
+    try:
+        return profiler.save(**fields)
+    except Exception:
+        logger.exception("profile not saved", extra={'profile': profiler.name})
+        return None
+
+
+def profile_dir() -> Path:
+    from django.conf import settings
+    return Path(getattr(settings, 'KNOWLEDGE_PROFILE_DIR', Path(__file__).resolve().parent.parent / 'profiles'))
+
+
+class Profiler:
+    """Profile of one request or job; see the module docstring"""
+
+    SLOWEST_QUERIES = 10
+    REPEATED_QUERIES = 10
+    REPORT_LINES = 60
+    MAX_STACK_DEPTH = 64
+
+    def __init__(self, kind: str, label: str, mode: str = None, interval: float = None):
+        from django.conf import settings
+
+        self.kind = kind
+        self.label = label
+        self.mode = mode or getattr(settings, 'KNOWLEDGE_PROFILING_MODE', 'sampling')
+        if self.mode not in MODES:
+            raise ValueError(f"Unsupported profiling mode: {self.mode}")
+        self.interval = interval or getattr(settings, 'KNOWLEDGE_PROFILING_INTERVAL', 0.005)
+        self.name = f"{time.strftime('%Y%m%dT%H%M%S')}-{kind}-{uuid.uuid4().hex[:8]}"
+        self.note = ''
+
+        self._lock = threading.Lock()
+        self.query_count = 0
+        self.query_seconds = 0.0
+        self._slowest = []
+        self._templates = Counter()
+        self.onnx_calls = 0
+        self.onnx_texts = 0
+        self.onnx_seconds = 0.0
+
+        self._threads = set()
+        self._stacks = Counter()
+        self._samples = 0
+        self._sampler = None
+        self._cprofile = None
+        self._stop = threading.Event()
+        self._started = None
+        self.seconds = 0.0
+
+    # Lifecycle
+
+    def start(self):
+        if self.mode == 'cprofile':
+            if _cprofile_lock.acquire(blocking=False):
+                self._cprofile = cProfile.Profile()
+                self._cprofile.enable()
+            else:
+                self.mode = 'sampling'
+                self.note = 'cProfile was busy with another profile; sampled instead'
+        if self.mode == 'sampling':
+            self._sampler = threading.Thread(target=self._sample, name=f'profiler-{self.name}', daemon=True)
+            self._sampler.start()
+        self._started = time.perf_counter()
+        return self
+
+    def stop(self):
+        if self._started is None:
+            return
+        self.seconds = time.perf_counter() - self._started
+        self._started = None
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            _cprofile_lock.release()
+        if self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+
+    @contextmanager
+    def attach(self):
+        """Attribute the calling thread's stack samples, queries and ONNX calls to this profile"""
+        from django.db import connection
+
+        token = _current.set(self)
+        thread_id = threading.get_ident()
+        with self._lock:
+            self._threads.add(thread_id)
+        try:
+            with connection.execute_wrapper(self._query_wrapper):
+                yield self
+        finally:
+            with self._lock:
+                self._threads.discard(thread_id)
+            _current.reset(token)
+
+    @contextmanager
+    def running(self):
+        """start(), attach() and stop() around the block"""
+        self.start()
+        try:
+            with self.attach():
+                yield self
+        finally:
+            self.stop()
+
+    # Collectors
+
+    def _query_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.query_count += 1
+                self.query_seconds += elapsed
+                self._templates[sql] += 1
+                self._slowest.append((elapsed, sql[:1000]))
+                if len(self._slowest) > 4 * self.SLOWEST_QUERIES:
+                    self._slowest = sorted(self._slowest, reverse=True)[:self.SLOWEST_QUERIES]
+
+    def record_onnx(self, seconds: float, texts: int):
+        with self._lock:
+            self.onnx_calls += 1
+            self.onnx_texts += texts
+            self.onnx_seconds += seconds
+
+    def _sample(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                threads = set(self._threads)
+            frames = sys._current_frames()
+            for thread_id in threads:
+                frame = frames.get(thread_id)
+                if frame is None or thread_id == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.MAX_STACK_DEPTH:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self._stacks[';'.join(reversed(stack))] += 1
+                self._samples += 1
+
+    # Results
+
+    def summary(self) -> dict:
+        with self._lock:
+            slowest = sorted(self._slowest, reverse=True)[:self.SLOWEST_QUERIES]
+            repeated = [(count, sql) for sql, count in self._templates.most_common(self.REPEATED_QUERIES) if count > 1]
+            return {
+                'name': self.name,
+                'kind': self.kind,
+                'label': self.label,
+                'mode': self.mode,
+                'note': self.note,
+                'seconds': round(self.seconds, 4),
+                'query_count': self.query_count,
+                'query_seconds': round(self.query_seconds, 4),
+                'slowest_queries': [{'ms': round(1000 * seconds, 2), 'sql': sql} for seconds, sql in slowest],
+                'repeated_queries': [{'count': count, 'sql': sql[:1000]} for count, sql in repeated],
+                'onnx_calls': self.onnx_calls,
+                'onnx_texts': self.onnx_texts,
+                'onnx_seconds': round(self.onnx_seconds, 4),
+                'samples': self._samples,
+            }
+
+    def report(self) -> str:
+        """Text report: top functions of the cProfile or stack-sample profile"""
+        if self._cprofile is not None:
+            out = io.StringIO()
+            stats = pstats.Stats(self._cprofile, stream=out)
+            stats.sort_stats('cumulative').print_stats(self.REPORT_LINES)
+            return out.getvalue()
+
+        inclusive, own = Counter(), Counter()
+        for stack, count in self._stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            for frame in set(frames):
+                inclusive[frame] += count
+        total = max(self._samples, 1)
+        lines = [f"{self._samples} samples every {self.interval * 1000:g} ms", '', 'Own time (top of stack):']
+        lines += [f"  {100 * count / total:5.1f}%  {frame}" for frame, count in own.most_common(self.REPORT_LINES // 2)]
+        lines += ['', 'Total time (anywhere on stack):']
+        lines += [f"  {100 * count / total:5.1f}%  {frame}" for frame, count in inclusive.most_common(self.REPORT_LINES // 2)]
+        return '\n'.join(lines) + '\n'
+
+    def save(self, **fields):
+        """
+        Write the profile's files and its RequestProfile row (fields are
+        extra model fields such as method, path and status_code), then drop
+        the oldest profiles beyond KNOWLEDGE_PROFILE_KEEP.
+        """
+        from django.conf import settings
+        from .models import RequestProfile
+
+        directory = profile_dir()
+        directory.mkdir(parents=True, exist_ok=True)
+        summary = self.summary()
+        (directory / f"{self.name}.json").write_text(
+            json.dumps({**summary, **fields, 'report': self.report()}, indent=2, default=str), encoding='utf-8'
+        )
+        # Raw profile for external viewers: pstats dump (snakeviz) or folded stacks (flamegraph, speedscope)
+        if self._cprofile is not None:
+            raw_name = f"{self.name}.prof"
+            self._cprofile.dump_stats(str(directory / raw_name))
+        else:
+            raw_name = f"{self.name}.folded"
+            (directory / raw_name).write_text(
+                ''.join(f"{stack} {count}\n" for stack, count in self._stacks.most_common()), encoding='utf-8'
+            )
+
+        profile = RequestProfile.objects.create(
+            name=self.name, kind=self.kind, label=self.label[:255], mode=self.mode,
+            duration_ms=round(1000 * self.seconds, 2), query_count=self.query_count,
+            query_ms=round(1000 * self.query_seconds, 2), onnx_calls=self.onnx_calls,
+            onnx_ms=round(1000 * self.onnx_seconds, 2), raw_file=raw_name, **fields
+        )
+
+        keep = getattr(settings, 'KNOWLEDGE_PROFILE_KEEP', 200)
+        stale = RequestProfile.objects.order_by('-created_at', '-pk').values_list('pk', flat=True)[keep:]
+        # Deleting rows also deletes their files (post_delete signal)
+        for old in RequestProfile.objects.filter(pk__in=list(stale)):
+            old.delete()
+        logger.info("profile saved", extra={
+            'profile': self.name, 'label': self.label, 'mode': self.mode, 'seconds': summary['seconds'],
+            'query_count': self.query_count, 'onnx_calls': self.onnx_calls,
+        })
+        return profile
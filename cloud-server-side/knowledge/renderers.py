@@ -0,0 +1,20 @@
+import json
+
+from rest_framework.renderers import BaseRenderer
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Newline-delimited JSON. Lets clients pick streaming exports with
+    ?format=ndjson or Accept: application/x-ndjson; views stream the rows
+    themselves, so this only renders errors and other plain responses.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+    
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        return ''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in rows).encode('utf-8')
@@ -1,27 +1,49 @@
 from rest_framework import serializers
-from .models import Course, Document, Chunk
+from django.utils import timezone
+from .models import Course, Document, Chunk, IngestionJob, ReembeddingJob
+from .services import DocumentDedupService
 
 
 class CourseSerializer(serializers.ModelSerializer):
     document_count = serializers.SerializerMethodField()
+    embedding_models = serializers.ListField(
+        child=serializers.CharField(max_length=100), required=False, allow_empty=True,
+        help_text="Embedding models, primary first (empty: the server default). "
+                  "Devices download the vectors of one of them."
+    )
     
     class Meta:
         model = Course
-        fields = ['id', 'code', 'name', 'description', 'document_count', 'created_at', 'updated_at']
+        fields = ['id', 'code', 'name', 'description', 'embedding_models', 'document_count', 'created_at', 'updated_at']
     
     def get_document_count(self, obj):
-        return obj.documents.count()
+        # Annotated by CourseViewSet; freshly created/updated instances fall back to a query
+        count = getattr(obj, 'document_count', None)
+        return obj.documents.count() if count is None else count
+    
+    def validate_embedding_models(self, value):
+        if len(set(value)) != len(value):
+            raise serializers.ValidationError("Each embedding model can only be listed once.")
+        if self.instance is not None and Chunk.objects.filter(document__course=self.instance).exists():
+            primary = Course(embedding_models=value).primary_embedding_model
+            if primary != self.instance.primary_embedding_model:
+                raise serializers.ValidationError(
+                    "The primary embedding model of a course with chunks changes through a re-embedding "
+                    "job (/api/knowledge/reembeddings/), which switches it once the new vectors are in."
+                )
+        return value
 
 
 class ChunkSerializer(serializers.ModelSerializer):
     """Chunks with vectors - use for download/export only"""
+    vector = serializers.ListField(child=serializers.FloatField(), read_only=True)
     document_title = serializers.CharField(source='document.title', read_only=True)
     document_file = serializers.CharField(source='document.file.name', read_only=True)
     course_code = serializers.CharField(source='document.course.code', read_only=True)
     
     class Meta:
         model = Chunk
-        fields = ['id', 'text', 'chunk_index', 'vector', 'embedding_model', 'document_title', 'document_file', 'course_code']
+        fields = ['id', 'text', 'chunk_index', 'page_number', 'vector', 'embedding_model', 'document_title', 'document_file', 'course_code']
 
 
 class ChunkSummarySerializer(serializers.ModelSerializer):
@@ -32,7 +54,7 @@ class ChunkSummarySerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Chunk
-        fields = ['id', 'text', 'chunk_index', 'embedding_model', 'document_title', 'document_file', 'course_code', 'created_at']
+        fields = ['id', 'text', 'chunk_index', 'page_number', 'embedding_model', 'document_title', 'document_file', 'course_code', 'created_at']
 
 
 class DocumentSerializer(serializers.ModelSerializer):
@@ -42,10 +64,12 @@ class DocumentSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Document
-        fields = ['id', 'title', 'course', 'course_code', 'file', 'file_type', 'chunk_count', 'created_at']
+        fields = ['id', 'title', 'course', 'course_code', 'file', 'file_type', 'sha256', 'duplicate_of', 'chunk_count', 'created_at']
     
     def get_chunk_count(self, obj):
-        return obj.chunks.count()
+        # Annotated by DocumentViewSet; freshly created/updated instances fall back to a query
+        count = getattr(obj, 'chunk_count', None)
+        return obj.chunks.count() if count is None else count
 
 
 class DocumentDetailSerializer(serializers.ModelSerializer):
@@ -56,14 +80,100 @@ class DocumentDetailSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Document
-        fields = ['id', 'title', 'course', 'course_code', 'file', 'file_type', 'chunk_count', 'created_at', 'chunks']
+        fields = ['id', 'title', 'course', 'course_code', 'file', 'file_type', 'sha256', 'duplicate_of', 'chunk_count', 'created_at', 'chunks']
     
     def get_chunk_count(self, obj):
-        return obj.chunks.count()
+        # Annotated by DocumentViewSet; freshly created/updated instances fall back to a query
+        count = getattr(obj, 'chunk_count', None)
+        return obj.chunks.count() if count is None else count
 
 
 class DocumentUploadSerializer(serializers.ModelSerializer):
     """For uploading documents"""
+    on_duplicate = serializers.ChoiceField(
+        choices=DocumentDedupService.POLICIES, write_only=True, required=False,
+        help_text="What to do if the same file was uploaded before: reuse its chunks, reject, or ingest again"
+    )
+    
     class Meta:
         model = Document
-        fields = ['id', 'title', 'file', 'course', 'file_type']
+        fields = ['id', 'title', 'file', 'course', 'file_type', 'on_duplicate']
+    
+    def create(self, validated_data):
+        validated_data.pop('on_duplicate', None)
+        return super().create(validated_data)
+
+
+class IngestionJobSerializer(serializers.ModelSerializer):
+    """Ingestion job status with progress and throughput"""
+    document_title = serializers.CharField(source='document.title', read_only=True)
+    progress = serializers.SerializerMethodField()
+    elapsed_seconds = serializers.SerializerMethodField()
+    chunks_per_second = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = IngestionJob
+        fields = [
+            'id', 'document', 'document_title', 'status', 'stage', 'progress',
+            'chunks_total', 'chunks_embedded', 'chunks_stored', 'cache_hits', 'cache_misses', 'elapsed_seconds',
+            'chunks_per_second', 'stage_timings', 'attempts', 'max_attempts',
+            'cancel_requested', 'error', 'created_at', 'started_at', 'finished_at'
+        ]
+        read_only_fields = fields
+    
+    def get_progress(self, obj):
+        """Fraction of work done; embedding and storing each count for half"""
+        if obj.status == IngestionJob.STATUS_SUCCEEDED:
+            return 1.0
+        if not obj.chunks_total:
+            return 0.0
+        return round((obj.chunks_embedded + obj.chunks_stored) / (2 * obj.chunks_total), 4)
+    
+    def get_elapsed_seconds(self, obj):
+        if not obj.started_at:
+            return None
+        end = obj.finished_at or timezone.now()
+        return round((end - obj.started_at).total_seconds(), 3)
+    
+    def get_chunks_per_second(self, obj):
+        elapsed = self.get_elapsed_seconds(obj)
+        if not elapsed:
+            return None
+        return round(max(obj.chunks_embedded, obj.chunks_stored) / elapsed, 2)
+
+
+class ReembeddingJobSerializer(serializers.ModelSerializer):
+    """Re-embedding job status with progress and throughput"""
+    course_code = serializers.CharField(source='course.code', read_only=True, default=None)
+    progress = serializers.SerializerMethodField()
+    chunks_per_second = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = ReembeddingJob
+        fields = [
+            'id', 'course', 'course_code', 'embedding_model', 'force', 'status', 'progress',
+            'chunks_total', 'chunks_done', 'cache_hits', 'chunks_per_second', 'last_chunk_id',
+            'cancel_requested', 'error', 'created_at', 'started_at', 'swapped_at', 'finished_at'
+        ]
+        read_only_fields = fields
+    
+    def get_progress(self, obj):
+        if obj.swapped_at:
+            return 1.0
+        if not obj.chunks_total:
+            return 0.0
+        return round(obj.chunks_done / obj.chunks_total, 4)
+    
+    def get_chunks_per_second(self, obj):
+        if not obj.started_at:
+            return None
+        # Includes the time the job spent paused for uploads
+        elapsed = ((obj.finished_at or timezone.now()) - obj.started_at).total_seconds()
+        return round(obj.chunks_done / elapsed, 2) if elapsed > 0 else None
+
+
+class ReembeddingRequestSerializer(serializers.Serializer):
+    """Parameters of a re-embedding request; no course means every course"""
+    course = serializers.PrimaryKeyRelatedField(queryset=Course.objects.all(), required=False, allow_null=True)
+    embedding_model = serializers.CharField(max_length=100, required=False)
+    force = serializers.BooleanField(default=False)
@@ -1,10 +1,25 @@
 import sqlite3
 import json
+import logging
 from typing import List, Dict, Any
 import numpy as np
 import os
 from pathlib import Path
-import sys
+import threading
+import itertools
+import queue
+import time
+import bisect
+import contextlib
+import re
+import hashlib
+import importlib.util
+import unicodedata
+from collections import OrderedDict
+
+from . import metrics, profiling
+
+logger = logging.getLogger(__name__)
 
 
 # Set up embedding cache directory
@@ -12,36 +27,183 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 PRETRAINED_MODELS_DIR = BASE_DIR / 'pretrained_models'
 PRETRAINED_MODELS_DIR.mkdir(exist_ok=True)
 
+DEFAULT_EMBEDDING_MODEL = "exp-models/dragonkue-KoEn-E5-Tiny-ONNX"
+
+# Between pages of extracted document text
+PAGE_SEPARATOR = "\n\n"
+
+# ONNX Runtime execution profiles for the embedding session (KNOWLEDGE_ONNX_PROFILE):
+#   variant: 'fp32' model file, or an 'int8' x86 variant (selected, or produced by dynamic quantization)
+#   optimize: full graph optimization, with the optimized graph saved and reused by later loads
+#   tune_threads: intra-op threads split between the threads that share the session
+ONNX_PROFILES = {
+    'default': {'variant': 'fp32', 'optimize': False, 'tune_threads': False},
+    'optimized': {'variant': 'fp32', 'optimize': True, 'tune_threads': True},
+    'int8': {'variant': 'int8', 'optimize': True, 'tune_threads': True},
+}
+
+# Prebuilt int8 x86 variants (as exported by Optimum) and the CPU flag each needs, best first
+INT8_X86_MODEL_FILES = [
+    ('model_qint8_avx512_vnni.onnx', 'avx512_vnni'),
+    ('model_qint8_avx512.onnx', 'avx512f'),
+    ('model_quint8_avx2.onnx', 'avx2'),
+    ('model_int8.onnx', None),
+    ('model_quantized.onnx', None),
+]
+# Written next to the fp32 model when no prebuilt variant fits
+INT8_X86_PRODUCED_FILE = 'model_qint8_x86.onnx'
+# Graphs saved by full optimization (optimized_model_filepath)
+OPTIMIZED_MODELS_DIR = PRETRAINED_MODELS_DIR / 'ort-optimized'
+
+
+def _cpu_flags() -> set:
+    """Instruction set flags of this CPU (empty where /proc/cpuinfo is unavailable)"""
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('flags'):
+                    return set(line.split(':', 1)[1].split())
+    except OSError:
+        pass
+    return set()
+
 
 class EmbeddingService:
     """Service for generating embeddings using ONNX models from HuggingFace"""
     
-    def __init__(self, model_name: str = "exp-models/dragonkue-KoEn-E5-Tiny-ONNX"):
+    # Process-wide registry of loaded services, keyed by model name
+    _instances: Dict[str, "EmbeddingService"] = {}
+    _instances_lock = threading.Lock()
+    # Threads expected to call the shared session at once (set_concurrency)
+    _concurrency = None
+    # Set in EmbeddingProcessPool worker processes, which always split the cores
+    _pool_worker = False
+    
+    def __init__(self, model_name: str = DEFAULT_EMBEDDING_MODEL, profile: str = None, processes: int = None):
         """
         Initialize embedding service with ONNX model.
         Downloads model from HuggingFace Hub to local cache if not present.
+        
+        profile names one of ONNX_PROFILES (default: KNOWLEDGE_ONNX_PROFILE).
+        With processes > 1 (default: KNOWLEDGE_EMBEDDING_PROCESSES), large
+        embed_array calls run on an EmbeddingProcessPool of that many
+        processes; the tokenizer and a session stay in this process for
+        chunking and small calls such as search queries.
+        
+        Prefer EmbeddingService.get_shared() in request handlers so the
+        tokenizer and ONNX session are loaded once per process.
         """
+        from django.conf import settings
+        
         self.model_name = model_name
+        self.profile = profile or getattr(settings, 'KNOWLEDGE_ONNX_PROFILE', 'optimized')
+        if self.profile not in ONNX_PROFILES:
+            raise ValueError(f"Unknown ONNX profile: {self.profile}")
+        self.processes = processes if processes is not None else getattr(settings, 'KNOWLEDGE_EMBEDDING_PROCESSES', 0)
         self.model_path = None
+        self.onnx_model_path = None
         self.tokenizer = None
         self.session = None
+        self._pool = None
+        self._pool_lock = threading.Lock()
         self._init_model()
     
+    @classmethod
+    def set_concurrency(cls, threads: int):
+        """
+        Number of threads that will embed at the same time in this process
+        (the ingestion worker count). Sessions loaded afterwards split the
+        CPU cores between them; see _session_options.
+        """
+        cls._concurrency = max(1, threads)
+    
+    @classmethod
+    def get_shared(cls, model_name: str = None) -> "EmbeddingService":
+        """
+        Return the process-wide service for model_name, loading it on first use.
+        
+        Loading is serialized per process, so concurrent requests never build
+        a second ONNX session for the same model.
+        """
+        if model_name is None:
+            from django.conf import settings
+            model_name = getattr(settings, 'KNOWLEDGE_EMBEDDING_MODEL', DEFAULT_EMBEDDING_MODEL)
+        
+        service = cls._instances.get(model_name)
+        if service is not None:
+            return service
+        
+        with cls._instances_lock:
+            service = cls._instances.get(model_name)
+            if service is None:
+                service = cls(model_name)
+                cls._instances[model_name] = service
+        return service
+    
+    @classmethod
+    def warm_up(cls, model_names: List[str] = None) -> List["EmbeddingService"]:
+        """Load shared services ahead of the first upload"""
+        if not model_names:
+            model_names = [None]
+        return [cls.get_shared(model_name) for model_name in model_names]
+    
+    @classmethod
+    def clear_shared(cls):
+        """Drop all shared services (frees their ONNX sessions and stops their process pools)"""
+        with cls._instances_lock:
+            services = list(cls._instances.values())
+            cls._instances.clear()
+        for service in services:
+            service.close()
+    
+    def close(self):
+        """Stop the process pool, if one was started"""
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
+    
+    def process_pool(self) -> "EmbeddingProcessPool":
+        """The service's EmbeddingProcessPool, started on first use"""
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = EmbeddingProcessPool(self.model_name, self.processes, self.profile)
+            return self._pool
+    
+    def _resolve_model_path(self) -> str:
+        """
+        Resolve the model snapshot directory.
+        A model_name that is a local directory (tokenizer.json plus an .onnx
+        file) is used as is. Otherwise uses the local pretrained_models/ cache
+        when present and only falls back to HuggingFace Hub when the model
+        was never downloaded.
+        """
+        from huggingface_hub import snapshot_download
+        from huggingface_hub.errors import LocalEntryNotFoundError
+        
+        if os.path.isdir(self.model_name):
+            return self.model_name
+        
+        download_kwargs = dict(
+            repo_id=self.model_name,
+            cache_dir=str(PRETRAINED_MODELS_DIR),
+            allow_patterns=["*.onnx", "tokenizer.json", "config.json", "special_tokens_map.json"]
+        )
+        try:
+            return snapshot_download(local_files_only=True, **download_kwargs)
+        except LocalEntryNotFoundError:
+            logger.info("downloading embedding model", extra={'model': self.model_name})
+            model_path = snapshot_download(**download_kwargs)
+            logger.info("embedding model downloaded", extra={'model': self.model_name, 'path': model_path})
+            return model_path
+    
     def _init_model(self):
-        """Initialize and download ONNX model"""
+        """Initialize ONNX model from the local cache, downloading it if needed"""
         try:
-            from huggingface_hub import snapshot_download
             import onnxruntime as ort
             from tokenizers import Tokenizer
             
-            # Download model to local directory
-            print(f"Downloading model: {self.model_name}")
-            self.model_path = snapshot_download(
-                repo_id=self.model_name,
-                cache_dir=str(PRETRAINED_MODELS_DIR),
-                allow_patterns=["*.onnx", "tokenizer.json", "config.json", "special_tokens_map.json"]
-            )
-            print(f"Model downloaded to: {self.model_path}")
+            self.model_path = self._resolve_model_path()
             
             # Load tokenizer
             tokenizer_path = os.path.join(self.model_path, "tokenizer.json")
@@ -50,23 +212,147 @@ class EmbeddingService:
             self.tokenizer = Tokenizer.from_file(tokenizer_path)
             
             # Load ONNX session - search recursively for .onnx files
+            profile = ONNX_PROFILES[self.profile]
             onnx_model_path = self._find_onnx_model(self.model_path)
             if not onnx_model_path:
                 raise FileNotFoundError(f"No ONNX model file found in {self.model_path}")
+            if profile['variant'] == 'int8':
+                onnx_model_path = self._find_int8_model(onnx_model_path)
+            self.onnx_model_path = onnx_model_path
             
-            self.session = ort.InferenceSession(onnx_model_path, providers=['CPUExecutionProvider'])
-            print(f"ONNX model loaded successfully from: {onnx_model_path}")
+            start = time.perf_counter()
+            options = self._session_options(ort, profile)
+            if profile['optimize']:
+                self.session = self._optimized_session(ort, onnx_model_path, options)
+            else:
+                self.session = ort.InferenceSession(onnx_model_path, options, providers=['CPUExecutionProvider'])
+            logger.info("onnx model loaded", extra={
+                'model': self.model_name, 'path': onnx_model_path, 'profile': self.profile,
+                'intra_op_threads': options.intra_op_num_threads, 'seconds': round(time.perf_counter() - start, 3)
+            })
             
         except ImportError as e:
             raise ImportError(f"Required packages not installed: {e}. Install with: uv pip install huggingface-hub onnxruntime tokenizers")
     
-    def _find_onnx_model(self, root_path: str) -> str:
+    def _session_options(self, ort, profile: dict):
+        """
+        SessionOptions for profile. Tuned threading gives each thread that
+        calls the session (ingestion workers, see set_concurrency) an equal
+        share of the cores instead of one full-size pool each, which would
+        oversubscribe the CPU; operators run one after another (inter-op 1).
+        KNOWLEDGE_ONNX_INTRA_OP_THREADS / KNOWLEDGE_ONNX_INTER_OP_THREADS
+        override the computed counts.
+        """
+        from django.conf import settings
+        
+        options = ort.SessionOptions()
+        if profile['optimize']:
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if profile['tune_threads'] or self._pool_worker:
+            concurrency = self._concurrency or max(1, getattr(settings, 'KNOWLEDGE_INGESTION_LOCAL_WORKERS', 2))
+            intra = getattr(settings, 'KNOWLEDGE_ONNX_INTRA_OP_THREADS', None)
+            options.intra_op_num_threads = intra or max(1, (os.cpu_count() or 1) // concurrency)
+            options.inter_op_num_threads = getattr(settings, 'KNOWLEDGE_ONNX_INTER_OP_THREADS', None) or 1
+            options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+            if concurrency > 1:
+                # Idle pool threads sleep instead of spinning on cores another worker needs
+                options.add_session_config_entry('session.intra_op.allow_spinning', '0')
+        return options
+    
+    def _optimized_session(self, ort, onnx_model_path: str, options):
+        """
+        Session over the fully optimized graph. The first load saves the
+        graph under OPTIMIZED_MODELS_DIR (optimized_model_filepath); later
+        loads read it back with optimization off and skip that work. Saved
+        graphs are keyed by source file, ONNX Runtime version and CPU, as
+        full optimization can emit hardware-specific kernels.
+        """
+        import platform
+        
+        stat = os.stat(onnx_model_path)
+        flags = sorted(_cpu_flags() & {'avx2', 'avx512f', 'avx512_vnni', 'avx_vnni', 'asimd'})
+        key = '|'.join(map(str, [
+            os.path.realpath(onnx_model_path), stat.st_size, stat.st_mtime_ns,
+            ort.__version__, platform.machine(), *flags
+        ]))
+        cached = OPTIMIZED_MODELS_DIR / f"{Path(onnx_model_path).stem}-{hashlib.sha256(key.encode()).hexdigest()[:16]}.onnx"
+        if cached.exists():
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+            return ort.InferenceSession(str(cached), options, providers=['CPUExecutionProvider'])
+        
+        OPTIMIZED_MODELS_DIR.mkdir(parents=True, exist_ok=True)
+        # Written under a temporary name, so concurrent loads never read a partial file
+        partial = cached.with_name(f"{cached.stem}.{os.getpid()}-{threading.get_ident()}.partial.onnx")
+        options.optimized_model_filepath = str(partial)
+        session = ort.InferenceSession(onnx_model_path, options, providers=['CPUExecutionProvider'])
+        try:
+            os.replace(partial, cached)
+        except OSError:
+            logger.warning("optimized onnx model not saved", exc_info=True, extra={'path': str(cached)})
+        return session
+    
+    @staticmethod
+    def _find_int8_model(fp32_model_path: str) -> str:
+        """
+        Int8 variant for this x86 CPU next to the fp32 model: the best
+        prebuilt file the CPU supports (INT8_X86_MODEL_FILES), else one
+        produced once by dynamic quantization (weights int8, activations
+        quantized at run time). The ARM64 variant is never picked here.
+        """
+        directory = os.path.dirname(fp32_model_path)
+        flags = _cpu_flags()
+        for file_name, flag in INT8_X86_MODEL_FILES:
+            path = os.path.join(directory, file_name)
+            if os.path.exists(path) and (flag is None or flag in flags):
+                return path
+        
+        produced = os.path.join(directory, INT8_X86_PRODUCED_FILE)
+        if not os.path.exists(produced):
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            from onnxruntime.quantization.shape_inference import quant_pre_process
+            
+            start = time.perf_counter()
+            partial = f"{produced}.{os.getpid()}-{threading.get_ident()}.partial"
+            source = fp32_model_path
+            try:
+                # Shape inference and graph cleanup let more operators be quantized
+                # (symbolic shape inference needs sympy)
+                quant_pre_process(
+                    fp32_model_path, f"{partial}.pre",
+                    skip_symbolic_shape=importlib.util.find_spec('sympy') is None
+                )
+                source = f"{partial}.pre"
+            except Exception:
+                logger.warning("onnx quantization pre-processing failed", exc_info=True,
+                               extra={'source': fp32_model_path})
+            try:
+                # Without VNNI, u8s8 products can saturate; 7-bit weights avoid that
+                quantize_dynamic(
+                    source, partial, weight_type=QuantType.QInt8, per_channel=True,
+                    reduce_range=not flags & {'avx512_vnni', 'avx_vnni'}
+                )
+                os.replace(partial, produced)
+            finally:
+                for leftover in (f"{partial}.pre", partial):
+                    if os.path.exists(leftover):
+                        os.remove(leftover)
+            logger.info("int8 onnx model produced", extra={
+                'source': fp32_model_path, 'path': produced, 'seconds': round(time.perf_counter() - start, 3)
+            })
+        return produced
+    
+    @staticmethod
+    def _find_onnx_model(root_path: str) -> str:
         """
-        Recursively search for ONNX model files.
-        Prioritizes model.onnx, then others.
+        Recursively search for the fp32 ONNX model file.
+        Prioritizes model.onnx, then others; quantized variants are skipped.
         """
         import glob
         
+        def is_fp32(path):
+            name = os.path.basename(path)
+            return 'int8' not in name and 'quant' not in name
+        
         # First try model.onnx in root
         model_path = os.path.join(root_path, "model.onnx")
         if os.path.exists(model_path):
@@ -79,88 +365,536 @@ class EmbeddingService:
             if os.path.exists(model_path):
                 return model_path
             
-            # Try any .onnx file in onnx directory
-            onnx_files = glob.glob(os.path.join(onnx_dir, "*.onnx"))
+            # Try any other fp32 .onnx file in onnx directory
+            onnx_files = sorted(filter(is_fp32, glob.glob(os.path.join(onnx_dir, "*.onnx"))))
             if onnx_files:
                 return onnx_files[0]
         
         # Recursively search all subdirectories
         for root, dirs, files in os.walk(root_path):
-            for file in files:
-                if file.endswith('.onnx'):
+            for file in sorted(files):
+                if file.endswith('.onnx') and is_fp32(file):
                     return os.path.join(root, file)
         
         return None
     
+    def _pad_token_id(self) -> int:
+        """Token id used to pad sequences in a batch"""
+        for token in ("[PAD]", "<pad>"):
+            token_id = self.tokenizer.token_to_id(token)
+            if token_id is not None:
+                return token_id
+        return 0
+    
+    def _run_batch(self, encodings: list) -> np.ndarray:
+        """
+        Run one ONNX call over a list of tokenizer encodings.
+        Sequences are right-padded to the longest one and the last hidden
+        state is mean-pooled over real tokens using the attention mask.
+        """
+        batch_size = len(encodings)
+        max_length = max(len(encoded.ids) for encoded in encodings)
+        
+        input_ids = np.full((batch_size, max_length), self._pad_token_id(), dtype=np.int64)
+        attention_mask = np.zeros((batch_size, max_length), dtype=np.int64)
+        for row, encoded in enumerate(encodings):
+            length = len(encoded.ids)
+            input_ids[row, :length] = encoded.ids
+            attention_mask[row, :length] = encoded.attention_mask
+        
+        # Create token_type_ids (all zeros for BERT-like models)
+        token_type_ids = np.zeros_like(input_ids, dtype=np.int64)
+        
+        # Prepare input feed with all required inputs
+        input_feed = {}
+        for input_node in self.session.get_inputs():
+            input_name = input_node.name
+            if input_name == 'input_ids':
+                input_feed[input_name] = input_ids
+            elif input_name == 'attention_mask':
+                input_feed[input_name] = attention_mask
+            elif input_name == 'token_type_ids':
+                input_feed[input_name] = token_type_ids
+        
+        # Run ONNX inference - only the last hidden state (first output) is used
+        output_name = self.session.get_outputs()[0].name
+        start = time.perf_counter()
+        hidden = self.session.run([output_name], input_feed)[0]
+        elapsed = time.perf_counter() - start
+        metrics.ONNX_BATCH_SECONDS.observe(elapsed)
+        profiling.record_onnx(elapsed, batch_size)
+        metrics.ONNX_BATCH_SIZE.observe(batch_size)
+        metrics.ONNX_BATCH_SEQUENCE_LENGTH.observe(max_length)
+        
+        if hidden.ndim == 2:
+            # Model already returns one pooled vector per sequence
+            return hidden.astype(np.float32, copy=False)
+        
+        # Attention-mask-weighted mean pooling over the sequence axis
+        mask = attention_mask.astype(hidden.dtype)
+        summed = np.einsum('bsd,bs->bd', hidden, mask)
+        counts = np.maximum(mask.sum(axis=1, keepdims=True), 1)
+        return (summed / counts).astype(np.float32, copy=False)
+    
     def embed(self, text: str) -> List[float]:
-        """Generate embedding for text"""
+        """
+        Generate embedding for text.
+        
+        Inference errors propagate: a made-up vector would be stored (and
+        cached) as if it were real, so the caller's job fails and is retried.
+        """
         if not self.session or not self.tokenizer:
             raise RuntimeError("Model not initialized properly")
         
-        try:
-            # Tokenize
-            encoded = self.tokenizer.encode(text)
-            input_ids = np.array([encoded.ids], dtype=np.int64)
-            attention_mask = np.array([encoded.attention_mask], dtype=np.int64)
-            
-            # Create token_type_ids (all zeros for BERT-like models)
-            token_type_ids = np.zeros_like(input_ids, dtype=np.int64)
-            
-            # Prepare input feed with all required inputs
-            input_feed = {}
-            for input_node in self.session.get_inputs():
-                input_name = input_node.name
-                if input_name == 'input_ids':
-                    input_feed[input_name] = input_ids
-                elif input_name == 'attention_mask':
-                    input_feed[input_name] = attention_mask
-                elif input_name == 'token_type_ids':
-                    input_feed[input_name] = token_type_ids
-            
-            # Run ONNX inference
-            output_names = [output.name for output in self.session.get_outputs()]
-            embeddings = self.session.run(output_names, input_feed)
-            
-            # Return the last hidden state (embeddings) - first output typically
-            embedding = embeddings[0]
-            
-            # Pool the embeddings (use mean pooling of last hidden state)
-            if embedding.ndim > 2:
-                # Remove batch dimension and average across sequence
-                embedding = embedding[0].mean(axis=0)
-            elif embedding.ndim == 2:
-                embedding = embedding[0].mean(axis=0)
+        encoded = self.tokenizer.encode(text)
+        return self._run_batch([encoded])[0].tolist()
+    
+    def embed_array(self, texts: List[str], batch_size: int = None) -> np.ndarray:
+        """
+        Generate embeddings for multiple texts as a (len(texts), dim) float32 array.
+        
+        Texts are tokenized in one call, sorted by token length and run in
+        micro-batches of batch_size so padding stays small. Rows are returned
+        in the original order of texts.
+        
+        With a process pool (processes > 1), calls of at least two batches
+        are spread over the pool's processes instead.
+        """
+        if not self.session or not self.tokenizer:
+            raise RuntimeError("Model not initialized properly")
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        
+        if batch_size is None:
+            from django.conf import settings
+            batch_size = getattr(settings, 'KNOWLEDGE_EMBEDDING_BATCH_SIZE', 32)
+        batch_size = max(1, batch_size)
+        
+        if self.processes > 1 and len(texts) >= 2 * batch_size:
+            from concurrent.futures.process import BrokenProcessPool
+            try:
+                return self.process_pool().embed_array(texts, batch_size, dim=self.dimension)
+            except BrokenProcessPool:
+                # A worker died (e.g. out of memory): embed here and start a fresh pool next time
+                logger.exception("embedding process pool broke, embedding in process", extra={'model': self.model_name})
+                self.close()
+        
+        encodings = self.tokenizer.encode_batch(list(texts))
+        order = np.argsort([len(encoded.ids) for encoded in encodings], kind='stable')
+        
+        vectors = None
+        for start in range(0, len(order), batch_size):
+            indices = order[start:start + batch_size]
+            try:
+                pooled = self._run_batch([encodings[i] for i in indices])
+            except Exception:
+                # E.g. out of memory on a large batch; a text that fails on its own raises
+                logger.exception(
+                    "batch embedding failed, embedding texts one by one",
+                    extra={'model': self.model_name, 'batch_size': len(indices)}
+                )
+                pooled = np.vstack([self._run_batch([encodings[i]]) for i in indices])
             
-            return embedding.tolist()
+            if vectors is None:
+                vectors = np.empty((len(texts), pooled.shape[1]), dtype=np.float32)
+            vectors[indices] = pooled
         
-        except Exception as e:
-            print(f"Error generating embedding: {e}")
-            # Fallback to random embedding
-            return np.random.randn(384).tolist()
+        return vectors
     
-    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+    def embed_batch(self, texts: List[str], batch_size: int = None) -> List[List[float]]:
         """Generate embeddings for multiple texts"""
-        if not self.session or not self.tokenizer:
-            raise RuntimeError("Model not initialized properly")
+        return self.embed_array(texts, batch_size=batch_size).tolist()
+    
+    @property
+    def dimension(self) -> int:
+        """Embedding size, found by running the model once"""
+        if getattr(self, '_dimension', None) is None:
+            self._dimension = int(self._run_batch([self.tokenizer.encode("dimension")]).shape[1])
+        return self._dimension
+
+
+# State of an EmbeddingProcessPool worker process
+_pool_service = None
+
+
+def _embedding_pool_init(model_name: str, profile: str, processes: int):
+    """Load the worker process's own session, with the cores split between the pool's processes"""
+    global _pool_service
+    EmbeddingService._pool_worker = True
+    EmbeddingService.set_concurrency(processes)
+    _pool_service = EmbeddingService(model_name, profile=profile, processes=0)
+
+
+def _embedding_pool_run(buffer_name: str, shape: tuple, rows: np.ndarray, texts: List[str], batch_size: int) -> float:
+    """Embed texts into rows of the shared (rows, dim) float32 buffer; returns the seconds spent"""
+    from multiprocessing import shared_memory
+    
+    start = time.perf_counter()
+    vectors = _pool_service.embed_array(texts, batch_size=batch_size)
+    seconds = time.perf_counter() - start
+    buffer = shared_memory.SharedMemory(name=buffer_name)
+    try:
+        output = np.ndarray(shape, dtype=np.float32, buffer=buffer.buf)
+        output[rows] = vectors
+        del output
+    finally:
+        buffer.close()
+    return seconds
+
+
+class EmbeddingProcessPool:
+    """
+    Processes that each hold their own ONNX session, for embedding more text
+    than one process can keep all cores busy with.
+    
+    embed_array sorts the texts by length and splits them into runs of
+    similar length, about four per process. Workers write their vectors
+    straight into one shared-memory float32 matrix, so results are never
+    pickled. Processes are started with spawn (ingestion runs on threads)
+    and load their session with the first task they receive.
+    """
+    
+    TASKS_PER_PROCESS = 4
+    
+    def __init__(self, model_name: str, processes: int, profile: str = None):
+        from concurrent.futures import ProcessPoolExecutor
+        import multiprocessing
+        
+        self.model_name = model_name
+        self.processes = max(1, processes)
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_embedding_pool_init,
+            initargs=(model_name, profile, self.processes),
+        )
+        logger.info("embedding process pool started", extra={'model': model_name, 'processes': self.processes})
+    
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+    
+    def embed_array(self, texts: List[str], batch_size: int, dim: int) -> np.ndarray:
+        """(len(texts), dim) float32 embeddings of texts, in their order"""
+        from multiprocessing import shared_memory
+        
+        count = len(texts)
+        order = np.argsort([len(text) for text in texts], kind='stable')
+        task_rows = max(batch_size, -(-count // (self.processes * self.TASKS_PER_PROCESS)))
+        buffer = shared_memory.SharedMemory(create=True, size=max(1, count * dim * 4))
+        futures = []
+        try:
+            for start in range(0, count, task_rows):
+                rows = order[start:start + task_rows]
+                futures.append((len(rows), self.executor.submit(
+                    _embedding_pool_run, buffer.name, (count, dim), rows, [texts[i] for i in rows], batch_size
+                )))
+            for rows, future in futures:
+                profiling.record_onnx(future.result(), rows)
+            output = np.ndarray((count, dim), dtype=np.float32, buffer=buffer.buf)
+            vectors = output.copy()
+            del output
+            return vectors
+        finally:
+            for _, future in futures:
+                future.cancel()
+            buffer.close()
+            buffer.unlink()
+
+
+class EmbeddingCacheService:
+    """
+    Persistent embedding cache keyed by (model name, normalized chunk-text hash).
+    
+    Lookups run before inference, so only cache misses reach the ONNX model.
+    The cache holds at most KNOWLEDGE_EMBEDDING_CACHE_SIZE entries; the least
+    recently used are evicted first. Hit/miss totals for this process are
+    kept in `counters`.
+    """
+    
+    # Hashes per IN (...) lookup, below SQLite's bound-parameter limit
+    LOOKUP_BATCH_SIZE = 500
+    
+    counters = {'hits': 0, 'misses': 0}
+    _counters_lock = threading.Lock()
+    
+    @staticmethod
+    def text_hash(text: str) -> str:
+        """SHA-256 of the text after NFC normalization and whitespace collapsing"""
+        normalized = ' '.join(unicodedata.normalize('NFC', text).split())
+        return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+    
+    @staticmethod
+    def max_entries() -> int:
+        from django.conf import settings
+        return getattr(settings, 'KNOWLEDGE_EMBEDDING_CACHE_SIZE', 200000)
+    
+    @classmethod
+    def _count(cls, hits: int, misses: int):
+        with cls._counters_lock:
+            cls.counters['hits'] += hits
+            cls.counters['misses'] += misses
+    
+    @classmethod
+    def embed_array(cls, embedding_service: EmbeddingService, texts: List[str], batch_size: int = None):
+        """
+        Embed texts through the cache.
+        
+        Returns:
+            (vectors, hits): (len(texts), dim) float32 array in the order of
+            texts, and how many of the texts were served without inference.
+            Repeated texts within the call are embedded once.
+        """
+        from django.utils import timezone
+        from .models import EmbeddingCacheEntry
+        
+        if not texts or cls.max_entries() <= 0:
+            cls._count(0, len(texts))
+            return embedding_service.embed_array(texts, batch_size=batch_size), 0
+        
+        model_name = embedding_service.model_name
+        hashes = [cls.text_hash(text) for text in texts]
+        unique = list(dict.fromkeys(hashes))
+        
+        vectors_by_hash = {}
+        for start in range(0, len(unique), cls.LOOKUP_BATCH_SIZE):
+            vectors_by_hash.update(EmbeddingCacheEntry.objects.filter(
+                embedding_model=model_name, text_hash__in=unique[start:start + cls.LOOKUP_BATCH_SIZE]
+            ).values_list('text_hash', 'vector'))
+        found = list(vectors_by_hash)
+        missing = [text_hash for text_hash in unique if text_hash not in vectors_by_hash]
+        
+        if missing:
+            text_by_hash = dict(zip(reversed(hashes), reversed(texts)))
+            fresh = embedding_service.embed_array([text_by_hash[text_hash] for text_hash in missing], batch_size=batch_size)
+            vectors_by_hash.update(zip(missing, fresh))
+        
+        now = timezone.now()
+        for start in range(0, len(found), cls.LOOKUP_BATCH_SIZE):
+            EmbeddingCacheEntry.objects.filter(
+                embedding_model=model_name, text_hash__in=found[start:start + cls.LOOKUP_BATCH_SIZE]
+            ).update(last_used_at=now)
+        if missing:
+            # Another worker may have cached the same text meanwhile
+            EmbeddingCacheEntry.objects.bulk_create([
+                EmbeddingCacheEntry(
+                    embedding_model=model_name, text_hash=text_hash,
+                    vector=vectors_by_hash[text_hash], last_used_at=now
+                )
+                for text_hash in missing
+            ], batch_size=cls.LOOKUP_BATCH_SIZE, ignore_conflicts=True)
+            cls.evict()
         
-        embeddings = []
-        for text in texts:
-            embeddings.append(self.embed(text))
+        hits = len(texts) - len(missing)
+        cls._count(hits, len(missing))
+        return np.vstack([vectors_by_hash[text_hash] for text_hash in hashes]).astype(np.float32, copy=False), hits
+    
+    @classmethod
+    def evict(cls) -> int:
+        """Delete least recently used entries beyond the cache size; returns how many"""
+        from .models import EmbeddingCacheEntry
+        
+        excess = EmbeddingCacheEntry.objects.count() - max(cls.max_entries(), 0)
+        if excess <= 0:
+            return 0
+        stale = list(
+            EmbeddingCacheEntry.objects.order_by('last_used_at', 'pk').values_list('pk', flat=True)[:excess]
+        )
+        for start in range(0, len(stale), cls.LOOKUP_BATCH_SIZE):
+            EmbeddingCacheEntry.objects.filter(pk__in=stale[start:start + cls.LOOKUP_BATCH_SIZE]).delete()
+        return len(stale)
+    
+    @classmethod
+    def stats(cls) -> Dict[str, Any]:
+        """Process hit/miss counters plus the current cache size"""
+        from .models import EmbeddingCacheEntry
+        
+        with cls._counters_lock:
+            hits, misses = cls.counters['hits'], cls.counters['misses']
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / (hits + misses), 4) if hits + misses else None,
+            'entries': EmbeddingCacheEntry.objects.count(),
+            'max_entries': cls.max_entries(),
+        }
+
+
+CHUNK_SEPARATORS = ["\n\n", "\n", ".", " ", ""]
+
+
+class CharacterSplitter:
+    """LangChain RecursiveCharacterTextSplitter; chunk sizes count characters"""
+    
+    def __init__(self, chunk_size: int = 400, chunk_overlap: int = 120, separators: List[str] = None):
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+        
+        self.splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            separators=separators or CHUNK_SEPARATORS
+        )
+        # Characters of text split at once by ChunkingService.iter_chunks
+        self.window = chunk_size * 64
+    
+    def split(self, text: str) -> List[tuple]:
+        """Chunks of text as [(chunk_text, offset), ...]"""
+        located, position = [], 0
+        for chunk in self.splitter.split_text(text):
+            found = text.find(chunk, position)
+            position = found if found >= 0 else position
+            located.append((chunk, position))
+        return located
+
+
+class TokenBudgetSplitter:
+    """
+    Recursive splitter whose chunk_size and chunk_overlap count tokens of the
+    embedding model's own tokenizer.
+    
+    Separators and merge/overlap rules follow RecursiveCharacterTextSplitter:
+    text is split on the first separator it contains, pieces are merged up
+    to chunk_size, each chunk starts with up to chunk_overlap tokens of the
+    previous one, and oversized pieces are split again on the next
+    separator. The last-resort "" separator splits between tokens.
+    
+    Each text is tokenized once; any span is measured by counting token
+    start offsets inside it, so no piece is re-tokenized.
+    """
+    
+    def __init__(self, tokenizer, chunk_size: int = 128, chunk_overlap: int = 32, separators: List[str] = None):
+        from tokenizers import Tokenizer
+        
+        if chunk_overlap >= chunk_size:
+            raise ValueError(f"chunk_overlap ({chunk_overlap}) must be smaller than chunk_size ({chunk_size})")
+        # Private copy: the model's tokenizer may truncate or pad
+        self.tokenizer = Tokenizer.from_str(tokenizer.to_str())
+        self.tokenizer.no_truncation()
+        self.tokenizer.no_padding()
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = separators or CHUNK_SEPARATORS
+        # About four characters per token
+        self.window = chunk_size * 64 * 4
+    
+    def count_tokens(self, text: str) -> int:
+        return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+    
+    def split(self, text: str) -> List[tuple]:
+        """Chunks of text as [(chunk_text, offset), ...]"""
+        self._text = text
+        self._starts = self._token_starts(text)
+        try:
+            located = []
+            for start, stop in self._split(0, len(text), self.separators):
+                chunk = text[start:stop]
+                stripped = chunk.strip()
+                if stripped:
+                    located.append((stripped, start + len(chunk) - len(chunk.lstrip())))
+            return located
+        finally:
+            self._text = self._starts = None
+    
+    def _token_starts(self, text: str, segment_chars: int = 4096) -> List[int]:
+        """
+        Sorted start offsets of text's tokens. Text is cut at blank lines into
+        segments of about segment_chars and encoded in one batch, which the
+        tokenizer parallelizes across cores.
+        """
+        bounds = [0]
+        cut = text.find(PAGE_SEPARATOR, segment_chars)
+        while cut >= 0:
+            bounds.append(cut)
+            cut = text.find(PAGE_SEPARATOR, cut + segment_chars)
+        bounds.append(len(text))
+        
+        encodings = self.tokenizer.encode_batch(
+            [text[a:b] for a, b in zip(bounds, bounds[1:])], add_special_tokens=False
+        )
+        starts = []
+        for offset, encoding in zip(bounds, encodings):
+            starts.extend(offset + start for start, _ in encoding.offsets)
+        starts.sort()
+        return starts
+    
+    def _count(self, start: int, stop: int) -> int:
+        """Tokens starting inside text[start:stop]"""
+        return bisect.bisect_left(self._starts, stop) - bisect.bisect_left(self._starts, start)
+    
+    def _pieces(self, start: int, stop: int, separator: str) -> List[tuple]:
+        """Split text[start:stop] before each separator (kept with the following piece)"""
+        if separator:
+            bounds, found = [start], self._text.find(separator, start + 1, stop)
+            while found >= 0:
+                bounds.append(found)
+                found = self._text.find(separator, found + len(separator), stop)
+        else:
+            first = bisect.bisect_right(self._starts, start)
+            bounds = [start] + [pos for pos in self._starts[first:bisect.bisect_left(self._starts, stop)]]
+        bounds.append(stop)
+        return [(a, b) for a, b in zip(bounds, bounds[1:]) if b > a]
+    
+    def _split(self, start: int, stop: int, separators: List[str]) -> List[tuple]:
+        separator, remaining = separators[-1], []
+        for idx, candidate in enumerate(separators):
+            if candidate == "":
+                separator = ""
+                break
+            if self._text.find(candidate, start, stop) >= 0:
+                separator, remaining = candidate, separators[idx + 1:]
+                break
+        
+        spans, fitting = [], []
+        for piece in self._pieces(start, stop, separator):
+            if self._count(*piece) <= self.chunk_size:
+                fitting.append(piece)
+                continue
+            if fitting:
+                spans.extend(self._merge(fitting))
+                fitting = []
+            if remaining:
+                spans.extend(self._split(*piece, remaining))
+            else:
+                spans.append(piece)
+        if fitting:
+            spans.extend(self._merge(fitting))
+        return spans
+    
+    def _merge(self, pieces: List[tuple]) -> List[tuple]:
+        """Greedily merge adjacent pieces up to chunk_size, carrying up to chunk_overlap tokens over"""
+        from collections import deque
         
-        return embeddings
+        spans, current = [], deque()
+        for piece in pieces:
+            if current and self._count(current[0][0], piece[1]) > self.chunk_size:
+                spans.append((current[0][0], current[-1][1]))
+                while current and (
+                    self._count(current[0][0], current[-1][1]) > self.chunk_overlap
+                    or self._count(current[0][0], piece[1]) > self.chunk_size
+                ):
+                    current.popleft()
+            current.append(piece)
+        if current:
+            spans.append((current[0][0], current[-1][1]))
+        return spans
 
 
 class ChunkingService:
-    """Service for chunking documents using LangChain"""
+    """Service for chunking documents (token-budget or LangChain character splitting)"""
     
     @staticmethod
     def chunk_text(text: str, chunk_size: int = 400, chunk_overlap: int = 120) -> list:
         """
-        Chunk text using LangChain's RecursiveCharacterTextSplitter.
+        Chunk a whole text in one pass using LangChain's RecursiveCharacterTextSplitter.
+        
+        Ingestion does not use this: it streams pages through iter_chunks
+        with splitter_for(), which by default budgets KNOWLEDGE_CHUNK_TOKENS
+        tokens of the embedding model's tokenizer (128, overlap 32) rather
+        than characters. chunk_text is the character-count splitter for
+        callers that already hold the full text.
         
         Args:
             text: Text to chunk
-            chunk_size: Size of each chunk in characters (200 = more granular chunks)
+            chunk_size: Size of each chunk in characters
             chunk_overlap: Overlap between chunks in characters
         
         Returns:
@@ -168,9 +902,6 @@ class ChunkingService:
         """
         from langchain_text_splitters import RecursiveCharacterTextSplitter
         
-        print(f"\n[CHUNKING] Input text length: {len(text)} characters", flush=True)
-        sys.stdout.flush()
-        
         splitter = RecursiveCharacterTextSplitter(
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap,
@@ -185,12 +916,92 @@ class ChunkingService:
         # Remove any empty chunks
         chunks = [c for c in chunks if c.strip()]
         
-        print(f"[CHUNKING] Total chunks created: {len(chunks)}", flush=True)
-        for i, chunk in enumerate(chunks[:3]):
-            print(f"  Chunk {i}: {len(chunk)} chars, preview: {chunk[:80]}...", flush=True)
-        sys.stdout.flush()
+        logger.debug("text chunked", extra={'characters': len(text), 'chunks': len(chunks)})
         
         return chunks
+    
+    @staticmethod
+    def splitter_for(embedding_service: EmbeddingService = None):
+        """
+        Splitter configured by KNOWLEDGE_CHUNKER: 'tokens' (default) budgets
+        KNOWLEDGE_CHUNK_TOKENS / KNOWLEDGE_CHUNK_OVERLAP_TOKENS tokens of the
+        embedding model's tokenizer; 'characters' keeps the 400/120 character
+        LangChain splitter.
+        """
+        from django.conf import settings
+        
+        if getattr(settings, 'KNOWLEDGE_CHUNKER', 'tokens') == 'characters':
+            return CharacterSplitter()
+        tokenizer = (embedding_service or EmbeddingService.get_shared()).tokenizer
+        return TokenBudgetSplitter(
+            tokenizer,
+            chunk_size=getattr(settings, 'KNOWLEDGE_CHUNK_TOKENS', 128),
+            chunk_overlap=getattr(settings, 'KNOWLEDGE_CHUNK_OVERLAP_TOKENS', 32)
+        )
+    
+    @staticmethod
+    def iter_chunks(pages, splitter=None, window: int = None):
+        """
+        Chunk a stream of (page_number, text) segments incrementally.
+        
+        Text is buffered and split one window (about window characters,
+        default the splitter's window of roughly 64 chunks) at a time. The
+        last chunk of each window is split again together with the following
+        text, so no chunk is cut short at a window edge and memory stays
+        bounded by the window.
+        
+        Args:
+            pages: Iterable of (page_number, text)
+            splitter: TokenBudgetSplitter or CharacterSplitter (default: 400/120 characters)
+            window: Characters split at once
+        
+        Yields:
+            (chunk_text, page_number) with the page the chunk starts on
+        """
+        if splitter is None:
+            splitter = CharacterSplitter()
+        window = window or splitter.window
+        
+        buffer = ''
+        # (offset in buffer, page_number) of each segment in the buffer
+        marks = []
+        count = 0
+        
+        def split(final):
+            """Chunks of the buffer as (text, offset), and where the unsplit remainder starts"""
+            located = splitter.split(buffer)
+            if final:
+                return located, len(buffer)
+            if len(located) < 2:
+                # A single chunk may still grow with the following text
+                return [], 0
+            return located[:-1], located[-1][1]
+        
+        def page_at(offset):
+            return marks[bisect.bisect_right([mark for mark, _ in marks], offset) - 1][1] if marks else None
+        
+        for number, text in itertools.chain(pages, [(None, None)]):
+            final = text is None
+            if text:
+                if buffer and number is not None:
+                    buffer += PAGE_SEPARATOR
+                marks.append((len(buffer), number))
+                buffer += text
+            if not final and len(buffer) < window:
+                continue
+            
+            located, keep_from = split(final)
+            for chunk, offset in located:
+                if chunk.strip():
+                    count += 1
+                    yield chunk, page_at(offset)
+            
+            # Keep the remainder and the page marks it still needs
+            page = page_at(keep_from)
+            buffer = buffer[keep_from:]
+            marks = [(0, page)] + [(mark - keep_from, num) for mark, num in marks if mark > keep_from]
+        
+        logger.debug("text chunked", extra={'chunks': count})
 
 
 class DocumentParsingService:
@@ -203,48 +1014,95 @@ class DocumentParsingService:
             return f.read()
     
     @staticmethod
-    def parse_pdf(file_path: str) -> str:
-        """Parse PDF file using pdfplumber for better text extraction"""
+    def iter_txt(file_path: str, block_chars: int = 1 << 20):
+        """Yield a TXT file's text in blocks of block_chars characters"""
+        with open(file_path, 'r', encoding='utf-8') as f:
+            while True:
+                block = f.read(block_chars)
+                if not block:
+                    return
+                yield block
+    
+    @staticmethod
+    def pdf_page_count(file_path: str) -> int:
+        """Number of pages, read from the PDF's page tree without extracting text"""
         try:
             import pdfplumber
-            text = ""
             with pdfplumber.open(file_path) as pdf:
-                num_pages = len(pdf.pages)
-                print(f"\n[PDF PARSING] Total pages: {num_pages}", flush=True)
-                sys.stdout.flush()
-                
-                for idx, page in enumerate(pdf.pages):
-                    page_text = page.extract_text()
-                    if page_text:
-                        text += page_text + "\n\n"
-                    
-                    if idx < 3 or idx == num_pages - 1 or (idx + 1) % 50 == 0:
-                        print(f"  Page {idx + 1}/{num_pages}: {len(page_text) if page_text else 0} chars", flush=True)
-                    sys.stdout.flush()
-            
-            print(f"[PDF PARSING] Total extracted text: {len(text)} characters\n", flush=True)
-            sys.stdout.flush()
-            return text
+                return len(pdf.pages)
         except ImportError:
-            # Fallback to PyPDF2
-            print("[PDF PARSING] pdfplumber not available, using PyPDF2", flush=True)
             try:
                 from PyPDF2 import PdfReader
-                text = ""
-                with open(file_path, 'rb') as f:
-                    reader = PdfReader(f)
-                    print(f"[PDF PARSING] Total pages: {len(reader.pages)}", flush=True)
-                    for idx, page in enumerate(reader.pages):
-                        page_text = page.extract_text()
-                        if page_text:
-                            text += page_text + "\n\n"
-                        if idx < 3 or idx == len(reader.pages) - 1:
-                            print(f"  Page {idx + 1}: {len(page_text) if page_text else 0} chars", flush=True)
-                    print(f"[PDF PARSING] Total extracted text: {len(text)} characters", flush=True)
-                sys.stdout.flush()
-                return text
             except ImportError:
                 raise ImportError("Either pdfplumber or PyPDF2 is required for PDF parsing")
+            logger.warning("pdfplumber not available, using PyPDF2")
+            with open(file_path, 'rb') as f:
+                return len(PdfReader(f).pages)
+    
+    @staticmethod
+    def pdf_page_ranges(num_pages: int, workers: int, pages_per_task: int) -> List[tuple]:
+        """
+        Split [0, num_pages) into (start, stop) ranges of at least pages_per_task
+        pages, about four per worker so slow pages do not idle the other workers.
+        """
+        size = max(pages_per_task, -(-num_pages // (workers * 4)))
+        return [(start, min(start + size, num_pages)) for start in range(0, num_pages, size)]
+    
+    @staticmethod
+    def iter_pdf_pages(file_path: str, workers: int = None):
+        """
+        Yield a PDF's pages as (page_number, text) in page order.
+        
+        Page ranges are extracted in parallel by a pool of up to workers
+        processes (KNOWLEDGE_PDF_WORKERS, default one per core), with at most
+        two ranges per worker in flight so memory stays bounded. With one
+        worker the ranges are extracted in this process.
+        """
+        from collections import deque
+        from concurrent.futures import ProcessPoolExecutor
+        import multiprocessing
+        from django.conf import settings
+        
+        if workers is None:
+            workers = getattr(settings, 'KNOWLEDGE_PDF_WORKERS', None) or os.cpu_count() or 1
+        pages_per_task = getattr(settings, 'KNOWLEDGE_PDF_PAGES_PER_TASK', 16)
+        
+        num_pages = DocumentParsingService.pdf_page_count(file_path)
+        ranges = DocumentParsingService.pdf_page_ranges(num_pages, workers, pages_per_task)
+        workers = min(workers, len(ranges))
+        logger.info("parsing pdf", extra={
+            'file': os.path.basename(file_path), 'pages': num_pages, 'page_ranges': len(ranges), 'workers': workers
+        })
+        
+        if workers <= 1:
+            for start, stop in ranges:
+                yield from extract_pdf_pages(file_path, start, stop)
+            return
+        
+        # spawn, not fork: ingestion runs on worker threads
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        try:
+            pending = deque()
+            remaining = iter(ranges)
+            for start, stop in itertools.islice(remaining, 2 * workers):
+                pending.append(pool.submit(extract_pdf_pages, file_path, start, stop))
+            while pending:
+                pages = pending.popleft().result()
+                for start, stop in itertools.islice(remaining, 1):
+                    pending.append(pool.submit(extract_pdf_pages, file_path, start, stop))
+                yield from pages
+        finally:
+            pool.shutdown(cancel_futures=True)
+    
+    @staticmethod
+    def parse_pdf_pages(file_path: str, workers: int = None) -> List[tuple]:
+        """Extract a PDF's text as [(page_number, text), ...] in page order"""
+        return list(DocumentParsingService.iter_pdf_pages(file_path, workers=workers))
+    
+    @staticmethod
+    def parse_pdf(file_path: str) -> str:
+        """Parse PDF file using pdfplumber for better text extraction"""
+        return DocumentParsingService.join_pages(DocumentParsingService.parse_pdf_pages(file_path))
     
     @staticmethod
     def parse_docx(file_path: str) -> str:
@@ -260,16 +1118,1593 @@ class DocumentParsingService:
     @staticmethod
     def parse_document(file_path: str, file_type: str) -> str:
         """Parse document based on file type"""
+        return DocumentParsingService.join_pages(DocumentParsingService.parse_document_pages(file_path, file_type))
+    
+    @staticmethod
+    def parse_document_pages(file_path: str, file_type: str) -> List[tuple]:
+        """Parse document into [(page_number, text), ...]; page_number is None for formats without pages"""
+        return list(DocumentParsingService.iter_document_pages(file_path, file_type))
+    
+    @staticmethod
+    def iter_document_pages(file_path: str, file_type: str):
+        """
+        Yield a document's text as (page_number, text) segments.
+        
+        PDF segments are pages. TXT files are read in blocks that may end
+        mid-word (page_number None); consecutive None segments are parts of
+        one continuous text.
+        """
         if file_type == 'txt':
-            return DocumentParsingService.parse_txt(file_path)
+            for block in DocumentParsingService.iter_txt(file_path):
+                yield None, block
         elif file_type == 'pdf':
-            return DocumentParsingService.parse_pdf(file_path)
+            yield from DocumentParsingService.iter_pdf_pages(file_path)
         elif file_type == 'docx':
-            return DocumentParsingService.parse_docx(file_path)
+            yield None, DocumentParsingService.parse_docx(file_path)
         else:
             raise ValueError(f"Unsupported file type: {file_type}")
+    
+    @staticmethod
+    def join_pages(pages: List[tuple]) -> str:
+        """Document text: pages separated by blank lines, unpaged segments concatenated"""
+        parts = []
+        for number, text in pages:
+            if not text:
+                continue
+            if parts and number is not None:
+                parts.append(PAGE_SEPARATOR)
+            parts.append(text)
+        return ''.join(parts)
 
 
-class VectorSnapshotService:
-    """Service removed - vector exports now handled directly in views"""
+def extract_pdf_pages(file_path: str, start: int, stop: int) -> List[tuple]:
+    """
+    Extract pages [start, stop) of a PDF as [(page_number, text), ...] with
+    1-based page numbers. Module-level so PDF worker processes can run it.
+    """
+    try:
+        import pdfplumber
+    except ImportError:
+        pdfplumber = None
+    
+    if pdfplumber is not None:
+        with pdfplumber.open(file_path, pages=list(range(start + 1, stop + 1))) as pdf:
+            return [(page.page_number, page.extract_text() or '') for page in pdf.pages]
+    
+    try:
+        from PyPDF2 import PdfReader
+    except ImportError:
+        raise ImportError("Either pdfplumber or PyPDF2 is required for PDF parsing")
+    with open(file_path, 'rb') as f:
+        reader = PdfReader(f)
+        return [(idx + 1, reader.pages[idx].extract_text() or '') for idx in range(start, stop)]
+
+
+class IngestionCancelled(Exception):
+    """Raised by a progress callback to stop an ingestion run"""
     pass
+
+
+class _PipelineStage(threading.Thread):
+    """
+    Thread draining an iterator into a bounded queue.
+    
+    Iterating the stage yields the items in order on the consuming thread.
+    The producer blocks once maxsize items are waiting, so a fast stage
+    never runs more than maxsize items ahead of a slow one. Errors raised
+    by the producer are re-raised in the consumer.
+    """
+    
+    _END = object()
+    
+    def __init__(self, name: str, items, maxsize: int, uses_db: bool = False):
+        super().__init__(name=name, daemon=True)
+        self.items = items
+        self.queue = queue.Queue(maxsize=max(1, maxsize))
+        self.uses_db = uses_db
+        self.error = None
+        self._stopped = threading.Event()
+        # Work done by the stage counts towards the starting thread's profile, if any
+        self.profiler = profiling.current()
+    
+    def run(self):
+        try:
+            with self.profiler.attach() if self.profiler else contextlib.nullcontext():
+                for item in self.items:
+                    if not self._put(item):
+                        break
+        except BaseException as e:
+            self.error = e
+        finally:
+            if hasattr(self.items, 'close'):
+                self.items.close()
+            if self.uses_db:
+                from django.db import connection
+                connection.close()
+            self._put(self._END)
+    
+    def _put(self, item) -> bool:
+        while not self._stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def __iter__(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=0.1)
+            except queue.Empty:
+                if self._stopped.is_set() and not self.is_alive():
+                    return
+                continue
+            if item is self._END:
+                if self.error is not None:
+                    raise self.error
+                return
+            yield item
+    
+    def stop(self):
+        """Ask the producer to stop at its next item (join() to wait for it)"""
+        self._stopped.set()
+
+
+def _timed(items, timings: Dict[str, float], key: str):
+    """Iterate items, adding the time spent producing them to timings[key]"""
+    iterator = iter(items)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            timings[key] += time.perf_counter() - start
+        yield item
+
+
+class IngestionService:
+    """Service running the parse -> chunk -> embed -> store pipeline for a document"""
+    
+    @staticmethod
+    def process_document(document, progress=None) -> int:
+        """
+        Parse, chunk, embed and store a document's chunks as a streaming pipeline.
+        
+        Chunks are sized with the tokenizer of the course's primary embedding
+        model and embedded once per declared model (Course.embedding_models),
+        so parsing and chunking are shared between the models.
+        
+        Pages flow into the chunker, chunks into embedding batches and
+        embedded batches into bulk inserts. Parsing/chunking and embedding
+        each run on their own thread, linked by queues holding at most
+        KNOWLEDGE_PIPELINE_QUEUE_SIZE batches, so the stages overlap and
+        memory stays flat however large the file is. Chunks are stored batch
+        by batch as they arrive; a failed or cancelled run leaves the chunks
+        stored so far for the caller to discard.
+        
+        Args:
+            document: Document whose file is ingested; existing chunks are replaced
+            progress: Optional callable(stage, done=0, total=0, **counters) called
+                when the run starts and after each stored batch. Counters are
+                embedded, cache_hits, cache_misses and stage_timings (seconds
+                each stage spent working). total counts the chunks found so
+                far. It may raise IngestionCancelled to abort the run.
+        
+        Returns:
+            Number of chunks stored
+        """
+        from django.conf import settings
+        
+        def report(stage, done=0, total=0, **counters):
+            if progress is not None:
+                progress(stage, done=done, total=total, **counters)
+        
+        report('parse')
+        model_names = document.course.embedding_model_names()
+        embedding_service = EmbeddingService.get_shared(model_names[0])
+        extra_services = [EmbeddingService.get_shared(model_name) for model_name in model_names[1:]]
+        step = getattr(settings, 'KNOWLEDGE_EMBEDDING_BATCH_SIZE', 32) * 8
+        queue_size = getattr(settings, 'KNOWLEDGE_PIPELINE_QUEUE_SIZE', 4)
+        
+        timings = {'parse': 0.0, 'chunk': 0.0, 'embed': 0.0, 'store': 0.0}
+        counts = {'chunked': 0, 'embedded': 0, 'vectors': 0, 'cache_hits': 0}
+        
+        def chunk_batches():
+            pages = _timed(
+                DocumentParsingService.iter_document_pages(document.file.path, document.file_type), timings, 'parse'
+            )
+            chunks = ChunkingService.iter_chunks(pages, ChunkingService.splitter_for(embedding_service))
+            while True:
+                batch = list(itertools.islice(chunks, step))
+                if not batch:
+                    return
+                counts['chunked'] += len(batch)
+                yield batch
+        
+        def embed_batches(batches):
+            # Chunks already in the embedding cache skip inference
+            for batch in batches:
+                start = time.perf_counter()
+                texts = [text for text, _ in batch]
+                vectors, hits = EmbeddingCacheService.embed_array(embedding_service, texts)
+                extra_vectors = {}
+                for service in extra_services:
+                    extra_vectors[service.model_name], extra_hits = EmbeddingCacheService.embed_array(service, texts)
+                    hits += extra_hits
+                timings['embed'] += time.perf_counter() - start
+                counts['embedded'] += len(batch)
+                counts['vectors'] += len(batch) * (1 + len(extra_services))
+                counts['cache_hits'] += hits
+                yield batch, vectors, extra_vectors
+        
+        def stage_timings():
+            # The chunk stage's time includes the parsing it pulled pages from
+            return {
+                'parse': round(timings['parse'], 3),
+                'chunk': round(max(timings['chunk'] - timings['parse'], 0.0), 3),
+                'embed': round(timings['embed'], 3),
+                'store': round(timings['store'], 3),
+            }
+        
+        ChunkStorageService.clear_chunks(document)
+        chunker = _PipelineStage('ingest-chunk', _timed(chunk_batches(), timings, 'chunk'), queue_size)
+        embedder = _PipelineStage('ingest-embed', embed_batches(chunker), queue_size, uses_db=True)
+        stored = 0
+        status = 'failed'
+        try:
+            chunker.start()
+            embedder.start()
+            for batch, vectors, extra_vectors in embedder:
+                start = time.perf_counter()
+                ChunkStorageService.append_chunks(
+                    document, [text for text, _ in batch], vectors, embedding_service.model_name,
+                    start_index=stored, page_numbers=[page for _, page in batch], extra_vectors=extra_vectors
+                )
+                timings['store'] += time.perf_counter() - start
+                stored += len(batch)
+                report(
+                    'store', done=stored, total=max(counts['chunked'], stored),
+                    embedded=counts['embedded'], cache_hits=counts['cache_hits'],
+                    cache_misses=counts['vectors'] - counts['cache_hits'], stage_timings=stage_timings()
+                )
+            status = 'succeeded'
+        except IngestionCancelled:
+            status = 'cancelled'
+            raise
+        finally:
+            embedder.stop()
+            chunker.stop()
+            embedder.join()
+            chunker.join()
+            IngestionService._record(document, status, stage_timings(), counts, stored)
+        
+        return stored
+    
+    @staticmethod
+    def _record(document, status: str, timings: Dict[str, float], counts: Dict[str, int], stored: int):
+        """Update the ingestion metrics and log the run's outcome"""
+        try:
+            size = document.file.size
+        except (OSError, ValueError):
+            size = 0
+        metrics.DOCUMENTS.inc(file_type=document.file_type, status=status)
+        metrics.DOCUMENT_BYTES.inc(size, file_type=document.file_type)
+        metrics.CHUNKS.inc(counts['chunked'], stage='chunk')
+        metrics.CHUNKS.inc(counts['embedded'], stage='embed')
+        metrics.CHUNKS.inc(stored, stage='store')
+        if status == 'succeeded':
+            # Partial runs would skew the per-document distributions
+            for stage, seconds in timings.items():
+                metrics.STAGE_SECONDS.observe(seconds, stage=stage)
+        logger.info("document ingested", extra={
+            'document_id': document.pk, 'file_type': document.file_type, 'status': status, 'bytes': size,
+            'chunks': stored, 'cache_hits': counts['cache_hits'], 'stage_seconds': timings,
+        })
+
+
+class ChunkStorageService:
+    """Service for persisting chunks and their vectors"""
+    
+    @staticmethod
+    def store_chunks(document, texts: List[str], vectors, model_name: str,
+                     batch_size: int = None, replace: bool = True, page_numbers: List[Any] = None,
+                     extra_vectors: Dict[str, Any] = None) -> int:
+        """
+        Insert a document's chunks with bulk_create inside one transaction.
+        
+        Args:
+            document: Document the chunks belong to
+            texts: Chunk texts, in chunk_index order
+            vectors: (len(texts), dim) array of embeddings
+            model_name: Embedding model that produced the vectors
+            batch_size: Rows per INSERT (defaults to KNOWLEDGE_CHUNK_BULK_BATCH_SIZE)
+            replace: Delete the document's existing chunks in the same transaction
+            page_numbers: Optional page each chunk starts on, aligned with texts
+            extra_vectors: Optional {model name: vectors} of the course's
+                additional embedding models, stored as ChunkEmbedding rows
+        
+        Returns:
+            Number of chunks stored
+        """
+        from django.db import transaction
+        from .models import Course
+        
+        with transaction.atomic():
+            Course.bump_content_version(document.course_id, document_id=document.pk)
+            if replace:
+                document.chunks.all().delete()
+            ChunkStorageService._insert(
+                document, texts, vectors, model_name, 0, page_numbers, batch_size, extra_vectors
+            )
+        
+        return len(texts)
+    
+    @staticmethod
+    def append_chunks(document, texts: List[str], vectors, model_name: str, start_index: int,
+                      page_numbers: List[Any] = None, batch_size: int = None,
+                      extra_vectors: Dict[str, Any] = None) -> int:
+        """
+        Insert one batch of a document's chunks, numbered from start_index,
+        in its own transaction. Used by the streaming pipeline.
+        """
+        from django.db import transaction
+        from .models import Course
+        
+        with transaction.atomic():
+            Course.bump_content_version(document.course_id, document_id=document.pk)
+            ChunkStorageService._insert(
+                document, texts, vectors, model_name, start_index, page_numbers, batch_size, extra_vectors
+            )
+        
+        return len(texts)
+    
+    @staticmethod
+    def clear_chunks(document) -> int:
+        """Delete a document's chunks, bumping the course version if there were any"""
+        from .models import Course
+        
+        deleted = document.chunks.all().delete()[0]
+        if deleted:
+            Course.bump_content_version(document.course_id, document_id=document.pk)
+        return deleted
+    
+    @staticmethod
+    def _insert(document, texts, vectors, model_name, start_index, page_numbers, batch_size, extra_vectors=None):
+        from django.conf import settings
+        from .models import Chunk, ChunkEmbedding
+        
+        if batch_size is None:
+            batch_size = getattr(settings, 'KNOWLEDGE_CHUNK_BULK_BATCH_SIZE', 500)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        extra_vectors = {
+            name: np.asarray(extra, dtype=np.float32) for name, extra in (extra_vectors or {}).items()
+            if name != model_name
+        }
+        
+        for start in range(0, len(texts), batch_size):
+            chunks = Chunk.objects.bulk_create([
+                Chunk(
+                    document=document,
+                    text=text,
+                    chunk_index=start_index + idx,
+                    vector=vectors[idx],
+                    embedding_model=model_name,
+                    page_number=page_numbers[idx] if page_numbers else None
+                )
+                for idx, text in enumerate(texts[start:start + batch_size], start=start)
+            ])
+            if extra_vectors:
+                # bulk_create sets the new chunks' ids (INSERT ... RETURNING)
+                ChunkEmbedding.objects.bulk_create([
+                    ChunkEmbedding(chunk=chunk, embedding_model=name, vector=extra[idx])
+                    for name, extra in extra_vectors.items()
+                    for idx, chunk in enumerate(chunks, start=start)
+                ])
+
+
+class DocumentDedupService:
+    """
+    Service detecting re-uploads of a file that is already stored.
+    
+    Policies for a duplicate upload:
+        reuse: share the stored file and copy the earlier upload's chunks
+            and vectors instead of parsing and embedding again
+        reject: refuse the upload
+        ingest: process it like any new file
+    
+    The copy runs as the duplicate's ingestion job, not in the upload
+    request. Chunks are copied rather than shared because every chunk
+    belongs to one document: search results, exports, snapshots and
+    deletes all follow that link.
+    """
+    
+    POLICIES = ('reuse', 'reject', 'ingest')
+    
+    @staticmethod
+    def default_policy() -> str:
+        from django.conf import settings
+        return getattr(settings, 'KNOWLEDGE_DUPLICATE_UPLOADS', 'reuse')
+    
+    @staticmethod
+    def file_hash(uploaded_file) -> str:
+        """SHA-256 hex digest of an upload (already computed if it came through knowledge.uploads handlers)"""
+        digest = getattr(uploaded_file, 'sha256', None)
+        if digest:
+            return digest
+        sha256 = hashlib.sha256()
+        for block in uploaded_file.chunks():
+            sha256.update(block)
+        uploaded_file.seek(0)
+        return sha256.hexdigest()
+    
+    @staticmethod
+    def complete_copies(sha256: str, course):
+        """
+        Fully ingested uploads of the file whose chunks have vectors for each
+        of course's embedding models, in the same (primary or additional) role
+        """
+        from .models import ChunkEmbedding, Document, IngestionJob
+        
+        model_names = course.embedding_model_names()
+        candidates = Document.objects.filter(
+            sha256=sha256, chunks__embedding_model=model_names[0]
+        ).exclude(
+            jobs__status__in=[IngestionJob.STATUS_QUEUED, IngestionJob.STATUS_RUNNING]
+        )
+        for model_name in model_names[1:]:
+            candidates = candidates.filter(pk__in=ChunkEmbedding.objects.filter(
+                embedding_model=model_name
+            ).values('chunk__document_id'))
+        return candidates.distinct().order_by('created_at')
+    
+    @staticmethod
+    def find_duplicate(sha256: str, course):
+        """Return a complete earlier upload of the same file, preferring one in course, or None"""
+        if not sha256:
+            return None
+        candidates = DocumentDedupService.complete_copies(sha256, course)
+        return candidates.filter(course=course).first() or candidates.first()
+    
+    @staticmethod
+    def reusable_source(document):
+        """
+        The upload document duplicates, if it still has chunks to copy; None
+        when it was deleted or re-ingested since, so document is processed
+        from its (shared) file instead
+        """
+        if not document.duplicate_of_id or not document.sha256:
+            return None
+        return DocumentDedupService.complete_copies(
+            document.sha256, document.course
+        ).filter(pk=document.duplicate_of_id).first()
+    
+    @staticmethod
+    def copy_chunks(source, document, progress=None) -> int:
+        """
+        Store source's chunks and vectors (for the embedding models of
+        document's course) as document's chunks, without parsing or embedding.
+        Runs in document's ingestion job; progress is reported as for
+        IngestionService.process_document, every chunk counting as a cache hit.
+        """
+        from .models import ChunkEmbedding
+        
+        model_names = document.course.embedding_model_names()
+        rows = list(
+            source.chunks.filter(embedding_model=model_names[0]).order_by('chunk_index').values_list(
+                'pk', 'text', 'vector', 'page_number'
+            )
+        )
+        extra_vectors = {}
+        for model_name in model_names[1:]:
+            by_chunk = dict(ChunkEmbedding.objects.filter(
+                chunk__document=source, embedding_model=model_name
+            ).values_list('chunk_id', 'vector'))
+            extra_vectors[model_name] = [by_chunk[pk] for pk, _, _, _ in rows]
+        texts = [text for _, text, _, _ in rows]
+        vectors = np.vstack([vector for _, _, vector, _ in rows]) if rows else np.empty((0, 0), dtype=np.float32)
+        stored = ChunkStorageService.store_chunks(
+            document, texts, vectors, model_names[0], page_numbers=[page for _, _, _, page in rows],
+            extra_vectors=extra_vectors
+        )
+        if progress:
+            progress('store', done=stored, total=stored, embedded=stored, cache_hits=stored, cache_misses=0)
+        return stored
+
+
+class ChunkExportService:
+    """
+    Service streaming chunks as NDJSON (one JSON object per line).
+    
+    Rows are read in keyset batches over (document, chunk_index), each batch
+    a range scan of that composite index, so memory stays flat and later
+    batches are as fast as the first however many chunks are exported.
+    """
+    
+    FIELDS = [
+        'id', 'document_id', 'text', 'chunk_index', 'page_number', 'embedding_model',
+        'document__title', 'document__file', 'document__course__code', 'created_at'
+    ]
+    
+    @staticmethod
+    def iter_rows(document_ids, include_vectors: bool = False, after: int = None, batch_size: int = 1000):
+        """
+        Yield chunk dicts of each document in document_ids, in chunk_index order.
+        
+        Args:
+            document_ids: Documents to export, in output order
+            include_vectors: Add each chunk's vector as a list of floats
+            after: Start after this chunk_index of the first document (to resume)
+            batch_size: Rows per query
+        """
+        from .models import Chunk
+        
+        fields = ChunkExportService.FIELDS + (['vector'] if include_vectors else [])
+        for document_id in document_ids:
+            last_index = after
+            after = None
+            while True:
+                batch = Chunk.objects.filter(document_id=document_id)
+                if last_index is not None:
+                    batch = batch.filter(chunk_index__gt=last_index)
+                rows = list(batch.order_by('chunk_index').values(*fields)[:batch_size])
+                for row in rows:
+                    yield {
+                        'id': row['id'],
+                        'document': row['document_id'],
+                        'text': row['text'],
+                        'chunk_index': row['chunk_index'],
+                        'page_number': row['page_number'],
+                        'embedding_model': row['embedding_model'],
+                        'document_title': row['document__title'],
+                        'document_file': row['document__file'],
+                        'course_code': row['document__course__code'],
+                        'created_at': row['created_at'].isoformat(),
+                        **({'vector': row['vector'].tolist()} if include_vectors else {}),
+                    }
+                if len(rows) < batch_size:
+                    break
+                last_index = rows[-1]['chunk_index']
+    
+    @staticmethod
+    def iter_ndjson(document_ids, include_vectors: bool = False, after: int = None, batch_size: int = 1000):
+        """Encode iter_rows as NDJSON, yielding about one bytes block per batch"""
+        lines = []
+        for row in ChunkExportService.iter_rows(document_ids, include_vectors, after, batch_size):
+            lines.append(json.dumps(row, ensure_ascii=False))
+            if len(lines) == batch_size:
+                yield ("\n".join(lines) + "\n").encode('utf-8')
+                lines = []
+        if lines:
+            yield ("\n".join(lines) + "\n").encode('utf-8')
+
+
+class ReembeddingService:
+    """
+    Re-embeds chunks for a ReembeddingJob.
+    
+    Chunks are read in id order, KNOWLEDGE_REEMBED_BATCH_SIZE at a time, and
+    their new vectors written as ChunkShadowVector rows in the same
+    transaction that moves the job's checkpoint (last_chunk_id), so a crash
+    loses at most the batch in flight and a rerun continues after the
+    checkpoint. Live vectors are untouched until swap() replaces them all
+    at once.
+    
+    In courses that declare the job's model as an additional embedding
+    model, the new vectors become the chunks' ChunkEmbedding rows for it
+    (a backfill). Elsewhere they replace the chunks' primary vectors and
+    the model becomes the course's primary model.
+    """
+    
+    @staticmethod
+    def additional_course_ids(job) -> List[int]:
+        """Courses in the job's scope that declare its model as an additional embedding model"""
+        from .models import Course
+        
+        courses = Course.objects.all() if job.course_id is None else Course.objects.filter(pk=job.course_id)
+        return [
+            pk for pk, names in courses.values_list('pk', 'embedding_models')
+            if job.embedding_model in (names or [])[1:]
+        ]
+    
+    @classmethod
+    def pending(cls, job):
+        """Chunks in the job's scope after its checkpoint that still need new vectors"""
+        from django.db.models import Q
+        from .models import Chunk, ChunkEmbedding
+        
+        chunks = Chunk.objects.filter(pk__gt=job.last_chunk_id)
+        if job.course_id is not None:
+            chunks = chunks.filter(document__course_id=job.course_id)
+        additional = Q(document__course_id__in=cls.additional_course_ids(job))
+        if job.force:
+            # A model never has both a primary vector and a ChunkEmbedding row
+            return chunks.exclude(additional & Q(embedding_model=job.embedding_model))
+        return chunks.exclude(embedding_model=job.embedding_model).exclude(additional & Q(
+            pk__in=ChunkEmbedding.objects.filter(embedding_model=job.embedding_model).values('chunk_id')
+        ))
+    
+    @classmethod
+    def run(cls, job, embedding_service: EmbeddingService = None, should_yield=None, progress=None) -> bool:
+        """
+        Embed the job's remaining chunks, then swap the new vectors in.
+        
+        Args:
+            job: ReembeddingJob to run from its checkpoint
+            embedding_service: Service for job.embedding_model (default: the shared one)
+            should_yield: Optional callable checked after each batch; returning
+                True stops the run early, keeping the checkpoint
+            progress: Optional callable(job) called after each batch. It may
+                raise IngestionCancelled to abort the run.
+        
+        Returns:
+            True once the vectors are swapped in, False if the run yielded
+        """
+        from django.conf import settings
+        from django.db import transaction
+        from django.utils import timezone
+        from .models import Chunk, ChunkShadowVector, EmbeddingCacheEntry
+        
+        batch_size = getattr(settings, 'KNOWLEDGE_REEMBED_BATCH_SIZE', 256)
+        max_rate = getattr(settings, 'KNOWLEDGE_REEMBED_MAX_CHUNKS_PER_SECOND', None)
+        embedding_service = embedding_service or EmbeddingService.get_shared(job.embedding_model)
+        
+        if job.force and not job.last_chunk_id:
+            # Cached vectors come from the code being replaced (e.g. before a tokenizer fix)
+            EmbeddingCacheEntry.objects.filter(embedding_model=job.embedding_model).delete()
+        job.chunks_total = job.chunks_done + cls.pending(job).count()
+        job.save(update_fields=['chunks_total', 'updated_at'])
+        
+        while True:
+            rows = list(cls.pending(job).order_by('pk').values_list('pk', 'text')[:batch_size])
+            if not rows:
+                if progress is not None:
+                    # Last chance to cancel before the swap
+                    progress(job)
+                cls.swap(job)
+                return True
+            
+            start = time.perf_counter()
+            vectors, hits = EmbeddingCacheService.embed_array(embedding_service, [text for _, text in rows])
+            with transaction.atomic():
+                # Chunks deleted meanwhile (document removed or re-ingested) are skipped
+                alive = set(Chunk.objects.filter(pk__in=[pk for pk, _ in rows]).values_list('pk', flat=True))
+                ChunkShadowVector.objects.bulk_create([
+                    ChunkShadowVector(job=job, chunk_id=pk, vector=vector)
+                    for (pk, _), vector in zip(rows, vectors) if pk in alive
+                ])
+                job.last_chunk_id = rows[-1][0]
+                job.chunks_done += len(rows)
+                job.cache_hits += hits
+                job.chunks_total = max(job.chunks_total, job.chunks_done)
+                job.heartbeat_at = timezone.now()
+                job.save(update_fields=[
+                    'last_chunk_id', 'chunks_done', 'cache_hits', 'chunks_total', 'heartbeat_at', 'updated_at'
+                ])
+            
+            if progress is not None:
+                progress(job)
+            if max_rate:
+                # Throttle: leave the CPU to live uploads for the rest of the batch's time slot
+                time.sleep(max(0.0, len(rows) / max_rate - (time.perf_counter() - start)))
+            if should_yield is not None and should_yield():
+                return False
+    
+    @classmethod
+    def swap(cls, job) -> int:
+        """
+        Replace the live vectors of the job's chunks with its shadow vectors
+        in one transaction; returns the number of chunks swapped.
+        
+        Every vector of the affected courses may change, so each course's
+        sync_min_version is raised (devices download a full snapshot) and,
+        where primary vectors changed, its ANN indexes are retrained.
+        """
+        from django.db import models, transaction
+        from django.utils import timezone
+        from .models import Chunk, ChunkEmbedding, ChunkShadowVector, Course, VectorIndex
+        
+        shadows = ChunkShadowVector.objects.filter(job=job)
+        additional_ids = cls.additional_course_ids(job)
+        with transaction.atomic():
+            chunks = Chunk.objects.filter(pk__in=shadows.values('chunk_id'))
+            course_ids = list(chunks.values_list('document__course_id', flat=True).distinct().order_by())
+            
+            # Backfilled additional model: new ChunkEmbedding rows
+            additional = chunks.filter(document__course_id__in=additional_ids)
+            ChunkEmbedding.objects.filter(chunk__in=additional, embedding_model=job.embedding_model).delete()
+            rows = shadows.filter(chunk__in=additional).values_list('chunk_id', 'vector').iterator(chunk_size=2000)
+            swapped = 0
+            while block := list(itertools.islice(rows, 2000)):
+                ChunkEmbedding.objects.bulk_create([
+                    ChunkEmbedding(chunk_id=chunk_id, embedding_model=job.embedding_model, vector=vector)
+                    for chunk_id, vector in block
+                ])
+                swapped += len(block)
+            
+            # Primary model: the chunks' own vectors
+            primary = chunks.exclude(document__course_id__in=additional_ids)
+            ChunkEmbedding.objects.filter(chunk__in=primary, embedding_model=job.embedding_model).delete()
+            swapped += primary.update(
+                vector=models.Subquery(shadows.filter(chunk_id=models.OuterRef('pk')).values('vector')[:1]),
+                embedding_model=job.embedding_model,
+            )
+            shadows.delete()
+            
+            for course in Course.objects.filter(pk__in=course_ids):
+                if course.pk not in additional_ids:
+                    VectorIndex.objects.filter(course=course).delete()
+                    if course.primary_embedding_model != job.embedding_model:
+                        Course.objects.filter(pk=course.pk).update(embedding_models=[job.embedding_model] + [
+                            name for name in course.embedding_models[1:] if name != job.embedding_model
+                        ])
+                Course.bump_content_version(course.pk)
+                Course.objects.filter(pk=course.pk).update(sync_min_version=models.F('content_version'))
+            job.swapped_at = timezone.now()
+            job.save(update_fields=['swapped_at', 'updated_at'])
+        
+        for course in Course.objects.filter(pk__in=course_ids).exclude(pk__in=additional_ids):
+            VectorIndexService.refresh(course)
+        for course_id in course_ids:
+            VectorSnapshotService.evict(course_id)
+        logger.info("re-embedded vectors swapped in", extra={
+            'job_id': job.pk, 'embedding_model': job.embedding_model, 'chunks': swapped, 'courses': course_ids
+        })
+        return swapped
+
+
+class VectorQuantizationService:
+    """
+    Service encoding vectors for export at a chosen precision.
+    
+    Precisions:
+        json: JSON text of float values (original format)
+        float32 / float16: raw little-endian floats
+        int8: symmetric per-vector quantization, value ~= int8 * vector_scale
+        binary: 1 bit per dimension (1 if > 0), packed most significant bit
+            first; ranked by Hamming distance alone
+        binary_int8: binary plus int8 rescoring vectors (rescore_vector,
+            rescore_scale) to re-rank the Hamming-distance candidates
+    
+    Bytes per vector at dimension d: float32 4d, float16 2d, int8 d + 4,
+    binary d / 8, binary_int8 d / 8 + d + 4. binary_int8 is therefore
+    larger than int8: it buys a fast Hamming pre-filter, not a smaller file.
+    For the smallest file use binary and accept its lower recall, or
+    use the server's search endpoint where exact ranking matters.
+    """
+    
+    PRECISIONS = ('json', 'float32', 'float16', 'int8', 'binary', 'binary_int8')
+    
+    # Extra chunk columns (name, SQL type) written for each precision
+    EXTRA_COLUMNS = {
+        'int8': [('vector_scale', 'REAL')],
+        'binary_int8': [('rescore_vector', 'BLOB'), ('rescore_scale', 'REAL')],
+    }
+    
+    @staticmethod
+    def metadata(precision: str, dimension: int = None) -> Dict[str, Any]:
+        """snapshot_meta entries describing how to decode the vector columns"""
+        meta = {'precision': precision}
+        if dimension:
+            meta['dimension'] = dimension
+        if precision in ('float32', 'float16'):
+            meta['byte_order'] = 'little'
+        elif precision == 'int8':
+            meta['quantization'] = 'symmetric_per_vector'
+            meta['scale_column'] = 'vector_scale'
+        elif precision in ('binary', 'binary_int8'):
+            meta['quantization'] = 'sign'
+            meta['bit_order'] = 'big'
+        if precision == 'binary_int8':
+            meta['rescore_precision'] = 'int8'
+            meta['rescore_column'] = 'rescore_vector'
+            meta['rescore_scale_column'] = 'rescore_scale'
+        return meta
+    
+    @staticmethod
+    def quantize_int8(vectors: np.ndarray):
+        """Return (int8 codes, float32 scale per row) with vectors ~= codes * scale"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    
+    @staticmethod
+    def quantize_binary(vectors: np.ndarray) -> np.ndarray:
+        """Return sign bits packed into uint8, one row per vector"""
+        return np.packbits(np.asarray(vectors) > 0, axis=1)
+    
+    @staticmethod
+    def encode(vectors: np.ndarray, precision: str) -> List[tuple]:
+        """
+        Encode a (n, dim) block of vectors.
+        Returns one tuple per row: (vector value, *extra column values).
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if precision == 'json':
+            return [(json.dumps(row),) for row in vectors.tolist()]
+        if precision == 'float32':
+            return [(row.tobytes(),) for row in vectors.astype('<f4', copy=False)]
+        if precision == 'float16':
+            return [(row.tobytes(),) for row in vectors.astype('<f2')]
+        if precision == 'int8':
+            codes, scales = VectorQuantizationService.quantize_int8(vectors)
+            return [(row.tobytes(), scale) for row, scale in zip(codes, scales.tolist())]
+        if precision == 'binary':
+            return [(packed.tobytes(),) for packed in VectorQuantizationService.quantize_binary(vectors)]
+        if precision == 'binary_int8':
+            bits = VectorQuantizationService.quantize_binary(vectors)
+            codes, scales = VectorQuantizationService.quantize_int8(vectors)
+            return [
+                (packed.tobytes(), row.tobytes(), scale)
+                for packed, row, scale in zip(bits, codes, scales.tolist())
+            ]
+        raise ValueError(f"Unsupported precision: {precision}")
+    
+    @staticmethod
+    def search(query: np.ndarray, vectors: np.ndarray, precision: str, k: int = 10,
+               rescore_factor: int = 4) -> np.ndarray:
+        """
+        Top-k row indices by cosine similarity as a device would compute them
+        from vectors exported at precision. Used to measure recall.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        k = min(k, len(vectors))
+        
+        def top(scores, count):
+            count = min(count, len(scores))
+            candidates = np.argpartition(-scores, count - 1)[:count]
+            return candidates[np.argsort(-scores[candidates])]
+        
+        def cosine(matrix):
+            norms = np.linalg.norm(matrix, axis=1)
+            norms[norms == 0] = 1.0
+            return (matrix @ query) / norms
+        
+        if precision in ('json', 'float32'):
+            return top(cosine(vectors), k)
+        if precision == 'float16':
+            return top(cosine(vectors.astype(np.float16).astype(np.float32)), k)
+        
+        codes, scales = VectorQuantizationService.quantize_int8(vectors)
+        dequantized = codes.astype(np.float32) * scales[:, None]
+        if precision == 'int8':
+            return top(cosine(dequantized), k)
+        if precision in ('binary', 'binary_int8'):
+            bits = VectorQuantizationService.quantize_binary(vectors)
+            query_bits = np.packbits(query > 0)
+            hamming = -np.unpackbits(bits ^ query_bits, axis=1).sum(axis=1).astype(np.float32)
+            if precision == 'binary':
+                return top(hamming, k)
+            candidates = top(hamming, k * rescore_factor)
+            return candidates[top(cosine(dequantized[candidates]), k)]
+        raise ValueError(f"Unsupported precision: {precision}")
+
+
+class VectorIndexService:
+    """
+    Service for IVF approximate nearest-neighbour indexes, in pure NumPy.
+    
+    Vectors are split into nlist clusters by spherical k-means. A query
+    scores the centroids, then only the vectors of its nprobe closest
+    clusters.
+    """
+    
+    @staticmethod
+    def default_nlist(count: int) -> int:
+        return int(np.clip(np.sqrt(count), 8, 4096))
+    
+    @staticmethod
+    def train(vectors: np.ndarray, nlist: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+        """Spherical k-means on L2-normalized vectors; returns (nlist, dim) normalized centroids"""
+        rng = np.random.default_rng(seed)
+        vectors = VectorSearchService.normalize(vectors)
+        nlist = min(nlist, len(vectors))
+        
+        # Train on a sample; assignment of the full set happens later
+        sample_size = min(len(vectors), nlist * 64)
+        sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+        
+        for _ in range(iterations):
+            labels = VectorIndexService.assign(sample, centroids)
+            order = np.argsort(labels, kind='stable')
+            counts = np.bincount(labels, minlength=nlist)
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            filled = counts > 0
+            sums = np.zeros_like(centroids)
+            sums[filled] = np.add.reduceat(sample[order], starts[filled], axis=0)
+            # Re-seed empty clusters from random sample points
+            sums[~filled] = sample[rng.choice(sample_size, int((~filled).sum()))]
+            centroids = VectorSearchService.normalize(sums)
+        return centroids.astype(np.float32)
+    
+    @staticmethod
+    def assign(vectors: np.ndarray, centroids: np.ndarray, block_size: int = 8192) -> np.ndarray:
+        """Index of the closest centroid for each vector, in bounded-memory blocks"""
+        labels = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), block_size):
+            labels[start:start + block_size] = np.argmax(vectors[start:start + block_size] @ centroids.T, axis=1)
+        return labels
+    
+    @staticmethod
+    def inverted_lists(labels: np.ndarray, nlist: int):
+        """Return (order, offsets): rows of list l are order[offsets[l]:offsets[l + 1]]"""
+        order = np.argsort(labels, kind='stable')
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(labels, minlength=nlist))))
+        return order, offsets
+    
+    @staticmethod
+    def search(query: np.ndarray, matrix: np.ndarray, centroids: np.ndarray, order: np.ndarray,
+               offsets: np.ndarray, k: int = 10, nprobe: int = 8) -> np.ndarray:
+        """Top-k row indices of a normalized matrix for a normalized query, scanning nprobe lists"""
+        probe = VectorSearchService.top_k(centroids @ query, nprobe)
+        candidates = np.concatenate([order[offsets[l]:offsets[l + 1]] for l in probe])
+        if not len(candidates):
+            return candidates
+        scores = matrix[candidates] @ query
+        return candidates[VectorSearchService.top_k(scores, k)]
+    
+    @staticmethod
+    def current(course, model_name: str, count: int):
+        """
+        The course's VectorIndex for model_name, or None if there is none or
+        the course has grown to count chunks, past KNOWLEDGE_ANN_RETRAIN_GROWTH
+        times its training size. Never trains.
+        """
+        from django.conf import settings
+        from .models import VectorIndex
+        
+        growth = getattr(settings, 'KNOWLEDGE_ANN_RETRAIN_GROWTH', 2.0)
+        index = VectorIndex.objects.filter(course=course, embedding_model=model_name).first()
+        if index is None or count > index.trained_chunk_count * growth:
+            return None
+        return index
+    
+    @staticmethod
+    def refresh(course):
+        """
+        ensure() the index of course's primary model after its chunks changed.
+        A failure is only logged: search scans every vector meanwhile and the
+        next snapshot build trains again.
+        """
+        try:
+            return VectorIndexService.ensure(course, course.primary_embedding_model)
+        except Exception:
+            logger.warning("vector index training failed", exc_info=True, extra={'course_id': course.pk})
+            return None
+    
+    @staticmethod
+    def ensure(course, model_name: str, vectors: np.ndarray = None):
+        """
+        Return the course's VectorIndex for model_name, training it when the
+        course reaches KNOWLEDGE_ANN_MIN_CHUNKS or has grown past
+        KNOWLEDGE_ANN_RETRAIN_GROWTH times the training size. Returns None
+        below the threshold.
+        
+        Retraining moves every chunk to new lists, so it also raises the
+        course's sync_min_version: devices must download a full snapshot.
+        Called after ingestion, after re-embedding and before building a
+        snapshot, never from search.
+        """
+        from django.conf import settings
+        from django.db import models, transaction
+        from .models import Chunk, Course, VectorIndex
+        
+        min_chunks = getattr(settings, 'KNOWLEDGE_ANN_MIN_CHUNKS', 5000)
+        
+        chunks = Chunk.objects.filter(document__course=course, embedding_model=model_name)
+        count = len(vectors) if vectors is not None else chunks.count()
+        index = VectorIndexService.current(course, model_name, count)
+        if index is not None or count < min_chunks:
+            return index
+        
+        if vectors is None:
+            vectors = np.vstack(list(chunks.values_list('vector', flat=True)))
+        centroids = VectorIndexService.train(vectors, VectorIndexService.default_nlist(count))
+        
+        with transaction.atomic():
+            index, _ = VectorIndex.objects.update_or_create(
+                course=course, embedding_model=model_name,
+                defaults=dict(
+                    centroids=centroids.astype('<f4').tobytes(),
+                    nlist=centroids.shape[0],
+                    dimension=centroids.shape[1],
+                    trained_chunk_count=count,
+                )
+            )
+            Course.bump_content_version(course.pk)
+            Course.objects.filter(pk=course.pk).update(sync_min_version=models.F('content_version'))
+        return index
+
+
+class VectorSearchService:
+    """
+    Service for top-k cosine search over a course's chunks.
+    
+    Each course's vectors are held in memory as one L2-normalized float32
+    matrix keyed by (course, content_version, model), so a query costs one
+    matrix-vector product, or a scan of a few IVF lists for large courses.
+    Any change to the course bumps its version and the stale matrix is
+    replaced on the next search.
+    
+    Search only uses an IVF index that is current (VectorIndexService.current);
+    without one it scans every vector. Indexes are trained by ingestion,
+    re-embedding and snapshot builds, so a search never writes.
+    """
+    
+    _matrices = OrderedDict()
+    _matrices_lock = threading.Lock()
+    
+    @staticmethod
+    def normalize(vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+    
+    @classmethod
+    def course_matrix(cls, course, model_name: str):
+        """
+        Return (chunk ids, normalized matrix, ivf) for the course's chunks
+        embedded with model_name. ivf is (centroids, order, offsets) when the
+        course has a current IVF index, else None (brute-force scan).
+        """
+        from django.conf import settings
+        from .models import Chunk, Course
+        
+        key = (course.pk, model_name)
+        with cls._matrices_lock:
+            cached = cls._matrices.get(key)
+            if cached is not None and cached[0] == course.content_version:
+                cls._matrices.move_to_end(key)
+                return cached[1:]
+        
+        # Read before the rows: a change in between leaves the matrix tagged stale
+        version = Course.objects.values_list('content_version', flat=True).get(pk=course.pk)
+        rows = list(Chunk.objects.filter(
+            document__course=course, embedding_model=model_name
+        ).order_by('id').values_list('id', 'vector'))
+        ids = np.fromiter((chunk_id for chunk_id, _ in rows), dtype=np.int64)
+        matrix = cls.normalize(np.vstack([vector for _, vector in rows])) if rows else np.empty((0, 0), np.float32)
+        
+        ivf = None
+        index = VectorIndexService.current(course, model_name, len(rows)) if rows else None
+        if index is not None:
+            centroids = index.centroid_matrix()
+            labels = VectorIndexService.assign(matrix, centroids)
+            ivf = (centroids, *VectorIndexService.inverted_lists(labels, index.nlist))
+        
+        with cls._matrices_lock:
+            cls._matrices[key] = (version, ids, matrix, ivf)
+            cls._matrices.move_to_end(key)
+            while len(cls._matrices) > getattr(settings, 'KNOWLEDGE_SEARCH_CACHE_COURSES', 16):
+                cls._matrices.popitem(last=False)
+        return ids, matrix, ivf
+    
+    @staticmethod
+    def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+        """Indices of the k highest scores, best first, without a full sort"""
+        k = min(k, len(scores))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64)
+        candidates = np.argpartition(-scores, k - 1)[:k]
+        return candidates[np.argsort(-scores[candidates])]
+    
+    @classmethod
+    def search(cls, course, query: str, k: int = 10) -> List[tuple]:
+        """Return [(chunk_id, score), ...] for the k chunks most similar to query, by the course's primary model"""
+        embedding_service = EmbeddingService.get_shared(course.primary_embedding_model)
+        ids, matrix, ivf = cls.course_matrix(course, embedding_service.model_name)
+        if not len(ids):
+            return []
+        
+        query_vector = cls.normalize(embedding_service.embed_array([query])[0])
+        if ivf is not None:
+            from django.conf import settings
+            nprobe = getattr(settings, 'KNOWLEDGE_ANN_NPROBE', 8)
+            best = VectorIndexService.search(query_vector, matrix, *ivf, k=k, nprobe=nprobe)
+            scores = matrix[best] @ query_vector
+            return [(int(ids[i]), float(score)) for i, score in zip(best, scores)]
+        
+        scores = matrix @ query_vector
+        best = cls.top_k(scores, k)
+        return [(int(ids[i]), float(scores[i])) for i in best]
+    
+    @classmethod
+    def clear(cls):
+        with cls._matrices_lock:
+            cls._matrices.clear()
+
+
+class LexicalSearchService:
+    """
+    Service for BM25 keyword search over chunk text.
+    
+    On SQLite this uses the knowledge_chunk_fts FTS5 index, which triggers
+    keep in sync with the chunk table. Other databases fall back to a
+    case-insensitive substring scan.
+    """
+    
+    FTS_TABLE = 'knowledge_chunk_fts'
+    
+    @staticmethod
+    def available() -> bool:
+        from django.db import connection
+        return connection.vendor == 'sqlite'
+    
+    @staticmethod
+    def match_expression(query: str) -> str:
+        """FTS5 MATCH expression: any of the query's terms, each quoted so operators are literal"""
+        terms = re.findall(r'\w+', query)
+        return ' OR '.join(f'"{term}"' for term in terms)
+    
+    @classmethod
+    def matching_ids_sql(cls, query: str):
+        """(sql, params) selecting ids of all chunks matching query, for use in pk__in=RawSQL(...)"""
+        return f"SELECT rowid FROM {cls.FTS_TABLE} WHERE {cls.FTS_TABLE} MATCH %s", [cls.match_expression(query)]
+    
+    @classmethod
+    def search(cls, course, query: str, k: int = 10) -> List[tuple]:
+        """Return [(chunk_id, score), ...] for the k best BM25 matches in the course (higher is better)"""
+        from django.db import connection
+        from .models import Chunk, Document
+        
+        match = cls.match_expression(query)
+        if not match:
+            return []
+        
+        if not cls.available():
+            chunk_ids = Chunk.objects.filter(
+                document__course=course, text__icontains=query
+            ).values_list('id', flat=True)[:k]
+            return [(chunk_id, 0.0) for chunk_id in chunk_ids]
+        
+        with connection.cursor() as cursor:
+            cursor.execute(f'''
+                SELECT c.id, bm25({cls.FTS_TABLE}) AS rank
+                FROM {cls.FTS_TABLE}
+                JOIN {Chunk._meta.db_table} c ON c.id = {cls.FTS_TABLE}.rowid
+                JOIN {Document._meta.db_table} d ON d.id = c.document_id
+                WHERE {cls.FTS_TABLE} MATCH %s AND d.course_id = %s
+                ORDER BY rank
+                LIMIT %s
+            ''', [match, course.pk, k])
+            # FTS5 bm25() is lower-is-better; flip it so all searches rank high-first
+            return [(chunk_id, -rank) for chunk_id, rank in cursor.fetchall()]
+
+
+class HybridSearchService:
+    """Service fusing lexical (BM25) and vector rankings with reciprocal rank fusion"""
+    
+    @staticmethod
+    def fuse(rankings: List[List[tuple]], k: int, rrf_k: int = 60) -> List[tuple]:
+        """Combine [(chunk_id, score), ...] rankings; each contributes 1 / (rrf_k + rank)"""
+        fused: Dict[int, float] = {}
+        for ranking in rankings:
+            for rank, (chunk_id, _) in enumerate(ranking, start=1):
+                fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (rrf_k + rank)
+        return sorted(fused.items(), key=lambda item: item[1], reverse=True)[:k]
+    
+    @staticmethod
+    def search(course, query: str, k: int = 10, candidates: int = 50) -> List[tuple]:
+        """Return [(chunk_id, fused score), ...] from the top candidates of both searches"""
+        depth = max(k, candidates)
+        lexical = LexicalSearchService.search(course, query, k=depth)
+        vector = VectorSearchService.search(course, query, k=depth)
+        return HybridSearchService.fuse([lexical, vector], k)
+
+
+class SyncUnavailable(Exception):
+    """Raised when a delta cannot be built from the requested base version"""
+    pass
+
+
+class VectorSnapshotService:
+    """
+    Service building per-course SQLite knowledge-base snapshots and delta patches.
+    
+    Snapshots are cached on disk per (course, content_version, embedding
+    model, precision), so every device syncing the same course version with
+    the same model gets the same prebuilt file. A file carries the vectors
+    of one of the course's embedding models, the one the device runs.
+    Patches from a base version are cached the same way. Files for older
+    versions are evicted when a new one is built.
+    
+    Every file has a snapshot_meta (key, value) table. Patches also carry a
+    removed_documents table; a device applies a patch by deleting the chunks
+    and documents listed in removed_documents or present in the patch's
+    documents table, then inserting the patch's documents and chunks.
+    """
+    
+    PRECISIONS = VectorQuantizationService.PRECISIONS
+    FORMAT_VERSION = 2
+    # Builds retried when the course changes while a snapshot is written
+    BUILD_ATTEMPTS = 3
+    
+    # External-content FTS5 table over chunks.text, maintained by triggers
+    FTS_SCHEMA = [
+        """
+        CREATE VIRTUAL TABLE chunks_fts USING fts5(
+            text, content='chunks', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        """,
+        "INSERT INTO chunks_fts (chunks_fts) VALUES ('rebuild')",
+        """
+        CREATE TRIGGER chunks_fts_insert AFTER INSERT ON chunks BEGIN
+            INSERT INTO chunks_fts (rowid, text) VALUES (new.id, new.text);
+        END
+        """,
+        """
+        CREATE TRIGGER chunks_fts_delete AFTER DELETE ON chunks BEGIN
+            INSERT INTO chunks_fts (chunks_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        END
+        """,
+        """
+        CREATE TRIGGER chunks_fts_update AFTER UPDATE OF text ON chunks BEGIN
+            INSERT INTO chunks_fts (chunks_fts, rowid, text) VALUES ('delete', old.id, old.text);
+            INSERT INTO chunks_fts (rowid, text) VALUES (new.id, new.text);
+        END
+        """,
+    ]
+    
+    _build_locks: Dict[str, threading.Lock] = {}
+    _build_locks_lock = threading.Lock()
+    
+    @staticmethod
+    def snapshot_dir() -> Path:
+        from django.conf import settings
+        path = Path(getattr(settings, 'KNOWLEDGE_SNAPSHOT_DIR', BASE_DIR / 'snapshots'))
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+    
+    @staticmethod
+    def model_key(model_name: str) -> str:
+        """Short file-name-safe key of an embedding model name"""
+        return hashlib.sha1(model_name.encode('utf-8')).hexdigest()[:10]
+    
+    @staticmethod
+    def snapshot_path(course_id: int, version: int, precision: str, since: int = None, model_name: str = '') -> Path:
+        model = VectorSnapshotService.model_key(model_name)
+        if since is None:
+            name = f"course_{course_id}_v{version}_{model}_{precision}.db"
+        else:
+            name = f"course_{course_id}_v{version}_from{since}_{model}_{precision}.patch.db"
+        return VectorSnapshotService.snapshot_dir() / name
+    
+    @staticmethod
+    def etag(course_id: int, version: int, precision: str, model_name: str = '', since: int = None) -> str:
+        model = VectorSnapshotService.model_key(model_name)
+        if since is None:
+            return f'"kb-{course_id}-{version}-{model}-{precision}"'
+        return f'"kb-{course_id}-{since}-{version}-{model}-{precision}"'
+    
+    @staticmethod
+    def resolve_model(course, model_name: str = None) -> str:
+        """The requested embedding model (default: the course's primary one), which the course must declare"""
+        if not model_name:
+            return course.primary_embedding_model
+        if model_name not in course.embedding_model_names():
+            raise ValueError(
+                f"Course {course.code} has no vectors for embedding model {model_name}; "
+                f"available: {', '.join(course.embedding_model_names())}"
+            )
+        return model_name
+    
+    @classmethod
+    def _build_lock(cls, key: str) -> threading.Lock:
+        with cls._build_locks_lock:
+            return cls._build_locks.setdefault(key, threading.Lock())
+    
+    @classmethod
+    def get_or_build(cls, course, precision: str = 'json', since: int = None, model_name: str = None):
+        """
+        Return (path, version) of the snapshot for the course's current content,
+        building it on a cache miss. With since, return the patch from that
+        base version instead. Vectors are those of model_name (default: the
+        course's primary embedding model).
+        
+        Returns (None, version) if there is nothing to send: the course has no
+        chunks, or (for a patch) since is already the current version.
+        Raises SyncUnavailable if a patch from since cannot be built.
+        
+        The file is written outside any transaction and renamed into place
+        once the course's version is seen unchanged after the build; if it
+        changed, the build is retried for the new version.
+        """
+        from .models import Course
+        
+        if precision not in cls.PRECISIONS:
+            raise ValueError(f"Unsupported precision: {precision}")
+        model_name = cls.resolve_model(course, model_name)
+        
+        version, min_version = Course.objects.values_list(
+            'content_version', 'sync_min_version'
+        ).get(pk=course.pk)
+        if since is not None:
+            if since > version or since < min_version:
+                raise SyncUnavailable(
+                    f"Cannot sync from version {since}; current version is {version}, "
+                    f"oldest syncable version is {min_version}"
+                )
+            if since == version:
+                return None, version
+        
+        path = cls.snapshot_path(course.pk, version, precision, since, model_name)
+        if path.exists():
+            return path, version
+        
+        # Concurrent requests for the same file wait for one build
+        with cls._build_lock(path.name):
+            if path.exists():
+                return path, version
+            
+            # Large courses ship an IVF index; training one bumps the
+            # version, so it has to happen before the version is read
+            VectorIndexService.ensure(course, model_name)
+            
+            # Build outside any transaction, so writers are never held up,
+            # and publish only if the course did not change meanwhile
+            for attempt in range(1, cls.BUILD_ATTEMPTS + 1):
+                version, min_version = Course.objects.values_list(
+                    'content_version', 'sync_min_version'
+                ).get(pk=course.pk)
+                if since is not None and since < min_version:
+                    raise SyncUnavailable(
+                        f"Cannot sync from version {since}; oldest syncable version is {min_version}"
+                    )
+                if since == version:
+                    return None, version
+                path = cls.snapshot_path(course.pk, version, precision, since, model_name)
+                if path.exists():
+                    break
+                
+                kind = 'full' if since is None else 'patch'
+                staging = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.staging")
+                start = time.perf_counter()
+                try:
+                    if not cls.build(course, precision, staging, version, since, model_name):
+                        return None, version
+                    current = Course.objects.values_list('content_version', flat=True).get(pk=course.pk)
+                    if current != version and attempt < cls.BUILD_ATTEMPTS:
+                        continue
+                    # After the last attempt the file is published anyway: it
+                    # holds at least version's content, and patches from
+                    # version resend every document changed since
+                    os.replace(staging, path)
+                finally:
+                    staging.unlink(missing_ok=True)
+                seconds = time.perf_counter() - start
+                size = path.stat().st_size
+                metrics.SNAPSHOT_BUILD_SECONDS.observe(seconds, kind=kind)
+                metrics.SNAPSHOT_BYTES.inc(size, kind=kind)
+                logger.info("snapshot built", extra={
+                    'course_id': course.pk, 'kind': kind, 'version': version, 'since': since,
+                    'precision': precision, 'embedding_model': model_name, 'bytes': size,
+                    'seconds': round(seconds, 3), 'attempts': attempt,
+                })
+                break
+            
+            cls.evict(course.pk, keep_version=version)
+        return path, version
+    
+    @staticmethod
+    def chunk_rows(document_ids, model_name: str):
+        """
+        Querysets of (id, document_id, text, chunk_index, vector, embedding_model)
+        rows of the chunks of document_ids with a vector for model_name: the
+        chunks' own vectors if it is their primary model, else ChunkEmbedding rows.
+        """
+        from .models import Chunk, ChunkEmbedding
+        
+        return [
+            Chunk.objects.filter(document__in=document_ids, embedding_model=model_name).order_by(
+                'document', 'chunk_index'
+            ).values_list('id', 'document_id', 'text', 'chunk_index', 'vector', 'embedding_model'),
+            ChunkEmbedding.objects.filter(chunk__document__in=document_ids, embedding_model=model_name).order_by(
+                'chunk__document', 'chunk__chunk_index'
+            ).values_list(
+                'chunk_id', 'chunk__document_id', 'chunk__text', 'chunk__chunk_index', 'vector', 'embedding_model'
+            ),
+        ]
+    
+    @staticmethod
+    def build(course, precision: str, path: Path, version: int, since: int = None, model_name: str = None) -> bool:
+        """
+        Write the course's snapshot (or the patch from since) with the vectors
+        of model_name to path, atomically via a temp file. Returns False
+        without writing anything if a full snapshot would have no chunks.
+        """
+        from django.conf import settings
+        from django.db.models import Q
+        from .models import Document, Chunk, ChunkEmbedding, DocumentTombstone, VectorIndex
+        
+        model_name = model_name or course.primary_embedding_model
+        index = VectorIndex.objects.filter(course=course, embedding_model=model_name).first()
+        documents = Document.objects.filter(course=course)
+        # Documents whose chunks have vectors for the model
+        with_vectors = Q(pk__in=Chunk.objects.filter(
+            document__course=course, embedding_model=model_name
+        ).values('document_id')) | Q(pk__in=ChunkEmbedding.objects.filter(
+            chunk__document__course=course, embedding_model=model_name
+        ).values('chunk__document_id'))
+        removed_ids = []
+        if since is not None:
+            changed = documents.filter(content_version__gt=since)
+            # Changed documents whose chunks are gone are removals too
+            removed_ids = list(changed.exclude(with_vectors).values_list('id', flat=True))
+            removed_ids += list(DocumentTombstone.objects.filter(
+                course_id=course.pk, content_version__gt=since
+            ).values_list('document_id', flat=True))
+            documents = changed
+        documents = documents.filter(with_vectors)
+        chunk_rows = VectorSnapshotService.chunk_rows(documents.values('id'), model_name)
+        
+        if since is None and not any(rows.exists() for rows in chunk_rows):
+            return False
+        
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        conn = sqlite3.connect(tmp_path)
+        try:
+            # The file is rebuilt from scratch on failure, so skip journaling
+            conn.execute('PRAGMA journal_mode=OFF')
+            conn.execute('PRAGMA synchronous=OFF')
+            cursor = conn.cursor()
+            
+            # Create schema
+            cursor.execute('''
+                CREATE TABLE snapshot_meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                )
+            ''')
+            
+            cursor.execute('''
+                CREATE TABLE courses (
+                    id INTEGER PRIMARY KEY,
+                    code TEXT NOT NULL UNIQUE,
+                    name TEXT NOT NULL
+                )
+            ''')
+            
+            cursor.execute('''
+                CREATE TABLE documents (
+                    id INTEGER PRIMARY KEY,
+                    course_id INTEGER NOT NULL,
+                    title TEXT NOT NULL,
+                    file_type TEXT,
+                    FOREIGN KEY (course_id) REFERENCES courses(id)
+                )
+            ''')
+            
+            extra_columns = list(VectorQuantizationService.EXTRA_COLUMNS.get(precision, []))
+            if index is not None:
+                extra_columns.append(('ann_list', 'INTEGER'))
+            extra_sql = ''.join(f'{name} {sql_type},\n' for name, sql_type in extra_columns)
+            cursor.execute(f'''
+                CREATE TABLE chunks (
+                    id INTEGER PRIMARY KEY,
+                    document_id INTEGER NOT NULL,
+                    text TEXT NOT NULL,
+                    chunk_index INTEGER NOT NULL,
+                    vector {'TEXT' if precision == 'json' else 'BLOB'} NOT NULL,
+                    {extra_sql}embedding_model TEXT,
+                    FOREIGN KEY (document_id) REFERENCES documents(id)
+                )
+            ''')
+            
+            first_vector = next((row[4] for rows in chunk_rows for row in rows[:1]), None)
+            meta = {
+                'format_version': VectorSnapshotService.FORMAT_VERSION,
+                'kind': 'full' if since is None else 'patch',
+                'course_id': course.pk,
+                'content_version': version,
+                'embedding_model': model_name,
+                **VectorQuantizationService.metadata(
+                    precision, len(first_vector) if first_vector is not None else None
+                ),
+            }
+            if index is not None:
+                meta.update({
+                    'ann_type': 'ivf_flat',
+                    'ann_metric': 'cosine',
+                    'ann_model': index.embedding_model,
+                    'ann_index_id': index.pk,
+                    'ann_lists': index.nlist,
+                    'ann_nprobe': getattr(settings, 'KNOWLEDGE_ANN_NPROBE', 8),
+                })
+                # Patches reuse the device's centroids; sync_min_version
+                # guarantees the index has not been retrained since
+                if since is None:
+                    cursor.execute('''
+                        CREATE TABLE ann_centroids (
+                            list_id INTEGER PRIMARY KEY,
+                            centroid BLOB NOT NULL
+                        )
+                    ''')
+                    cursor.executemany(
+                        'INSERT INTO ann_centroids (list_id, centroid) VALUES (?, ?)',
+                        ((list_id, row.astype('<f4').tobytes()) for list_id, row in enumerate(index.centroid_matrix()))
+                    )
+            if since is None:
+                meta['fts_table'] = 'chunks_fts'
+            else:
+                meta['base_version'] = since
+                cursor.execute('CREATE TABLE removed_documents (id INTEGER PRIMARY KEY)')
+                cursor.executemany(
+                    'INSERT OR IGNORE INTO removed_documents (id) VALUES (?)',
+                    ((doc_id,) for doc_id in removed_ids)
+                )
+            cursor.executemany(
+                'INSERT INTO snapshot_meta (key, value) VALUES (?, ?)',
+                ((key, str(value)) for key, value in meta.items())
+            )
+            
+            # Insert course
+            cursor.execute('INSERT INTO courses (id, code, name) VALUES (?, ?, ?)',
+                          (course.id, course.code, course.name))
+            
+            # Insert documents that have chunks
+            cursor.executemany(
+                'INSERT INTO documents (id, course_id, title, file_type) VALUES (?, ?, ?, ?)',
+                ((doc_id, course.id, title, file_type)
+                 for doc_id, title, file_type in documents.values_list('id', 'title', 'file_type'))
+            )
+            
+            # Insert chunks with their server ids, streaming rows from the database
+            # and encoding vectors one block at a time
+            columns = ['id', 'document_id', 'text', 'chunk_index', 'vector'] + [name for name, _ in extra_columns] + ['embedding_model']
+            insert_sql = f"INSERT INTO chunks ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+            rows = itertools.chain.from_iterable(rows.iterator(chunk_size=2000) for rows in chunk_rows)
+            while True:
+                block = list(itertools.islice(rows, 2000))
+                if not block:
+                    break
+                vectors = np.vstack([row[4] for row in block])
+                encoded = VectorQuantizationService.encode(vectors, precision)
+                if index is not None:
+                    # Chunks of other models are not in the index
+                    labels = VectorIndexService.assign(
+                        VectorSearchService.normalize(vectors), index.centroid_matrix()
+                    ).tolist()
+                    encoded = [
+                        (*values, label if row[5] == index.embedding_model else None)
+                        for row, values, label in zip(block, encoded, labels)
+                    ]
+                cursor.executemany(insert_sql, (
+                    (chunk_id, doc_id, text, chunk_index, *values, model)
+                    for (chunk_id, doc_id, text, chunk_index, _, model), values in zip(block, encoded)
+                ))
+            if index is not None:
+                cursor.execute('CREATE INDEX idx_chunks_ann_list ON chunks (ann_list)')
+            
+            # Full-text index for on-device keyword search. The triggers keep
+            # it in sync when the device applies delta patches to chunks.
+            if since is None:
+                for statement in VectorSnapshotService.FTS_SCHEMA:
+                    cursor.execute(statement)
+            
+            conn.commit()
+        except Exception:
+            conn.close()
+            tmp_path.unlink(missing_ok=True)
+            raise
+        conn.close()
+        os.replace(tmp_path, path)
+        return True
+    
+    @staticmethod
+    def evict(course_id: int, keep_version: int = None):
+        """Delete cached snapshots and patches of a course, except those for keep_version"""
+        prefix = f"course_{course_id}_v"
+        for path in VectorSnapshotService.snapshot_dir().glob(f"{prefix}*.db"):
+            version = path.name[len(prefix):].split('_', 1)[0]
+            if keep_version is not None and version == str(keep_version):
+                continue
+            path.unlink(missing_ok=True)
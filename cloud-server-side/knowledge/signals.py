@@ -0,0 +1,38 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Course, Document, DocumentTombstone, RequestProfile
+
+
+@receiver(post_save, sender=Document)
+def bump_course_version_on_document_save(sender, instance, **kwargs):
+    """Documents (and their chunks) are part of the course snapshot"""
+    Course.bump_content_version(instance.course_id, document_id=instance.pk)
+
+
+@receiver(post_delete, sender=Document)
+def record_document_tombstone(sender, instance, **kwargs):
+    """Bump the course version and leave a tombstone for delta syncs"""
+    Course.bump_content_version(instance.course_id)
+    version = Course.objects.filter(pk=instance.course_id).values_list('content_version', flat=True).first()
+    if version is not None:
+        DocumentTombstone.objects.create(
+            course_id=instance.course_id,
+            document_id=instance.pk,
+            content_version=version
+        )
+
+
+@receiver(post_delete, sender=Course)
+def clean_up_course(sender, instance, **kwargs):
+    from .services import VectorSnapshotService
+    DocumentTombstone.objects.filter(course_id=instance.pk).delete()
+    VectorSnapshotService.evict(instance.pk)
+
+
+@receiver(post_delete, sender=RequestProfile)
+def remove_profile_files(sender, instance, **kwargs):
+    from .profiling import profile_dir
+    directory = profile_dir()
+    for name in (f"{instance.name}.json", instance.raw_file):
+        (directory / name).unlink(missing_ok=True)
@@ -1,3 +1,1380 @@
-from django.test import TestCase
+import hashlib
+import importlib.util
+import json
+import multiprocessing
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+from unittest import mock, skipUnless
+from pathlib import Path
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import OperationalError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+
+from .models import (
+    Course, Document, Chunk, ChunkEmbedding, ChunkShadowVector, EmbeddingCacheEntry, IngestionJob, ReembeddingJob,
+    RequestProfile, VectorIndex
+)
+from . import metrics, services
+from .fields import VectorField
+from .jobs import IngestionQueue, IngestionWorkerPool, ReembeddingQueue
+from .services import (
+    ChunkExportService, ChunkStorageService, EmbeddingService, IngestionService, ReembeddingService
+)
+
+
+class QueryCountTests(TestCase):
+    """
+    Each endpoint runs a fixed number of queries however many rows it returns.
+    The fixtures hold several courses, documents and chunks per parent, so
+    a per-row query (N+1) shows up as a changed count.
+    """
+
+    COURSES = 3
+    DOCUMENTS_PER_COURSE = 4
+    CHUNKS_PER_DOCUMENT = 25
+
+    @classmethod
+    def setUpClass(cls):
+        cls.snapshot_dir = tempfile.mkdtemp()
+        cls.media_root = tempfile.mkdtemp()
+        cls._overrides = override_settings(
+            KNOWLEDGE_SNAPSHOT_DIR=cls.snapshot_dir,
+            MEDIA_ROOT=cls.media_root,
+            KNOWLEDGE_INGESTION_LOCAL_WORKERS=0,
+        )
+        cls._overrides.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls._overrides.disable()
+        shutil.rmtree(cls.snapshot_dir, ignore_errors=True)
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = np.random.default_rng(0)
+        cls.courses = []
+        for course_idx in range(cls.COURSES):
+            course = Course.objects.create(
+                code=f"SCI{course_idx:02d}", name=f"Science {course_idx}", embedding_models=["test-model"]
+            )
+            cls.courses.append(course)
+            for doc_idx in range(cls.DOCUMENTS_PER_COURSE):
+                document = Document.objects.create(
+                    course=course, title=f"Chapter {doc_idx}", file=f"documents/chapter-{course_idx}-{doc_idx}.txt",
+                    sha256=f"{course_idx:02d}{doc_idx:02d}".ljust(64, '0')
+                )
+                Chunk.objects.bulk_create([
+                    Chunk(
+                        document=document,
+                        text=f"photosynthesis turns light into energy, part {chunk_idx}",
+                        chunk_index=chunk_idx,
+                        vector=rng.standard_normal(8).astype(np.float32),
+                        embedding_model='test-model',
+                    )
+                    for chunk_idx in range(cls.CHUNKS_PER_DOCUMENT)
+                ])
+                IngestionJob.objects.create(document=document, status=IngestionJob.STATUS_SUCCEEDED, stage='done')
+        cls.course = cls.courses[0]
+        cls.document = cls.course.documents.first()
+        cls.job = cls.document.jobs.first()
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def get(self, url, queries, **params):
+        with self.assertNumQueries(queries):
+            response = self.client.get(url, params)
+        self.assertLess(response.status_code, 400, getattr(response, 'data', None))
+        return response
+
+    def test_course_list(self):
+        response = self.get('/api/knowledge/courses/', 2)
+        self.assertEqual(
+            [course['document_count'] for course in response.data['results']],
+            [self.DOCUMENTS_PER_COURSE] * self.COURSES
+        )
+
+    def test_course_detail(self):
+        response = self.get(f'/api/knowledge/courses/{self.course.pk}/', 1)
+        self.assertEqual(response.data['document_count'], self.DOCUMENTS_PER_COURSE)
+
+    def test_course_documents(self):
+        response = self.get(f'/api/knowledge/courses/{self.course.pk}/documents/', 2)
+        self.assertEqual(len(response.data), self.DOCUMENTS_PER_COURSE)
+        self.assertTrue(all(doc['chunk_count'] == self.CHUNKS_PER_DOCUMENT for doc in response.data))
+
+    def test_course_search(self):
+        # Vector and hybrid modes need the embedding model; they share the lexical mode's lookups
+        response = self.get(
+            f'/api/knowledge/courses/{self.course.pk}/search/', 3, q='photosynthesis', k=20, mode='lexical'
+        )
+        self.assertEqual(len(response.data['results']), 20)
+
+    def test_course_download_knowledge_base(self):
+        url = f'/api/knowledge/courses/{self.course.pk}/download_knowledge_base/'
+        # The first request builds the snapshot; serving the prebuilt file is constant
+        etag = self.client.get(url)['ETag']
+        response = self.get(url, 2)
+        response.close()
+        # Revalidation is answered from the course row alone
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_course_sync(self):
+        url = f'/api/knowledge/courses/{self.course.pk}/sync/'
+        self.get(url, 2, since=Course.objects.get(pk=self.course.pk).content_version)
+
+    def test_document_list(self):
+        response = self.get('/api/knowledge/documents/', 2)
+        self.assertTrue(all(doc['chunk_count'] == self.CHUNKS_PER_DOCUMENT for doc in response.data['results']))
+        self.get('/api/knowledge/documents/', 2, course_id=self.course.pk)
+
+    def test_document_detail(self):
+        response = self.get(f'/api/knowledge/documents/{self.document.pk}/', 2)
+        self.assertEqual(response.data['chunk_count'], self.CHUNKS_PER_DOCUMENT)
+        self.assertEqual(len(response.data['chunks']), self.CHUNKS_PER_DOCUMENT)
+        self.assertEqual(response.data['chunks'][0]['course_code'], self.course.code)
+
+    def test_document_chunks(self):
+        url = f'/api/knowledge/documents/{self.document.pk}/chunks/'
+        response = self.get(url, 2, page_size=10)
+        self.assertEqual([chunk['chunk_index'] for chunk in response.data['results']], list(range(10)))
+        # Later pages continue from a keyset cursor, without COUNT or OFFSET
+        with self.assertNumQueries(2):
+            response = self.client.get(response.data['next'])
+        self.assertEqual([chunk['chunk_index'] for chunk in response.data['results']], list(range(10, 20)))
+        response = self.get(url, 2, page_size=10, vectors='true')
+        self.assertEqual(len(response.data['results'][0]['vector']), 8)
+
+    def test_document_chunks_ndjson(self):
+        url = f'/api/knowledge/documents/{self.document.pk}/chunks/'
+        response = self.client.get(url, {'format': 'ndjson', 'vectors': 'true'})
+        with self.assertNumQueries(1):
+            lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), self.CHUNKS_PER_DOCUMENT)
+        self.assertEqual(len(json.loads(lines[0])['vector']), 8)
+        response = self.client.get(url, {'after': 19}, HTTP_ACCEPT='application/x-ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([row['chunk_index'] for row in rows], list(range(20, self.CHUNKS_PER_DOCUMENT)))
+
+    def test_chunk_export_batches(self):
+        # 25 chunks in batches of 10: three keyset queries, no row skipped or repeated
+        with self.assertNumQueries(3):
+            rows = list(ChunkExportService.iter_rows([self.document.pk], batch_size=10))
+        self.assertEqual([row['chunk_index'] for row in rows], list(range(self.CHUNKS_PER_DOCUMENT)))
+
+    def test_course_chunks_ndjson(self):
+        url = f'/api/knowledge/courses/{self.course.pk}/chunks/'
+        response = self.client.get(url)
+        # One keyset query per document (they hold fewer chunks than a batch)
+        with self.assertNumQueries(self.DOCUMENTS_PER_COURSE):
+            rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(len(rows), self.DOCUMENTS_PER_COURSE * self.CHUNKS_PER_DOCUMENT)
+        self.assertNotIn('vector', rows[0])
+        last = rows[30]
+        response = self.client.get(url, {'after': f"{last['document']}:{last['chunk_index']}"})
+        resumed = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(resumed, rows[31:])
+
+    def test_document_upload(self):
+        upload = SimpleUploadedFile('notes.txt', b'Photosynthesis happens in the chloroplast.')
+        with self.assertNumQueries(7):
+            response = self.client.post('/api/knowledge/documents/', {
+                'title': 'Notes', 'course': self.course.pk, 'file_type': 'txt', 'file': upload,
+            }, format='multipart')
+        self.assertEqual(response.status_code, 202, response.data)
+
+    def test_job_list(self):
+        response = self.get('/api/knowledge/jobs/', 2)
+        self.assertEqual(len(response.data['results']), 10)
+
+    def test_job_detail(self):
+        self.get(f'/api/knowledge/jobs/{self.job.pk}/', 1)
+
+    def test_embedding_cache_stats(self):
+        self.get('/api/knowledge/jobs/embedding_cache/', 1)
+
+    def test_metrics(self):
+        # Only the ingestion job gauge reads the database
+        with self.assertNumQueries(1):
+            response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn('# TYPE knowledge_ingestion_stage_seconds histogram', response.content.decode())
+        self.assertIn(b'knowledge_ingestion_jobs{status="queued"}', response.content)
+        # Worker processes leave the database-wide gauge to the web server
+        with self.assertNumQueries(0):
+            body = metrics.render(shared=False)
+        self.assertNotIn('knowledge_ingestion_jobs', body)
+        self.assertIn('knowledge_ingestion_stage_seconds', body)
+
+
+class ProfilingTests(TestCase):
+    """Profiles are opt-in for staff users, capture queries and end up in the bounded ring buffer"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.profile_dir = tempfile.mkdtemp()
+        cls._overrides = override_settings(KNOWLEDGE_PROFILE_DIR=cls.profile_dir, KNOWLEDGE_PROFILE_KEEP=2)
+        cls._overrides.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls._overrides.disable()
+        shutil.rmtree(cls.profile_dir, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.staff = User.objects.create_user('staff', password='x', is_staff=True)
+        cls.student = User.objects.create_user('student', password='x')
+        cls.course = Course.objects.create(code='BIO101', name='Biology')
+        cls.document = Document.objects.create(course=cls.course, title='Cells', file='documents/cells.txt')
+        Chunk.objects.bulk_create([
+            Chunk(document=cls.document, text=f"cells {idx}", chunk_index=idx,
+                  vector=np.ones(8, dtype=np.float32), embedding_model='test-model')
+            for idx in range(5)
+        ])
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_header_needs_staff(self):
+        url = f'/api/knowledge/courses/{self.course.pk}/'
+        self.client.force_login(self.student)
+        response = self.client.get(url, HTTP_X_KNOWLEDGE_PROFILE='1')
+        self.assertNotIn('X-Knowledge-Profile', response)
+        self.assertFalse(RequestProfile.objects.exists())
+
+    def test_streamed_export_profile(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(f'/api/knowledge/courses/{self.course.pk}/chunks/', HTTP_X_KNOWLEDGE_PROFILE='1')
+        # Saved once the body has been streamed, including the export's queries
+        self.assertFalse(RequestProfile.objects.exists())
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 5)
+        profile = RequestProfile.objects.get()
+        self.assertEqual(profile.name, response['X-Knowledge-Profile'])
+        self.assertEqual((profile.kind, profile.status_code, profile.user), ('request', 200, 'staff'))
+        self.assertGreaterEqual(profile.query_count, 2)
+        saved = json.loads((Path(self.profile_dir) / f"{profile.name}.json").read_text())
+        self.assertEqual(saved['query_count'], profile.query_count)
+        self.assertTrue((Path(self.profile_dir) / profile.raw_file).is_file())
+
+    def test_ring_buffer(self):
+        self.client.force_login(self.staff)
+        names = [
+            self.client.get(f'/api/knowledge/courses/{self.course.pk}/', HTTP_X_KNOWLEDGE_PROFILE=mode)['X-Knowledge-Profile']
+            for mode in ('sampling', 'cprofile', 'sampling')
+        ]
+        self.assertEqual(set(RequestProfile.objects.values_list('name', flat=True)), set(names[1:]))
+        self.assertEqual(RequestProfile.objects.get(name=names[1]).raw_file, f"{names[1]}.prof")
+        # The oldest profile's files went with its row
+        self.assertEqual(len(list(Path(self.profile_dir).iterdir())), 4)
+
+
+@override_settings(KNOWLEDGE_INGESTION_LOCAL_WORKERS=0)
+class IngestionQueueTests(TestCase):
+    """Failed jobs are retried up to max_attempts; cancelled jobs leave no chunks"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.course = Course.objects.create(code='ART101', name='Art')
+
+    def setUp(self):
+        self.client = APIClient()
+        document = Document.objects.create(course=self.course, title='Colour', file='documents/colour.txt')
+        self.job = IngestionQueue.enqueue(document)
+
+    def run_claimed(self, process_document):
+        job = IngestionQueue.claim_next('worker')
+        self.assertEqual(job.pk, self.job.pk)
+        with mock.patch.object(IngestionService, 'process_document', side_effect=process_document):
+            return IngestionQueue.run_job(job)
+
+    def test_failures_retry_then_fail(self):
+        def fail(document, progress=None):
+            raise RuntimeError("parser crashed")
+
+        for attempt in range(1, self.job.max_attempts + 1):
+            job = self.run_claimed(fail)
+            self.assertEqual(job.attempts, attempt)
+        self.assertEqual(job.status, IngestionJob.STATUS_FAILED)
+        self.assertIn("parser crashed", job.error)
+
+        response = self.client.post(f'/api/knowledge/jobs/{job.pk}/retry/')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual((response.data['status'], response.data['attempts']), (IngestionJob.STATUS_QUEUED, 0))
+
+    def test_cancel_running_job_discards_chunks(self):
+        def store_then_report(document, progress=None):
+            ChunkStorageService.append_chunks(
+                document, ["red", "blue"], np.ones((2, 8), dtype=np.float32), 'test-model', start_index=0
+            )
+            # The API call lands while the job runs; the next progress report stops it
+            self.client.post(f'/api/knowledge/jobs/{self.job.pk}/cancel/')
+            progress('store', done=2, total=2)
+
+        job = self.run_claimed(store_then_report)
+        self.assertEqual(job.status, IngestionJob.STATUS_CANCELLED)
+        self.assertFalse(Chunk.objects.filter(document=job.document).exists())
+        # Finished jobs cannot be cancelled again
+        self.assertEqual(self.client.post(f'/api/knowledge/jobs/{job.pk}/cancel/').status_code, 409)
+
+    def test_cancel_queued_job(self):
+        response = self.client.post(f'/api/knowledge/jobs/{self.job.pk}/cancel/')
+        self.assertEqual(response.data['status'], IngestionJob.STATUS_CANCELLED)
+        self.assertIsNone(IngestionQueue.claim_next('worker'))
+
+
+class IngestionWorkerPoolTests(TestCase):
+    """Worker threads log errors and keep polling; dead threads are restarted"""
+
+    def test_worker_survives_errors(self):
+        pool = IngestionWorkerPool(workers=1, poll_interval=0.01)
+        calls = []
+
+        def run_once(worker_name):
+            calls.append(worker_name)
+            if len(calls) == 1:
+                raise OperationalError("database is locked")
+            pool.stop(wait=False)
+
+        with mock.patch.object(pool, '_run_once', side_effect=run_once), \
+                self.assertLogs('knowledge.jobs', 'ERROR') as logs:
+            pool.start()
+            pool._threads[0].join(5)
+        self.assertEqual(len(calls), 2)
+        self.assertIn("ingestion worker error", logs.output[0])
+
+    def test_restart_dead(self):
+        pool = IngestionWorkerPool(workers=2, poll_interval=0.01)
+        with mock.patch.object(pool, '_run', side_effect=lambda worker_name: None):
+            pool.start()
+            for thread in pool._threads:
+                thread.join(5)
+        self.assertFalse(pool.is_alive())
+
+        with mock.patch.object(pool, '_run', side_effect=lambda worker_name: pool._stop.wait(5)), \
+                self.assertLogs('knowledge.jobs', 'WARNING'):
+            self.assertEqual(pool.restart_dead(), 2)
+            self.assertTrue(all(thread.is_alive() for thread in pool._threads))
+            pool.stop()
+        self.assertEqual(pool.restart_dead(), 0)
+
+
+@override_settings(KNOWLEDGE_INGESTION_LOCAL_WORKERS=0)
+class SnapshotSyncTests(TestCase):
+    """
+    A delta patch carries only the documents changed since the base version,
+    plus tombstones. Full downloads support ranges and ETag revalidation.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.snapshot_dir = tempfile.mkdtemp()
+        cls._overrides = override_settings(KNOWLEDGE_SNAPSHOT_DIR=cls.snapshot_dir)
+        cls._overrides.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls._overrides.disable()
+        shutil.rmtree(cls.snapshot_dir, ignore_errors=True)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.course = Course.objects.create(code='HIS101', name='History', embedding_models=['test-model'])
+        self.documents = {}
+        for title in ('kept', 'edited', 'deleted'):
+            self.add_document(title)
+
+    def add_document(self, title, chunks=3):
+        document = Document.objects.create(course=self.course, title=title, file=f'documents/{title}.txt')
+        ChunkStorageService.store_chunks(
+            document, [f"{title} {idx}" for idx in range(chunks)],
+            np.random.default_rng(len(self.documents)).normal(size=(chunks, 8)).astype(np.float32), 'test-model'
+        )
+        self.documents[title] = document
+
+    def version(self):
+        return Course.objects.values_list('content_version', flat=True).get(pk=self.course.pk)
+
+    def sync(self, since):
+        return self.client.get(f'/api/knowledge/courses/{self.course.pk}/sync/', {'since': since})
+
+    def read_patch(self, response):
+        path = Path(self.snapshot_dir) / 'downloaded.patch.db'
+        path.write_bytes(b''.join(response.streaming_content))
+        with sqlite3.connect(path) as conn:
+            patch = {
+                'meta': dict(conn.execute('SELECT key, value FROM snapshot_meta')),
+                'documents': {title for title, in conn.execute('SELECT title FROM documents')},
+                'chunks': sorted(text for text, in conn.execute('SELECT text FROM chunks')),
+                'removed': {doc_id for doc_id, in conn.execute('SELECT id FROM removed_documents')},
+            }
+        path.unlink()
+        return patch
+
+    def test_patch_contents(self):
+        base = self.version()
+        edited = self.documents['edited']
+        ChunkStorageService.store_chunks(edited, ["edited again"], np.ones((1, 8), dtype=np.float32), 'test-model')
+        deleted_id = self.documents['deleted'].pk
+        self.documents['deleted'].delete()
+        self.add_document('added', chunks=2)
+
+        response = self.sync(base)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Content-Version'], str(self.version()))
+        patch = self.read_patch(response)
+        self.assertEqual(patch['meta']['kind'], 'patch')
+        self.assertEqual(patch['meta']['base_version'], str(base))
+        self.assertEqual(patch['documents'], {'edited', 'added'})
+        self.assertEqual(patch['chunks'], ["added 0", "added 1", "edited again"])
+        self.assertEqual(patch['removed'], {deleted_id})
+
+    def test_chunks_cleared_is_a_removal(self):
+        base = self.version()
+        ChunkStorageService.clear_chunks(self.documents['edited'])
+        patch = self.read_patch(self.sync(base))
+        self.assertEqual(patch['documents'], set())
+        self.assertEqual(patch['removed'], {self.documents['edited'].pk})
+
+    def test_build_retried_when_course_changes(self):
+        build = services.VectorSnapshotService.build
+        calls = []
+
+        def build_during_upload(course, precision, path, version, *args):
+            if not calls:
+                self.add_document('uploaded meanwhile')
+            calls.append(version)
+            return build(course, precision, path, version, *args)
+
+        with mock.patch.object(services.VectorSnapshotService, 'build', side_effect=build_during_upload):
+            path, version = services.VectorSnapshotService.get_or_build(self.course)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(version, self.version())
+        self.assertEqual(path.name, services.VectorSnapshotService.snapshot_path(
+            self.course.pk, version, 'json', model_name='test-model'
+        ).name)
+        with sqlite3.connect(path) as conn:
+            self.assertEqual(conn.execute('SELECT COUNT(*) FROM documents').fetchone()[0], 4)
+        self.assertEqual(sorted(p.name for p in Path(self.snapshot_dir).iterdir()), [path.name])
+
+    def download(self, **headers):
+        return self.client.get(f'/api/knowledge/courses/{self.course.pk}/download_knowledge_base/', **headers)
+
+    def test_range_requests(self):
+        full = self.download()
+        etag, body = full['ETag'], b''.join(full.streaming_content)
+        size = len(body)
+
+        response = self.download(HTTP_RANGE='bytes=10-99')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 10-99/{size}')
+        self.assertEqual(response['Content-Length'], '90')
+        self.assertEqual(b''.join(response.streaming_content), body[10:100])
+
+        # Suffix and open-ended ranges, the way interrupted downloads resume
+        response = self.download(HTTP_RANGE='bytes=-50', HTTP_IF_RANGE=etag)
+        self.assertEqual(response['Content-Range'], f'bytes {size - 50}-{size - 1}/{size}')
+        self.assertEqual(b''.join(response.streaming_content), body[-50:])
+        response = self.download(HTTP_RANGE=f'bytes={size - 5}-')
+        self.assertEqual(b''.join(response.streaming_content), body[-5:])
+
+        response = self.download(HTTP_RANGE=f'bytes={size}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{size}')
+
+        # A range against an older file gets the whole current one
+        response = self.download(HTTP_RANGE='bytes=10-99', HTTP_IF_RANGE='"kb-stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), body)
+
+    def test_etag_changes_after_upload(self):
+        response = self.download()
+        etag = response['ETag']
+        response.close()
+        self.assertEqual(self.download(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.add_document('uploaded later')
+        response = self.download(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response['X-Content-Version'], str(self.version()))
+        response.close()
+
+    def test_precision_metadata(self):
+        vectors = Chunk.objects.filter(document__course=self.course).order_by('id').values_list('id', 'vector')
+        expected = {chunk_id: vector for chunk_id, vector in vectors}
+        for precision in services.VectorQuantizationService.PRECISIONS:
+            with self.subTest(precision=precision):
+                response = self.download(QUERY_STRING=f'precision={precision}')
+                path = Path(self.snapshot_dir) / 'downloaded.db'
+                path.write_bytes(b''.join(response.streaming_content))
+                with sqlite3.connect(path) as conn:
+                    meta = dict(conn.execute('SELECT key, value FROM snapshot_meta'))
+                    columns = [row[1] for row in conn.execute('PRAGMA table_info(chunks)')]
+                    rows = conn.execute('SELECT * FROM chunks ORDER BY id').fetchall()
+                path.unlink()
+
+                self.assertEqual((meta['precision'], meta['dimension']), (precision, '8'))
+                self.assertEqual(len(rows), len(expected))
+                row = dict(zip(columns, rows[0]))
+                if precision == 'int8':
+                    self.assertEqual(meta['scale_column'], 'vector_scale')
+                    decoded = np.frombuffer(row['vector'], np.int8) * row['vector_scale']
+                    np.testing.assert_allclose(decoded, expected[row['id']], atol=row['vector_scale'] / 2 + 1e-6)
+                elif precision.startswith('binary'):
+                    self.assertEqual((meta['quantization'], meta['bit_order']), ('sign', 'big'))
+                    self.assertEqual(len(row['vector']), 1)
+                    bits = np.unpackbits(np.frombuffer(row['vector'], np.uint8))
+                    np.testing.assert_array_equal(bits, expected[row['id']] > 0)
+                    if precision == 'binary_int8':
+                        self.assertEqual(meta['rescore_column'], 'rescore_vector')
+                        self.assertEqual(meta['rescore_scale_column'], 'rescore_scale')
+                        decoded = np.frombuffer(row['rescore_vector'], np.int8) * row['rescore_scale']
+                        np.testing.assert_allclose(decoded, expected[row['id']], atol=row['rescore_scale'] / 2 + 1e-6)
+                    else:
+                        self.assertNotIn('rescore_column', meta)
+                        self.assertNotIn('rescore_vector', columns)
+                elif precision in ('float32', 'float16'):
+                    self.assertEqual(meta['byte_order'], 'little')
+                    dtype = '<f4' if precision == 'float32' else '<f2'
+                    np.testing.assert_allclose(np.frombuffer(row['vector'], dtype), expected[row['id']], rtol=2 ** -11)
+                else:
+                    np.testing.assert_allclose(json.loads(row['vector']), expected[row['id']], rtol=1e-6)
+
+    def test_up_to_date_and_too_old(self):
+        self.assertEqual(self.sync(self.version()).status_code, 204)
+        Course.objects.filter(pk=self.course.pk).update(sync_min_version=self.version())
+        self.assertEqual(self.sync(self.version() - 1).status_code, 409)
+
+
+class VectorIndexTests(TestCase):
+    """Probing enough IVF lists finds the same top-k as a brute-force scan"""
+
+    def test_probe_matches_brute_force(self):
+        rng = np.random.default_rng(0)
+        centers = rng.normal(size=(20, 32))
+        vectors = centers[rng.integers(0, 20, 2000)] + rng.normal(scale=0.3, size=(2000, 32))
+        matrix = services.VectorSearchService.normalize(vectors)
+        centroids = services.VectorIndexService.train(matrix, nlist=16)
+        labels = services.VectorIndexService.assign(matrix, centroids)
+        order, offsets = services.VectorIndexService.inverted_lists(labels, len(centroids))
+        self.assertEqual(sorted(order.tolist()), list(range(len(matrix))))
+
+        for query in services.VectorSearchService.normalize(rng.normal(size=(10, 32))):
+            exact = services.VectorSearchService.top_k(matrix @ query, 10)
+            probed = services.VectorIndexService.search(
+                query, matrix, centroids, order, offsets, k=10, nprobe=len(centroids)
+            )
+            self.assertEqual(probed.tolist(), exact.tolist())
+            # A few lists already find most of the true neighbours
+            nearby = services.VectorIndexService.search(query, matrix, centroids, order, offsets, k=10, nprobe=8)
+            self.assertGreaterEqual(len(set(nearby.tolist()) & set(exact.tolist())), 7)
+
+    @override_settings(KNOWLEDGE_ANN_MIN_CHUNKS=50)
+    def test_search_never_trains(self):
+        course = Course.objects.create(code='PHY101', name='Physics', embedding_models=['test-model'])
+        document = Document.objects.create(course=course, title='Waves', file='documents/waves.txt')
+        vectors = np.random.default_rng(0).normal(size=(100, 8)).astype(np.float32)
+        ChunkStorageService.store_chunks(document, [f"wave {idx}" for idx in range(100)], vectors, 'test-model')
+        course.refresh_from_db()
+        version = course.content_version
+
+        services.VectorSearchService.clear()
+        ids, matrix, ivf = services.VectorSearchService.course_matrix(course, 'test-model')
+        self.assertEqual((len(ids), ivf), (100, None))
+        self.assertFalse(VectorIndex.objects.exists())
+        self.assertEqual(Course.objects.get(pk=course.pk).content_version, version)
+
+        services.VectorIndexService.refresh(course)
+        course.refresh_from_db()
+        self.assertEqual(course.sync_min_version, course.content_version)
+        ids, matrix, ivf = services.VectorSearchService.course_matrix(course, 'test-model')
+        self.assertEqual(len(ivf[0]), VectorIndex.objects.get(course=course).nlist)
+
+
+class VectorQuantizationTests(TestCase):
+    """Each export precision decodes within its error bound; binary ranks by Hamming distance"""
+
+    def setUp(self):
+        self.vectors = np.random.default_rng(0).normal(size=(50, 20)).astype(np.float32)
+
+    def test_float_round_trips(self):
+        Q = services.VectorQuantizationService
+        decoded = np.vstack([np.frombuffer(row[0], '<f4') for row in Q.encode(self.vectors, 'float32')])
+        np.testing.assert_array_equal(decoded, self.vectors)
+        decoded = np.vstack([np.frombuffer(row[0], '<f2') for row in Q.encode(self.vectors, 'float16')])
+        # float16 keeps 11 significant bits
+        np.testing.assert_allclose(decoded, self.vectors, rtol=2 ** -11, atol=1e-7)
+        decoded = np.array([json.loads(row[0]) for row in Q.encode(self.vectors, 'json')], dtype=np.float32)
+        np.testing.assert_array_equal(decoded, self.vectors)
+
+    def test_int8_round_trip(self):
+        rows = services.VectorQuantizationService.encode(self.vectors, 'int8')
+        for (codes, scale), vector in zip(rows, self.vectors):
+            decoded = np.frombuffer(codes, np.int8).astype(np.float32) * scale
+            self.assertEqual(np.abs(np.frombuffer(codes, np.int8)).max(), 127)
+            # Rounding to the nearest code is off by at most half a step
+            self.assertLessEqual(np.abs(decoded - vector).max(), scale / 2 + 1e-6)
+
+    def test_binary_packing(self):
+        Q = services.VectorQuantizationService
+        for row, vector in zip(Q.encode(self.vectors, 'binary'), self.vectors):
+            self.assertEqual(len(row), 1)
+            self.assertEqual(len(row[0]), 3)
+            bits = np.unpackbits(np.frombuffer(row[0], np.uint8))
+            np.testing.assert_array_equal(bits[:20], vector > 0)
+            self.assertFalse(bits[20:].any())
+        packed, rescore, scale = Q.encode(self.vectors[:1], 'binary_int8')[0]
+        self.assertEqual(packed, Q.encode(self.vectors[:1], 'binary')[0][0])
+        self.assertEqual(rescore, Q.encode(self.vectors[:1], 'int8')[0][0])
+
+    def test_binary_search_orders(self):
+        Q = services.VectorQuantizationService
+        query = np.ones(16, dtype=np.float32)
+        # Row i has i negative dimensions, so Hamming distance i from the query
+        vectors = np.ones((10, 16), dtype=np.float32)
+        for idx in range(10):
+            vectors[idx, :idx] = -1
+        self.assertEqual(Q.search(query, vectors[::-1], 'binary', k=3).tolist(), [9, 8, 7])
+
+        # Same bits, different cosine: only rescoring tells them apart
+        vectors = np.ones((6, 16), dtype=np.float32)
+        vectors[:, 0] = [0.1, 0.2, 5.0, 0.3, 9.0, 0.4]
+        self.assertEqual(Q.search(query, vectors, 'binary_int8', k=2, rescore_factor=3).tolist(), [5, 3])
+        self.assertEqual(Q.search(query, vectors, 'float32', k=2).tolist(), [5, 3])
+
+
+class HybridSearchTests(TestCase):
+    """Reciprocal rank fusion, and the FTS index following chunk updates and deletes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.course = Course.objects.create(code='BIO101', name='Biology', embedding_models=['test-model'])
+        cls.document = Document.objects.create(course=cls.course, title='Cells', file='documents/cells.txt')
+        ChunkStorageService.store_chunks(
+            cls.document, ["mitochondria make energy", "ribosomes make proteins", "the nucleus holds DNA"],
+            np.ones((3, 8), dtype=np.float32), 'test-model'
+        )
+
+    def search(self, query):
+        return [chunk_id for chunk_id, _ in services.LexicalSearchService.search(self.course, query)]
+
+    def test_fuse_rewards_agreement(self):
+        lexical = [(1, 9.0), (2, 5.0), (3, 1.0)]
+        vector = [(2, 0.9), (3, 0.8), (4, 0.7)]
+        fused = services.HybridSearchService.fuse([lexical, vector], k=3, rrf_k=60)
+        self.assertEqual([chunk_id for chunk_id, _ in fused], [2, 3, 1])
+        self.assertAlmostEqual(fused[0][1], 1 / 62 + 1 / 61)
+        # Scores are ignored, only ranks count
+        self.assertEqual(services.HybridSearchService.fuse([[(5, -1.0)], [(5, 100.0)]], k=1), [(5, 2 / 61)])
+
+    def test_fts_follows_update_and_delete(self):
+        chunk = Chunk.objects.get(document=self.document, chunk_index=0)
+        self.assertEqual(self.search("mitochondria"), [chunk.pk])
+
+        chunk.text = "chloroplasts capture light"
+        chunk.save(update_fields=['text'])
+        self.assertEqual(self.search("mitochondria"), [])
+        self.assertEqual(self.search("chloroplasts"), [chunk.pk])
+
+        chunk.delete()
+        self.assertEqual(self.search("chloroplasts"), [])
+        self.assertEqual(len(self.search("make nucleus")), 2)
+
+
+@override_settings(KNOWLEDGE_INGESTION_LOCAL_WORKERS=0)
+class DuplicateUploadTests(TestCase):
+    """Re-uploads of an ingested file reuse its chunks in the job, or are rejected"""
+
+    CONTENT = b'The French Revolution began in 1789.'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp()
+        cls._overrides = override_settings(MEDIA_ROOT=cls.media_root)
+        cls._overrides.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls._overrides.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.course = Course.objects.create(code='FRE101', name='French', embedding_models=['test-model'])
+        cls.source = Document.objects.create(
+            course=cls.course, title='Revolution', file='documents/revolution.txt',
+            sha256=hashlib.sha256(cls.CONTENT).hexdigest()
+        )
+        ChunkStorageService.store_chunks(
+            cls.source, ["The French Revolution", "began in 1789."],
+            np.arange(16, dtype=np.float32).reshape(2, 8), 'test-model', page_numbers=[1, 2]
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def upload(self, on_duplicate):
+        return self.client.post('/api/knowledge/documents/', {
+            'title': 'Revolution again', 'course': self.course.pk, 'file_type': 'txt',
+            'file': SimpleUploadedFile('revolution.txt', self.CONTENT), 'on_duplicate': on_duplicate,
+        }, format='multipart')
+
+    def run_next_job(self):
+        job = IngestionQueue.claim_next('worker')
+        return IngestionQueue.run_job(job)
+
+    def test_reuse_copies_chunks_in_job(self):
+        response = self.upload('reuse')
+        self.assertEqual(response.status_code, 202, response.data)
+        self.assertEqual(response.data['status'], IngestionJob.STATUS_QUEUED)
+        document = Document.objects.get(pk=response.data['document'])
+        self.assertEqual((document.duplicate_of_id, document.file.name), (self.source.pk, self.source.file.name))
+        self.assertFalse(document.chunks.exists())
+
+        with mock.patch.object(IngestionService, 'process_document') as process_document:
+            job = self.run_next_job()
+        process_document.assert_not_called()
+        self.assertEqual((job.status, job.chunks_stored, job.cache_hits), (IngestionJob.STATUS_SUCCEEDED, 2, 2))
+        copied = list(document.chunks.order_by('chunk_index').values_list('text', 'page_number', 'vector'))
+        original = list(self.source.chunks.order_by('chunk_index').values_list('text', 'page_number', 'vector'))
+        self.assertEqual([row[:2] for row in copied], [row[:2] for row in original])
+        np.testing.assert_array_equal(np.vstack([row[2] for row in copied]), np.vstack([row[2] for row in original]))
+
+    def test_reuse_after_source_deleted_ingests(self):
+        response = self.upload('reuse')
+        self.source.delete()
+        with mock.patch.object(IngestionService, 'process_document') as process_document:
+            job = self.run_next_job()
+        process_document.assert_called_once()
+        self.assertEqual(job.status, IngestionJob.STATUS_SUCCEEDED)
+        self.assertEqual(job.document_id, response.data['document'])
+
+    def test_reject(self):
+        response = self.upload('reject')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['duplicate_of'], self.source.pk)
+        self.assertEqual(Document.objects.count(), 1)
+        self.assertFalse(IngestionJob.objects.exists())
+
+
+class TokenBudgetSplitterTests(TestCase):
+    """Chunks stay within chunk_size tokens and overlap by at most chunk_overlap tokens"""
+
+    @classmethod
+    def setUpClass(cls):
+        from tokenizers import Tokenizer, models, pre_tokenizers
+
+        super().setUpClass()
+
+        # Every word and punctuation mark is one token
+        tokenizer = Tokenizer(models.WordLevel({"[UNK]": 0}, unk_token="[UNK]"))
+        tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+        cls.splitter = services.TokenBudgetSplitter(tokenizer, chunk_size=20, chunk_overlap=6)
+        rng = np.random.default_rng(0)
+        paragraphs = []
+        for _ in range(12):
+            sentences = [
+                ' '.join(f"w{idx}" for idx in rng.integers(0, 1000, rng.integers(3, 15)))
+                for _ in range(rng.integers(1, 6))
+            ]
+            paragraphs.append('. '.join(sentences) + '.')
+        # A run with no separator but "" must be cut between tokens
+        paragraphs.append('-'.join(f"x{idx}" for idx in range(40)))
+        cls.text = '\n\n'.join(paragraphs)
+
+    def assert_within_limits(self, chunks):
+        for text, _ in chunks:
+            self.assertLessEqual(self.splitter.count_tokens(text), self.splitter.chunk_size, text)
+
+    def test_chunk_size_and_overlap(self):
+        chunks = self.splitter.split(self.text)
+        self.assert_within_limits(chunks)
+        overlaps = []
+        for (text, offset), (_, next_offset) in zip(chunks, chunks[1:]):
+            self.assertEqual(self.text[offset:offset + len(text)], text)
+            shared = self.text[next_offset:offset + len(text)]
+            overlaps.append(self.splitter.count_tokens(shared))
+        self.assertLessEqual(max(overlaps), self.splitter.chunk_overlap)
+        self.assertGreater(sum(overlaps), 0)
+        # Nothing is dropped
+        words = set(self.text.replace('.', ' ').replace('-', ' ').split())
+        self.assertEqual(set(' '.join(text for text, _ in chunks).replace('.', ' ').replace('-', ' ').split()), words)
+
+    def test_incremental_chunks_keep_limits(self):
+        pages = [(number, page) for number, page in enumerate(self.text.split('\n\n'), start=1)]
+        chunks = list(services.ChunkingService.iter_chunks(pages, self.splitter, window=200))
+        self.assert_within_limits(chunks)
+        self.assertEqual(chunks[0][1], 1)
+        self.assertEqual(chunks[-1][1], len(pages))
+
+    def test_overlap_must_be_smaller(self):
+        with self.assertRaises(ValueError):
+            services.TokenBudgetSplitter(self.splitter.tokenizer, chunk_size=8, chunk_overlap=8)
+
+
+class WarmUpTests(TestCase):
+    """Only processes that serve requests warm the embedding model on startup"""
+
+    def serves_requests(self, argv, run_main=None):
+        from .apps import _serves_requests
+
+        environ = {'RUN_MAIN': run_main} if run_main else {}
+        with mock.patch('sys.argv', argv), mock.patch.dict('os.environ', environ), mock.patch.dict('sys.modules'):
+            # Whatever runs this suite, judge the argv alone
+            sys.modules.pop('pytest', None)
+            return _serves_requests()
+
+    def test_process_kinds(self):
+        self.assertTrue(self.serves_requests(['/venv/bin/gunicorn', 'core.wsgi']))
+        self.assertTrue(self.serves_requests(['manage.py', 'runserver'], run_main='true'))
+        self.assertFalse(self.serves_requests(['manage.py', 'runserver']))
+        self.assertFalse(self.serves_requests(['manage.py', 'migrate']))
+        self.assertFalse(self.serves_requests(['manage.py', 'test']))
+
+    def test_ready_warms_in_background(self):
+        from django.apps import apps
+
+        with mock.patch('knowledge.apps._serves_requests', return_value=True), \
+                mock.patch.object(EmbeddingService, 'warm_up', return_value=[]) as warm_up:
+            apps.get_app_config('knowledge').ready()
+            for thread in threading.enumerate():
+                if thread.name == 'embedding-warm-up':
+                    thread.join(5)
+        warm_up.assert_called_once_with()
+
+
+@override_settings(
+    KNOWLEDGE_PDF_WORKERS=2, KNOWLEDGE_PDF_PAGES_PER_TASK=1, KNOWLEDGE_INGESTION_LOCAL_WORKERS=0,
+    KNOWLEDGE_CHUNKER='characters', KNOWLEDGE_EMBEDDING_CACHE_SIZE=0,
+)
+class PdfProcessPoolTests(TestCase):
+    """PDF pages extracted by the worker pool arrive in order with their page numbers; worker errors fail the job"""
+
+    PAGES = 6
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp()
+        cls._overrides = override_settings(MEDIA_ROOT=cls.media_root)
+        cls._overrides.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls._overrides.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        from .benchmarks import _write_pdf
+
+        cls.course = Course.objects.create(code='BIO201', name='Biology', embedding_models=['test-model'])
+        path = Path(cls.media_root) / 'documents' / 'cells.pdf'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Words are tagged with their page, so each chunk shows the page it starts on
+        _write_pdf(path, [' '.join(f"p{page}w{idx}" for idx in range(120)) for page in range(1, cls.PAGES + 1)])
+        cls.document = Document.objects.create(
+            course=cls.course, title='Cells', file='documents/cells.pdf', file_type='pdf'
+        )
+
+    def run_next_job(self):
+        job = IngestionQueue.claim_next('worker')
+        service = _ConstantEmbeddingService('test-model', 1.0)
+        with mock.patch.object(EmbeddingService, 'get_shared', return_value=service):
+            return IngestionQueue.run_job(job)
+
+    def test_pages_in_order(self):
+        pages = list(services.DocumentParsingService.iter_pdf_pages(self.document.file.path))
+        self.assertEqual([number for number, _ in pages], list(range(1, self.PAGES + 1)))
+        for number, text in pages:
+            self.assertTrue(text.startswith(f"p{number}w0 "), text[:20])
+        self.assertEqual(multiprocessing.active_children(), [])
+
+    def test_chunk_page_numbers(self):
+        IngestionQueue.enqueue(self.document)
+        job = self.run_next_job()
+        self.assertEqual(job.status, IngestionJob.STATUS_SUCCEEDED, job.error)
+
+        chunks = list(self.document.chunks.order_by('chunk_index').values_list('text', 'page_number'))
+        self.assertGreater(len(chunks), self.PAGES)
+        for text, page_number in chunks:
+            self.assertEqual(page_number, int(text.split('w', 1)[0][1:]), text[:20])
+        self.assertEqual({page for _, page in chunks}, set(range(1, self.PAGES + 1)))
+
+    def test_worker_error_fails_job(self):
+        broken = Document.objects.create(
+            course=self.course, title='Broken', file='documents/broken.pdf', file_type='pdf'
+        )
+        Path(broken.file.path).write_bytes(b'%PDF-1.4\nnot a pdf\n')
+        job = IngestionQueue.enqueue(broken)
+        job.max_attempts = 1
+        job.save()
+        # The page count is read in this process; the pages fail to parse in the workers
+        with mock.patch.object(services.DocumentParsingService, 'pdf_page_count', return_value=self.PAGES), \
+                self.assertLogs('knowledge.jobs', 'WARNING'):
+            job = self.run_next_job()
+        self.assertEqual(job.status, IngestionJob.STATUS_FAILED)
+        self.assertIn('extract_pdf_pages', job.error)
+        self.assertFalse(broken.chunks.exists())
+        self.assertEqual(multiprocessing.active_children(), [])
+
+
+@override_settings(
+    KNOWLEDGE_INGESTION_LOCAL_WORKERS=0, KNOWLEDGE_CHUNKER='characters', KNOWLEDGE_EMBEDDING_CACHE_SIZE=0,
+    KNOWLEDGE_EMBEDDING_BATCH_SIZE=1, KNOWLEDGE_PIPELINE_QUEUE_SIZE=2,
+)
+class IngestionPipelineTests(TestCase):
+    """Pipeline errors and cancellation stop every stage; windowed chunking matches a single split"""
+
+    PAGES = 2000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.course = Course.objects.create(code='ECO101', name='Economics', embedding_models=['test-model'])
+
+    def setUp(self):
+        self.document = Document.objects.create(
+            course=self.course, title='Markets', file='documents/markets.pdf', file_type='pdf'
+        )
+        self.pages_read = 0
+        self.pages_closed = threading.Event()
+        self.service = _ConstantEmbeddingService('test-model', 1.0)
+        for patcher in (
+            mock.patch.object(services.DocumentParsingService, 'iter_document_pages', side_effect=self.pages),
+            mock.patch.object(EmbeddingService, 'get_shared', return_value=self.service),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def pages(self, file_path, file_type):
+        try:
+            for number in range(1, self.PAGES + 1):
+                self.pages_read = number
+                yield number, ' '.join(f"p{number}w{idx}" for idx in range(100))
+        finally:
+            self.pages_closed.set()
+
+    def assert_stopped(self):
+        """The parse/chunk and embed threads exited and closed the page generator early"""
+        names = {thread.name for thread in threading.enumerate()}
+        self.assertFalse(names & {'ingest-chunk', 'ingest-embed'})
+        self.assertTrue(self.pages_closed.is_set())
+        self.assertLess(self.pages_read, self.PAGES)
+
+    def test_embed_error_stops_pipeline(self):
+        calls = []
+
+        def embed_array(texts, batch_size=None):
+            calls.append(len(texts))
+            if len(calls) == 3:
+                raise RuntimeError("inference failed")
+            return np.ones((len(texts), 8), dtype=np.float32)
+
+        self.service.embed_array = embed_array
+        with self.assertRaisesMessage(RuntimeError, "inference failed"):
+            IngestionService.process_document(self.document)
+        self.assert_stopped()
+        self.assertEqual(self.document.chunks.count(), 2 * calls[0])
+
+    def test_store_error_stops_pipeline(self):
+        with mock.patch.object(ChunkStorageService, 'append_chunks', side_effect=OperationalError("disk full")), \
+                self.assertRaisesMessage(OperationalError, "disk full"):
+            IngestionService.process_document(self.document)
+        self.assert_stopped()
+
+    def test_cancel_mid_stream_discards_chunks(self):
+        job = IngestionQueue.enqueue(self.document)
+        append_chunks = ChunkStorageService.append_chunks
+        stored = []
+
+        def append_then_cancel(document, texts, *args, **kwargs):
+            append_chunks(document, texts, *args, **kwargs)
+            stored.append(len(texts))
+            if len(stored) == 2:
+                IngestionQueue.cancel(job)
+
+        with mock.patch.object(ChunkStorageService, 'append_chunks', side_effect=append_then_cancel):
+            job = IngestionQueue.run_job(IngestionQueue.claim_next('worker'))
+        self.assertEqual(job.status, IngestionJob.STATUS_CANCELLED, job.error)
+        self.assertEqual(len(stored), 2)
+        self.assertFalse(self.document.chunks.exists())
+        self.assert_stopped()
+
+    def test_window_edges(self):
+        overlap = 20
+        splitter = services.CharacterSplitter(chunk_size=60, chunk_overlap=overlap)
+        rng = np.random.default_rng(0)
+        pages = [
+            (number, ' '.join(f"p{number}w{idx}" for idx in range(rng.integers(5, 60))))
+            for number in range(1, 30)
+        ]
+        text = services.DocumentParsingService.join_pages(pages)
+        # Windows shorter than, near and well above a chunk each cut chunks at their edge
+        for window in (50, 61, 97, 333):
+            with self.subTest(window=window):
+                start, end = -1, 0
+                for chunk, page in services.ChunkingService.iter_chunks(pages, splitter, window=window):
+                    # Words are unique, so a repeated chunk would not be found again further on
+                    found = text.find(chunk, start + 1)
+                    self.assertGreater(found, start, chunk)
+                    self.assertFalse(text[end:found].strip(), "text dropped before " + chunk)
+                    self.assertLessEqual(end - found, overlap)
+                    self.assertEqual(page, int(chunk.split('w', 1)[0][1:]))
+                    start, end = found, found + len(chunk)
+                self.assertEqual(end, len(text))
+
+
+class VectorFieldTests(TestCase):
+    """Vectors are stored as little-endian float BLOBs and load as NumPy arrays"""
+
+    def test_float32_round_trip(self):
+        course = Course.objects.create(code='MUS101', name='Music')
+        document = Document.objects.create(course=course, title='Scales', file='documents/scales.txt')
+        values = [0.1, -2.5, 3e-8, 1e6, 0.0]
+        chunk = Chunk.objects.create(document=document, text="scales", chunk_index=0, vector=values)
+
+        loaded = Chunk.objects.get(pk=chunk.pk).vector
+        self.assertIsInstance(loaded, np.ndarray)
+        self.assertEqual((loaded.dtype, loaded.shape), (np.dtype('<f4'), (len(values),)))
+        np.testing.assert_array_equal(loaded, np.asarray(values, dtype=np.float32))
+        # Four bytes per value, no JSON
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT vector FROM knowledge_chunk WHERE id = %s', [chunk.pk])
+            self.assertEqual(len(cursor.fetchone()[0]), 4 * len(values))
+
+    def test_none_and_float16(self):
+        field = VectorField(null=True, dtype='float16')
+        self.assertIsNone(field.get_prep_value(None))
+        self.assertIsNone(field.from_db_value(None, None, connection))
+        self.assertIsNone(field.to_python(None))
+        blob = field.get_prep_value([1.5, -0.25])
+        self.assertEqual(blob, np.asarray([1.5, -0.25], dtype='<f2').tobytes())
+        loaded = field.from_db_value(blob, None, connection)
+        self.assertEqual((loaded.dtype, list(loaded)), (np.dtype('<f2'), [1.5, -0.25]))
+        with self.assertRaises(ValueError):
+            VectorField(dtype='int8')
+
+
+class VectorFieldMigrationTests(TransactionTestCase):
+    """Migration 0003 converts JSON vectors to float32 BLOBs and back"""
+
+    before = [('knowledge', '0002_ingestionjob')]
+    after = [('knowledge', '0003_chunk_binary_vector')]
+    vectors = [[0.5, -1.25, 2.0], [0.375, 0.0, -7.75]]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+        super().tearDown()
+
+    def test_json_to_blob_and_back(self):
+        apps = self.migrate(self.before)
+        course = apps.get_model('knowledge', 'Course').objects.create(code='LAT101', name='Latin')
+        document = apps.get_model('knowledge', 'Document').objects.create(
+            course=course, title='Verbs', file='documents/verbs.txt'
+        )
+        Chunk = apps.get_model('knowledge', 'Chunk')
+        for idx, vector in enumerate(self.vectors):
+            Chunk.objects.create(document=document, text=f"verb {idx}", chunk_index=idx, vector=vector)
+
+        apps = self.migrate(self.after)
+        Chunk = apps.get_model('knowledge', 'Chunk')
+        loaded = list(Chunk.objects.order_by('chunk_index').values_list('vector', flat=True))
+        for vector, expected in zip(loaded, self.vectors):
+            self.assertEqual(vector.dtype, np.dtype('<f4'))
+            np.testing.assert_array_equal(vector, np.asarray(expected, dtype=np.float32))
+
+        apps = self.migrate(self.before)
+        Chunk = apps.get_model('knowledge', 'Chunk')
+        loaded = list(Chunk.objects.order_by('chunk_index').values_list('vector', flat=True))
+        # The values above are exact in float32, so JSON gets them back unchanged
+        self.assertEqual(loaded, self.vectors)
+
+
+class OnnxModelSelectionTests(TestCase):
+    """Model files picked for the fp32 and int8 execution profiles"""
+
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        (self.directory / 'onnx').mkdir()
+        for name in ('model_qint8_arm64.onnx', 'model_fp16.onnx', 'model_qint8_avx512.onnx'):
+            (self.directory / 'onnx' / name).touch()
+
+    def test_fp32_skips_quantized_variants(self):
+        found = EmbeddingService._find_onnx_model(str(self.directory))
+        self.assertEqual(Path(found).name, 'model_fp16.onnx')
+
+    def test_int8_picks_supported_prebuilt_variant(self):
+        fp32 = str(self.directory / 'onnx' / 'model_fp16.onnx')
+        with mock.patch.object(services, '_cpu_flags', return_value={'avx2', 'avx512f'}):
+            self.assertEqual(Path(EmbeddingService._find_int8_model(fp32)).name, 'model_qint8_avx512.onnx')
+        (self.directory / 'onnx' / 'model_qint8_x86.onnx').touch()
+        # Without AVX-512 the prebuilt file is unusable; the produced variant is used instead
+        with mock.patch.object(services, '_cpu_flags', return_value={'avx2'}):
+            self.assertEqual(Path(EmbeddingService._find_int8_model(fp32)).name, 'model_qint8_x86.onnx')
+
+
+@skipUnless(importlib.util.find_spec('onnx'), "building the test model needs the onnx package")
+class EmbeddingServiceTests(TestCase):
+    """Batched inference on a small generated model"""
+
+    @classmethod
+    def setUpClass(cls):
+        from .benchmarks import build_tiny_embedding_model
+
+        super().setUpClass()
+        cls.directory = tempfile.mkdtemp()
+        model = build_tiny_embedding_model(cls.directory, dim=16, layers=1, vocab_size=500)
+        cls.service = EmbeddingService(model, profile='default', processes=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(cls.directory, ignore_errors=True)
+
+    def test_batches_match_single_texts(self):
+        # Mixed lengths: each batch pads to its longest text, which must not change the pooled vectors
+        texts = ["ocean", "the quick tide turns over the long grey shore " * 6, "salt water", "waves " * 20, "a"]
+        singles = np.array([self.service.embed(text) for text in texts], dtype=np.float32)
+        for batch_size in (1, 2, len(texts)):
+            batched = self.service.embed_array(texts, batch_size=batch_size)
+            np.testing.assert_allclose(batched, singles, rtol=1e-4, atol=1e-5)
+
+    def test_failed_embedding_is_not_cached(self):
+        texts = ["rivers flow to the sea", "mountains rise"]
+        with mock.patch.object(self.service, '_run_batch', side_effect=RuntimeError("onnx failed")):
+            with self.assertRaises(RuntimeError):
+                services.EmbeddingCacheService.embed_array(self.service, texts)
+            with self.assertRaises(RuntimeError):
+                self.service.embed(texts[0])
+        self.assertFalse(EmbeddingCacheEntry.objects.exists())
+        # The next attempt embeds for real
+        vectors, hits = services.EmbeddingCacheService.embed_array(self.service, texts)
+        self.assertEqual((vectors.shape, hits), ((2, 16), 0))
+
+
+@skipUnless(importlib.util.find_spec('onnx'), "building the test model needs the onnx package")
+class EmbeddingProcessPoolTests(TestCase):
+    """Vectors from the process pool match in-process ones, in input order"""
+
+    def test_pool_matches_in_process(self):
+        from .benchmarks import _synthetic_corpus, build_tiny_embedding_model
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        model = build_tiny_embedding_model(directory, dim=16, layers=1, vocab_size=500)
+        texts = _synthetic_corpus(40).split("\n\n")
+        expected = EmbeddingService(model, profile='default', processes=0).embed_array(texts, batch_size=4)
+        service = EmbeddingService(model, profile='default', processes=2)
+        self.addCleanup(service.close)
+        np.testing.assert_allclose(service.embed_array(texts, batch_size=4), expected, rtol=1e-5, atol=1e-6)
+
+
+class _ConstantEmbeddingService:
+    """Embeds every text as the same vector"""
+
+    def __init__(self, model_name, value, dim=8):
+        self.model_name = model_name
+        self.vector = np.full(dim, value, dtype=np.float32)
+
+    def embed_array(self, texts, batch_size=None):
+        return np.tile(self.vector, (len(texts), 1))
+
+
+@override_settings(KNOWLEDGE_INGESTION_LOCAL_WORKERS=0, KNOWLEDGE_REEMBED_BATCH_SIZE=4)
+class ReembeddingTests(TestCase):
+    """Re-embedding is checkpointed, yields to uploads and swaps all vectors in at once"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.course = Course.objects.create(code='CHEM101', name='Chemistry')
+        cls.other = Course.objects.create(code='PHYS101', name='Physics')
+        for course in (cls.course, cls.other):
+            document = Document.objects.create(course=course, title='Notes', file=f'documents/{course.code}.txt')
+            Chunk.objects.bulk_create([
+                Chunk(document=document, text=f"{course.code} chunk {idx}", chunk_index=idx,
+                      vector=np.zeros(8, dtype=np.float32), embedding_model='old-model')
+                for idx in range(10)
+            ])
+
+    def test_yields_then_resumes_and_swaps(self):
+        job = ReembeddingJob.objects.create(course=self.course, embedding_model='new-model')
+        service = _ConstantEmbeddingService('new-model', 0.5)
+
+        self.assertFalse(ReembeddingService.run(job, service, should_yield=lambda: True))
+        job.refresh_from_db()
+        self.assertEqual((job.chunks_done, job.chunks_total), (4, 10))
+        self.assertEqual(ChunkShadowVector.objects.filter(job=job).count(), 4)
+        # Nothing live changes before the swap
+        self.assertFalse(Chunk.objects.filter(embedding_model='new-model').exists())
+
+        version = Course.objects.get(pk=self.course.pk).content_version
+        self.assertTrue(ReembeddingService.run(job, service))
+        job.refresh_from_db()
+        self.assertEqual(job.chunks_done, 10)
+        self.assertIsNotNone(job.swapped_at)
+        self.assertFalse(ChunkShadowVector.objects.exists())
+        for chunk in Chunk.objects.filter(document__course=self.course):
+            self.assertEqual(chunk.embedding_model, 'new-model')
+            np.testing.assert_array_equal(chunk.vector, service.vector)
+        self.assertFalse(Chunk.objects.filter(document__course=self.other, embedding_model='new-model').exists())
+        course = Course.objects.get(pk=self.course.pk)
+        self.assertGreater(course.content_version, version)
+        self.assertEqual(course.sync_min_version, course.content_version)
+
+    def test_queue_waits_for_uploads(self):
+        job = ReembeddingQueue.enqueue(None, 'new-model')
+        self.assertEqual(ReembeddingQueue.enqueue(None, 'new-model'), job)
+        upload = IngestionJob.objects.create(document=Document.objects.first())
+        self.assertIsNone(ReembeddingQueue.claim_next('worker'))
+        upload.status = IngestionJob.STATUS_SUCCEEDED
+        upload.save()
+
+        job = ReembeddingQueue.run_job(ReembeddingQueue.claim_next('worker'), _ConstantEmbeddingService('new-model', 1.0))
+        self.assertEqual(job.status, ReembeddingJob.STATUS_SUCCEEDED)
+        self.assertEqual(Chunk.objects.filter(embedding_model='new-model').count(), 20)
+
+    def test_api_create_reuses_unfinished_job(self):
+        client = APIClient()
+        first = client.post('/api/knowledge/reembeddings/', {'course': self.course.pk, 'embedding_model': 'new-model'})
+        self.assertEqual(first.status_code, 202, first.data)
+        self.assertTrue(first['Location'].endswith(f"/reembeddings/{first.data['id']}/"))
+        second = client.post('/api/knowledge/reembeddings/', {'course': self.course.pk, 'embedding_model': 'new-model'})
+        self.assertEqual(second.data['id'], first.data['id'])
+        cancelled = client.post(f"/api/knowledge/reembeddings/{first.data['id']}/cancel/")
+        self.assertEqual(cancelled.data['status'], ReembeddingJob.STATUS_CANCELLED)
+
+
+class MultiModelTests(TestCase):
+    """Chunks are embedded with each of the course's models; snapshots carry the requested model's vectors"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.snapshot_dir = tempfile.mkdtemp()
+        cls.media_root = tempfile.mkdtemp()
+        cls._overrides = override_settings(
+            KNOWLEDGE_SNAPSHOT_DIR=cls.snapshot_dir,
+            MEDIA_ROOT=cls.media_root,
+            KNOWLEDGE_INGESTION_LOCAL_WORKERS=0,
+        )
+        cls._overrides.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls._overrides.disable()
+        shutil.rmtree(cls.snapshot_dir, ignore_errors=True)
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.course = Course.objects.create(
+            code='GEO101', name='Geography', embedding_models=['big-model', 'mobile-model']
+        )
+        document = Document.objects.create(course=cls.course, title='Maps', file='documents/maps.txt')
+        ChunkStorageService.store_chunks(
+            document, [f"map {idx}" for idx in range(5)], np.ones((5, 8), dtype=np.float32), 'big-model',
+            extra_vectors={'mobile-model': np.full((5, 4), 0.5, dtype=np.float32)}
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def snapshot_meta(self, response):
+        path = Path(self.snapshot_dir) / 'downloaded.db'
+        path.write_bytes(b''.join(response.streaming_content))
+        with sqlite3.connect(path) as conn:
+            meta = dict(conn.execute('SELECT key, value FROM snapshot_meta'))
+            meta['chunks'] = conn.execute('SELECT COUNT(*) FROM chunks').fetchone()[0]
+        path.unlink()
+        return meta
+
+    def test_download_per_model(self):
+        url = f'/api/knowledge/courses/{self.course.pk}/download_knowledge_base/'
+        primary = self.client.get(url)
+        mobile = self.client.get(url, {'model': 'mobile-model'})
+        self.assertNotEqual(primary['ETag'], mobile['ETag'])
+        meta = self.snapshot_meta(primary)
+        self.assertEqual((meta['embedding_model'], meta['dimension'], meta['chunks']), ('big-model', '8', 5))
+        meta = self.snapshot_meta(mobile)
+        self.assertEqual((meta['embedding_model'], meta['dimension'], meta['chunks']), ('mobile-model', '4', 5))
+        self.assertEqual(self.client.get(url, {'model': 'other-model'}).status_code, 400)
+
+    def test_added_model_is_backfilled(self):
+        course = Course.objects.create(code='HIST101', name='History', embedding_models=['big-model'])
+        document = Document.objects.create(course=course, title='Empires', file='documents/empires.txt')
+        ChunkStorageService.store_chunks(
+            document, [f"empire {idx}" for idx in range(6)], np.ones((6, 8), dtype=np.float32), 'big-model'
+        )
+        url = f'/api/knowledge/courses/{course.pk}/'
+        response = self.client.patch(url, {'embedding_models': ['big-model', 'mobile-model']}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+
+        job = ReembeddingQueue.claim(ReembeddingJob.objects.get(course=course).pk, 'worker')
+        self.assertEqual(job.embedding_model, 'mobile-model')
+        ReembeddingQueue.run_job(job, _ConstantEmbeddingService('mobile-model', 0.25, dim=4))
+        embeddings = ChunkEmbedding.objects.filter(chunk__document=document, embedding_model='mobile-model')
+        self.assertEqual(embeddings.count(), 6)
+        np.testing.assert_array_equal(embeddings.first().vector, np.full(4, 0.25, dtype=np.float32))
+        # Primary vectors and search are untouched
+        self.assertEqual(document.chunks.filter(embedding_model='big-model').count(), 6)
+
+        response = self.client.patch(url, {'embedding_models': ['mobile-model']}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.client.patch(url, {'embedding_models': ['big-model']}, format='json')
+        self.assertFalse(ChunkEmbedding.objects.filter(chunk__document=document).exists())
+
+    @skipUnless(importlib.util.find_spec('onnx'), "building the test models needs the onnx package")
+    # The embed stage's thread cannot see the test transaction, so no embedding cache
+    @override_settings(KNOWLEDGE_EMBEDDING_CACHE_SIZE=0, KNOWLEDGE_ONNX_PROFILE='default')
+    def test_ingestion_embeds_with_each_model(self):
+        from .benchmarks import _synthetic_corpus, build_tiny_embedding_model
+
+        directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        primary = build_tiny_embedding_model(directory / 'primary', dim=16, layers=1, vocab_size=500)
+        mobile = build_tiny_embedding_model(directory / 'mobile', dim=8, layers=1, vocab_size=500, seed=1)
+        self.addCleanup(EmbeddingService.clear_shared)
+        course = Course.objects.create(code='LIT101', name='Literature', embedding_models=[primary, mobile])
+        (Path(self.media_root) / 'documents').mkdir(exist_ok=True)
+        (Path(self.media_root) / 'documents' / 'poems.txt').write_text(_synthetic_corpus(30), encoding='utf-8')
+        document = Document.objects.create(course=course, title='Poems', file='documents/poems.txt')
+
+        stored = IngestionService.process_document(document)
+        self.assertGreater(stored, 0)
+        self.assertEqual(document.chunks.filter(embedding_model=primary).count(), stored)
+        vectors = list(ChunkEmbedding.objects.filter(chunk__document=document, embedding_model=mobile).values_list(
+            'vector', flat=True
+        ))
+        self.assertEqual(len(vectors), stored)
+        self.assertEqual(len(vectors[0]), 8)
@@ -0,0 +1,40 @@
+"""
+Upload handlers that hash files while they stream in.
+
+Each uploaded file gets a `sha256` attribute (hex digest) computed from the
+chunks as Django receives them, so duplicate detection needs no second pass
+over the file.
+"""
+import hashlib
+
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+
+class HashingUploadHandlerMixin:
+    def new_file(self, *args, **kwargs):
+        # Set up first: MemoryFileUploadHandler.new_file raises StopFutureHandlers
+        self.sha256 = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        uploaded = super().file_complete(file_size)
+        if uploaded is not None:
+            uploaded.sha256 = self.sha256.hexdigest()
+        return uploaded
+
+
+class HashingMemoryFileUploadHandler(HashingUploadHandlerMixin, MemoryFileUploadHandler):
+    """Small uploads kept in memory (up to FILE_UPLOAD_MAX_MEMORY_SIZE)"""
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadHandlerMixin, TemporaryFileUploadHandler):
+    """Larger uploads streamed to a temporary file"""
+
+
+def hashing_upload_handlers(request):
+    """Replacement for Django's default FILE_UPLOAD_HANDLERS on request"""
+    return [HashingMemoryFileUploadHandler(request), HashingTemporaryFileUploadHandler(request)]
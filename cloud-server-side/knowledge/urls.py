@@ -1,10 +1,12 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import CourseViewSet, DocumentViewSet
+from .views import CourseViewSet, DocumentViewSet, IngestionJobViewSet, ReembeddingJobViewSet
 
 router = DefaultRouter()
 router.register(r'courses', CourseViewSet)
 router.register(r'documents', DocumentViewSet)
+router.register(r'jobs', IngestionJobViewSet)
+router.register(r'reembeddings', ReembeddingJobViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
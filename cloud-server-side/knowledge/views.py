@@ -1,21 +1,32 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 from rest_framework.parsers import MultiPartParser, FormParser
-from django.http import FileResponse
-import os
-import sqlite3
-import json
-import tempfile
+from rest_framework.settings import api_settings
+from django.db.models import Count, Prefetch
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+import re
 
-from .models import Course, Document, Chunk
+from .models import Course, Document, Chunk, IngestionJob, ReembeddingJob
 from .serializers import (
     CourseSerializer, DocumentSerializer, DocumentDetailSerializer,
-    DocumentUploadSerializer, ChunkSerializer, ChunkSummarySerializer
+    DocumentUploadSerializer, ChunkSerializer, ChunkSummarySerializer,
+    IngestionJobSerializer, ReembeddingJobSerializer, ReembeddingRequestSerializer
 )
+from . import metrics
+from .jobs import IngestionQueue, ReembeddingQueue
+from .pagination import ChunkCursorPagination
+from .renderers import NDJSONRenderer
 from .services import (
-    EmbeddingService, ChunkingService, DocumentParsingService
+    VectorSnapshotService, VectorSearchService, LexicalSearchService,
+    HybridSearchService, EmbeddingCacheService, DocumentDedupService,
+    ChunkExportService, SyncUnavailable
 )
+from .uploads import hashing_upload_handlers
+
+# Actions that can also stream newline-delimited JSON (?format=ndjson)
+NDJSON_RENDERER_CLASSES = [*api_settings.DEFAULT_RENDERER_CLASSES, NDJSONRenderer]
 
 
 class CourseViewSet(viewsets.ModelViewSet):
@@ -30,119 +41,312 @@ class CourseViewSet(viewsets.ModelViewSet):
     update: Update course
     destroy: Delete course
     """
-    queryset = Course.objects.all()
+    queryset = Course.objects.annotate(document_count=Count('documents')).order_by('code')
     serializer_class = CourseSerializer
     
+    def perform_update(self, serializer):
+        # Added additional embedding models are backfilled for the existing chunks
+        previous_models = serializer.instance.embedding_model_names()
+        course = serializer.save()
+        ReembeddingQueue.sync_course_models(course, previous_models)
+    
     @action(detail=True, methods=['get'])
     def documents(self, request, pk=None):
         """Get all documents for a course"""
         course = self.get_object()
-        documents = course.documents.all()
+        # Explicit order: Meta.ordering is not applied to GROUP BY (annotated) queries
+        documents = course.documents.select_related('course').annotate(
+            chunk_count=Count('chunks')
+        ).order_by('-created_at')
         serializer = DocumentSerializer(documents, many=True)
         return Response(serializer.data)
     
+    @action(detail=True, methods=['get'], renderer_classes=[NDJSONRenderer])
+    def chunks(self, request, pk=None):
+        """
+        Stream all chunks of a course as newline-delimited JSON
+        
+        Chunks are ordered by document id, then chunk_index, and read in
+        keyset batches, so exports of any size run at steady memory.
+        
+        Query params:
+            vectors: 'true' to include each chunk's vector
+            after: '{document_id}:{chunk_index}' of the last chunk received,
+                to resume an interrupted export
+        """
+        course = self.get_object()
+        documents = course.documents.order_by('pk')
+        after_index = None
+        after = request.query_params.get('after')
+        if after:
+            try:
+                after_document, after_index = (int(value) for value in after.split(':'))
+            except ValueError:
+                return Response({'error': 'after must be {document_id}:{chunk_index}'}, status=status.HTTP_400_BAD_REQUEST)
+            documents = documents.filter(pk__gte=after_document)
+            if not documents.filter(pk=after_document).exists():
+                after_index = None
+        rows = ChunkExportService.iter_ndjson(
+            list(documents.values_list('pk', flat=True)),
+            include_vectors=_flag(request.query_params.get('vectors')),
+            after=after_index
+        )
+        return _ndjson_response(rows)
+    
     @action(detail=True, methods=['get'])
     def download_knowledge_base(self, request, pk=None):
-        """Download knowledge base as SQLite vector snapshot"""
-        course = self.get_object()
+        """
+        Download knowledge base as SQLite vector snapshot
+        
+        Snapshots are prebuilt per course content version and served with an
+        ETag: send If-None-Match to get 304 when nothing changed, and Range
+        to resume an interrupted download.
         
+        Query params:
+            precision: Vector encoding, recorded in the snapshot_meta table
+                - json (default): JSON text of floats
+                - float32 / float16: raw little-endian BLOBs (~4x / ~8x smaller)
+                - int8: int8 BLOB plus a per-vector vector_scale column (~16x smaller)
+                - binary: 1-bit sign BLOB (~32x smaller), ranked by Hamming distance
+                - binary_int8: binary plus int8 rescore_vector/rescore_scale columns
+                  for re-ranking Hamming-distance candidates (larger than int8)
+            model: Embedding model the device runs, one of the course's
+                embedding_models (default: the course's primary model). The
+                snapshot carries only that model's vectors.
+        """
+        course = self.get_object()
+        precision = request.query_params.get('precision', 'json')
+        if precision not in VectorSnapshotService.PRECISIONS:
+            return Response({'error': f'Unsupported precision: {precision}'}, status=status.HTTP_400_BAD_REQUEST)
         try:
-            # Get all chunks for this course
-            chunks = Chunk.objects.filter(document__course=course).select_related('document')
-            
-            if not chunks.exists():
-                return Response({'error': 'No chunks found for this course'}, status=status.HTTP_404_NOT_FOUND)
-            
-            # Create SQLite database
-            with tempfile.NamedTemporaryFile(suffix='.db', delete=False) as tmp_file:
-                db_path = tmp_file.name
-            
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-            
-            # Create schema
-            cursor.execute('''
-                CREATE TABLE courses (
-                    id INTEGER PRIMARY KEY,
-                    code TEXT NOT NULL UNIQUE,
-                    name TEXT NOT NULL
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE documents (
-                    id INTEGER PRIMARY KEY,
-                    course_id INTEGER NOT NULL,
-                    title TEXT NOT NULL,
-                    file_type TEXT,
-                    FOREIGN KEY (course_id) REFERENCES courses(id)
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE chunks (
-                    id INTEGER PRIMARY KEY,
-                    document_id INTEGER NOT NULL,
-                    text TEXT NOT NULL,
-                    chunk_index INTEGER NOT NULL,
-                    vector TEXT NOT NULL,
-                    embedding_model TEXT,
-                    FOREIGN KEY (document_id) REFERENCES documents(id)
-                )
-            ''')
-            
-            # Insert course
-            cursor.execute('INSERT INTO courses (id, code, name) VALUES (?, ?, ?)',
-                          (course.id, course.code, course.name))
-            
-            # Insert documents and chunks
-            for chunk in chunks:
-                doc = chunk.document
-                
-                # Insert document
-                cursor.execute('INSERT OR IGNORE INTO documents (id, course_id, title, file_type) VALUES (?, ?, ?, ?)',
-                              (doc.id, course.id, doc.title, doc.file_type))
-                
-                # Insert chunk
-                vector_json = json.dumps(chunk.vector)
-                cursor.execute('INSERT INTO chunks (document_id, text, chunk_index, vector, embedding_model) VALUES (?, ?, ?, ?, ?)',
-                              (doc.id, chunk.text, chunk.chunk_index, vector_json, chunk.embedding_model))
-            
-            conn.commit()
-            conn.close()
-            
-            # Return file
-            response = FileResponse(
-                open(db_path, 'rb'),
-                as_attachment=True,
-                filename=f"{course.code}_knowledge_base.db"
-            )
+            model_name = VectorSnapshotService.resolve_model(course, request.query_params.get('model'))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Answer revalidation from the version alone, without touching the snapshot
+        etag = VectorSnapshotService.etag(course.pk, course.content_version, precision, model_name)
+        if _etag_matches(request.headers.get('If-None-Match'), etag):
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
             return response
-            
+        
+        try:
+            path, version = VectorSnapshotService.get_or_build(course, precision, model_name=model_name)
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if path is None:
+            return Response({'error': 'No chunks found for this course'}, status=status.HTTP_404_NOT_FOUND)
+        
+        response = _snapshot_file_response(
+            request, path,
+            filename=f"{course.code}_knowledge_base.db",
+            etag=VectorSnapshotService.etag(course.pk, version, precision, model_name)
+        )
+        response['X-Content-Version'] = str(version)
+        return response
+    
+    @action(detail=True, methods=['get'])
+    def search(self, request, pk=None):
+        """
+        Semantic search over a course's chunks
+        
+        Query params:
+            q: Query text (required)
+            k: Number of results, 1-100 (default 10)
+            mode: 'vector' (default, cosine similarity), 'lexical' (BM25 over
+                the full-text index) or 'hybrid' (reciprocal rank fusion of both)
+        """
+        course = self.get_object()
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'error': 'q is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            k = int(request.query_params.get('k', 10))
+        except ValueError:
+            return Response({'error': 'k must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= k <= 100:
+            return Response({'error': 'k must be between 1 and 100'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        mode = request.query_params.get('mode', 'vector')
+        search_services = {
+            'vector': VectorSearchService,
+            'lexical': LexicalSearchService,
+            'hybrid': HybridSearchService,
+        }
+        if mode not in search_services:
+            return Response({'error': f'Unsupported mode: {mode}'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        hits = search_services[mode].search(course, query, k=k)
+        chunks = Chunk.objects.select_related('document__course').defer('vector').in_bulk([chunk_id for chunk_id, _ in hits])
+        results = []
+        for chunk_id, score in hits:
+            if chunk_id in chunks:
+                data = ChunkSummarySerializer(chunks[chunk_id]).data
+                data['score'] = round(score, 6)
+                results.append(data)
+        return Response({'query': query, 'k': k, 'mode': mode, 'results': results})
+    
+    @action(detail=True, methods=['get'])
+    def sync(self, request, pk=None):
+        """
+        Download the changes since a device's snapshot version as a SQLite patch
+        
+        The patch has the snapshot schema plus a removed_documents table. Apply it
+        by deleting chunks and documents whose document id is in removed_documents
+        or in the patch's documents table, then inserting the patch's documents
+        and chunks. snapshot_meta.content_version is the device's new version.
+        
+        Query params:
+            since: content version of the device's current snapshot (required)
+            precision: Vector encoding, as for download_knowledge_base
+            model: Embedding model, as for download_knowledge_base
+        
+        Returns 204 when the device is up to date and 409 when it must
+        download the full knowledge base instead.
+        """
+        course = self.get_object()
+        precision = request.query_params.get('precision', 'json')
+        if precision not in VectorSnapshotService.PRECISIONS:
+            return Response({'error': f'Unsupported precision: {precision}'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            since = int(request.query_params['since'])
+        except (KeyError, ValueError):
+            return Response({'error': 'since must be an integer content version'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            model_name = VectorSnapshotService.resolve_model(course, request.query_params.get('model'))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            path, version = VectorSnapshotService.get_or_build(course, precision, since=since, model_name=model_name)
+        except SyncUnavailable as e:
+            return Response({'error': str(e), 'content_version': course.content_version}, status=status.HTTP_409_CONFLICT)
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if path is None:
+            response = Response(status=status.HTTP_204_NO_CONTENT)
+        else:
+            response = _snapshot_file_response(
+                request, path,
+                filename=f"{course.code}_v{since}-v{version}.patch.db",
+                etag=VectorSnapshotService.etag(course.pk, version, precision, model_name, since=since)
+            )
+        response['X-Content-Version'] = str(version)
+        return response
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint (text exposition format): per-stage ingestion
+    timings, document/chunk/byte counters, ONNX batch sizes and latency,
+    snapshot builds and embedding cache hits, for this server process, plus
+    the database-wide ingestion job gauge.
+    """
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+def _flag(value):
+    return (value or '').lower() in ('1', 'true', 'yes')
+
+
+def _ndjson_response(rows):
+    response = StreamingHttpResponse(rows, content_type='application/x-ndjson; charset=utf-8')
+    # Let proxies pass batches through as they are produced
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _etag_matches(header, etag):
+    if not header:
+        return False
+    candidates = [value.strip() for value in header.split(',')]
+    return '*' in candidates or etag in candidates or f'W/{etag}' in candidates
+
+
+def _iter_file_range(file, length, block_size=64 * 1024):
+    with file:
+        while length > 0:
+            data = file.read(min(block_size, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def _snapshot_file_response(request, path, filename, etag):
+    """Serve a snapshot file with ETag and single-range (206) support"""
+    size = path.stat().st_size
+    range_header = request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
+    match = re.fullmatch(r'bytes=(\d*)-(\d*)', range_header.strip()) if range_header else None
+    
+    if match and any(match.groups()) and (not if_range or if_range == etag):
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        else:
+            start = max(size - int(last), 0)
+            end = size - 1
+        if start > end:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        
+        file = open(path, 'rb')
+        file.seek(start)
+        response = StreamingHttpResponse(
+            _iter_file_range(file, end - start + 1),
+            status=206,
+            content_type='application/octet-stream'
+        )
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    else:
+        response = FileResponse(open(path, 'rb'), as_attachment=True, filename=filename)
+    
+    response['ETag'] = etag
+    response['Accept-Ranges'] = 'bytes'
+    # Clients may cache the file but must revalidate with the ETag
+    response['Cache-Control'] = 'no-cache'
+    return response
 
 
 class DocumentViewSet(viewsets.ModelViewSet):
     """
     Document Upload & Management API
     
-    Upload documents to a course. Documents are automatically:
+    Upload documents to a course. Documents are queued as an ingestion job
+    and processed in the background:
     - Parsed (TXT, PDF, DOCX)
     - Split into chunks (with overlap)
     - Vectorized using ONNX embeddings
     - Saved to database
     
+    Re-uploads of a file already ingested (same SHA-256, same embedding
+    model) reuse the stored file and its chunks instead of being processed
+    again, or are rejected, per the on_duplicate field.
+    
     list: Get all documents (filter by course_id)
-    create: Upload new document
+    create: Upload new document (returns 202 with the ingestion job, 409 for a rejected duplicate)
     retrieve: Get document with chunks
     update: Update document metadata
     destroy: Delete document
     """
-    queryset = Document.objects.all()
+    queryset = Document.objects.select_related('course').annotate(
+        chunk_count=Count('chunks')
+    ).order_by('-created_at')
     serializer_class = DocumentSerializer
     parser_classes = (MultiPartParser, FormParser)
     
+    def initialize_request(self, request, *args, **kwargs):
+        # Hash uploads while they stream in (must be set before the body is parsed)
+        if request.method == 'POST':
+            request.upload_handlers = hashing_upload_handlers(request)
+        return super().initialize_request(request, *args, **kwargs)
+    
     def get_serializer_class(self):
         if self.action == 'create':
             return DocumentUploadSerializer
@@ -151,52 +355,192 @@ class DocumentViewSet(viewsets.ModelViewSet):
         return DocumentSerializer
     
     def get_queryset(self):
+        # Counts and related rows are fetched up front so serializing N documents
+        # (or one document's N chunks) takes a constant number of queries
+        queryset = super().get_queryset()
+        if self.action == 'retrieve':
+            # Prefetched chunks get the document (and its course) attached, vectors stay in the DB
+            queryset = queryset.prefetch_related(Prefetch('chunks', queryset=Chunk.objects.defer('vector')))
         course_id = self.request.query_params.get('course_id')
         if course_id:
-            return Document.objects.filter(course_id=course_id)
-        return Document.objects.all()
+            queryset = queryset.filter(course_id=course_id)
+        return queryset
     
     def create(self, request, *args, **kwargs):
-        """Upload and process document"""
+        """Upload document and queue it for background processing"""
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        document = serializer.save()
         
-        try:
-            self._process_document(document)
-            response_serializer = DocumentDetailSerializer(document)
-            return Response(response_serializer.data, status=status.HTTP_201_CREATED)
-        except Exception as e:
-            document.delete()
-            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
-    
-    def _process_document(self, document: Document):
-        """Parse, chunk, and embed document"""
-        # Parse document
-        file_path = document.file.path
-        text = DocumentParsingService.parse_document(file_path, document.file_type)
-        
-        # Chunk text
-        chunks_text = ChunkingService.chunk_text(text)
-        
-        # Generate embeddings
-        embedding_service = EmbeddingService()
-        embeddings = embedding_service.embed_batch(chunks_text)
-        
-        # Save chunks and vectors to database
-        for idx, (chunk_text, embedding) in enumerate(zip(chunks_text, embeddings)):
-            Chunk.objects.create(
-                document=document,
-                text=chunk_text,
-                chunk_index=idx,
-                vector=embedding,
-                embedding_model=embedding_service.model_name
+        policy = serializer.validated_data.pop('on_duplicate', None) or DocumentDedupService.default_policy()
+        sha256 = DocumentDedupService.file_hash(serializer.validated_data['file'])
+        duplicate = None
+        if policy != 'ingest':
+            duplicate = DocumentDedupService.find_duplicate(sha256, serializer.validated_data['course'])
+        
+        if duplicate is not None and policy == 'reject':
+            return Response(
+                {'error': 'This file was already uploaded', 'duplicate_of': duplicate.pk, 'course': duplicate.course_id},
+                status=status.HTTP_409_CONFLICT
             )
+        if duplicate is not None:
+            # Point at the stored copy; the uploaded bytes are never written to media/.
+            # Its job copies that upload's chunks instead of parsing and embedding.
+            document = serializer.save(sha256=sha256, file=duplicate.file.name, duplicate_of=duplicate)
+        else:
+            document = serializer.save(sha256=sha256)
+        # A profiled upload (ProfilingMiddleware) profiles its ingestion job too
+        job = IngestionQueue.enqueue(document, profile=hasattr(request, 'knowledge_profile'))
+        
+        response_serializer = IngestionJobSerializer(job)
+        return Response(
+            response_serializer.data,
+            status=status.HTTP_202_ACCEPTED,
+            headers={'Location': reverse('ingestionjob-detail', args=[job.pk], request=request)}
+        )
     
-    @action(detail=True, methods=['get'])
+    @action(detail=True, methods=['get'], renderer_classes=NDJSON_RENDERER_CLASSES)
     def chunks(self, request, pk=None):
-        """Get chunks for a document"""
+        """
+        Get chunks for a document, in chunk_index order
+        
+        Pages are keyset-paginated: follow the response's next link, whose
+        cursor continues after the last chunk_index of the page.
+        
+        Query params:
+            page_size: Chunks per page, 1-1000 (default 100)
+            vectors: 'true' to include each chunk's vector
+            format: 'ndjson' (or Accept: application/x-ndjson) to stream all
+                chunks as newline-delimited JSON instead of pages
+            after: With ndjson, start after this chunk_index (to resume)
+        """
         document = self.get_object()
-        chunks = document.chunks.all()
-        serializer = ChunkSummarySerializer(chunks, many=True)
-        return Response(serializer.data)
+        include_vectors = _flag(request.query_params.get('vectors'))
+        
+        if request.accepted_renderer.format == NDJSONRenderer.format:
+            try:
+                after = int(request.query_params['after']) if request.query_params.get('after') else None
+            except ValueError:
+                return Response({'error': 'after must be an integer chunk_index'}, status=status.HTTP_400_BAD_REQUEST)
+            return _ndjson_response(ChunkExportService.iter_ndjson([document.pk], include_vectors, after=after))
+        
+        chunks = Chunk.objects.filter(document=document).select_related('document__course')
+        if not include_vectors:
+            chunks = chunks.defer('vector')
+        paginator = ChunkCursorPagination()
+        page = paginator.paginate_queryset(chunks, request, view=self)
+        serializer_class = ChunkSerializer if include_vectors else ChunkSummarySerializer
+        return paginator.get_paginated_response(serializer_class(page, many=True).data)
+
+
+class IngestionJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Ingestion Job API
+    
+    Track background document processing.
+    
+    list: Get all jobs (filter by document_id or status)
+    retrieve: Get job stage, progress and throughput
+    cancel: Cancel a queued or running job
+    retry: Re-queue a failed or cancelled job
+    embedding_cache: Embedding cache hit/miss counters
+    """
+    queryset = IngestionJob.objects.select_related('document')
+    serializer_class = IngestionJobSerializer
+    
+    def get_queryset(self):
+        queryset = IngestionJob.objects.select_related('document')
+        document_id = self.request.query_params.get('document_id')
+        if document_id:
+            queryset = queryset.filter(document_id=document_id)
+        job_status = self.request.query_params.get('status')
+        if job_status:
+            queryset = queryset.filter(status=job_status)
+        return queryset
+    
+    @action(detail=True, methods=['post'])
+    def cancel(self, request, pk=None):
+        """Cancel a queued or running job"""
+        job = self.get_object()
+        if job.is_finished:
+            return Response({'error': f'Job is already {job.status}'}, status=status.HTTP_409_CONFLICT)
+        job = IngestionQueue.cancel(job)
+        return Response(IngestionJobSerializer(job).data)
+    
+    @action(detail=True, methods=['post'])
+    def retry(self, request, pk=None):
+        """Re-queue a failed or cancelled job"""
+        job = self.get_object()
+        if job.status not in (IngestionJob.STATUS_FAILED, IngestionJob.STATUS_CANCELLED):
+            return Response({'error': f'Job is {job.status}'}, status=status.HTTP_409_CONFLICT)
+        job = IngestionQueue.retry(job)
+        return Response(IngestionJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+    
+    @action(detail=False, methods=['get'])
+    def embedding_cache(self, request):
+        """
+        Embedding cache counters.
+        
+        hits/misses count chunks served from the cache or embedded by this
+        server process since it started; entries is the current cache size.
+        Per-job counts are in each job's cache_hits and cache_misses.
+        """
+        return Response(EmbeddingCacheService.stats())
+
+
+class ReembeddingJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Re-embedding Job API
+    
+    Re-embed the chunks of a course (or of every course) in the background,
+    in checkpointed batches that pause while uploads are being ingested.
+    The new vectors replace the old ones in one transaction at the end, and
+    devices of the affected courses download a full snapshot on next sync.
+    
+    create: Queue a job (course, embedding_model, force); an unfinished
+        job with the same parameters is returned instead of a new one
+    list: Get all jobs (filter by course_id or status)
+    retrieve: Get job progress and throughput
+    cancel: Cancel a queued or running job, discarding its new vectors
+    retry: Re-queue a failed job; it resumes from its checkpoint
+    """
+    queryset = ReembeddingJob.objects.select_related('course')
+    serializer_class = ReembeddingJobSerializer
+    
+    def get_queryset(self):
+        queryset = ReembeddingJob.objects.select_related('course')
+        course_id = self.request.query_params.get('course_id')
+        if course_id:
+            queryset = queryset.filter(course_id=course_id)
+        job_status = self.request.query_params.get('status')
+        if job_status:
+            queryset = queryset.filter(status=job_status)
+        return queryset
+    
+    def create(self, request, *args, **kwargs):
+        """Queue a re-embedding job"""
+        serializer = ReembeddingRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        job = ReembeddingQueue.enqueue(**serializer.validated_data)
+        return Response(
+            ReembeddingJobSerializer(job).data,
+            status=status.HTTP_202_ACCEPTED,
+            headers={'Location': reverse('reembeddingjob-detail', args=[job.pk], request=request)}
+        )
+    
+    @action(detail=True, methods=['post'])
+    def cancel(self, request, pk=None):
+        """Cancel a queued or running job"""
+        job = self.get_object()
+        if job.is_finished:
+            return Response({'error': f'Job is already {job.status}'}, status=status.HTTP_409_CONFLICT)
+        job = ReembeddingQueue.cancel(job)
+        return Response(ReembeddingJobSerializer(job).data)
+    
+    @action(detail=True, methods=['post'])
+    def retry(self, request, pk=None):
+        """Re-queue a failed job"""
+        job = self.get_object()
+        if job.status != ReembeddingJob.STATUS_FAILED:
+            return Response({'error': f'Job is {job.status}'}, status=status.HTTP_409_CONFLICT)
+        job = ReembeddingQueue.retry(job)
+        return Response(ReembeddingJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)